@@ -0,0 +1,306 @@
+# api_server.py
+
+"""
+Servizio HTTP asincrono di RAGnova: domande (anche in streaming), indicizzazione,
+stato dei job, elenco ed eliminazione dei documenti.
+
+Il servizio è indipendente dalla UI: può girare con più worker dietro un
+load balancer, tutti sulle stesse KB su disco. Le domande usano il router dei
+modelli e gli handle condivisi delle KB del processo (riaperti quando un altro
+worker modifica la KB, vedi `core.store_cache`); le scritture passano dalla
+coda dei job (`core.ingestion_jobs`), che le serializza per KB tra i worker.
+
+Con `RAGNOVA_API_URL` l'app Streamlit diventa un client del servizio.
+
+Avvio:
+    python api_server.py [--host 0.0.0.0] [--port 8600] [--workers 4]
+oppure:
+    uvicorn api_server:app --host 0.0.0.0 --port 8600 --workers 4
+
+Con `API_TOKEN` impostato ogni richiesta (tranne `/health`) deve avere
+l'header `Authorization: Bearer <API_TOKEN>`.
+"""
+
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import validators
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from config import API_HOST, API_MAX_UPLOAD_MB, API_PORT, API_TOKEN, API_WORKERS
+from core.database import kb_storage_path, kb_upload_dir, list_user_kbs, load_or_create_chroma_db
+from core.document_manager import DocumentManager
+from core.file_server import signed_file_url
+from core.ingestion_jobs import IngestionWorker, get_job_store
+from core.llm_client import LLMBackendError
+from core.model_router import get_model_router
+from core.ollama_models import backend_model_status, warm_all_on_startup
+from core.query_metrics import QueryTrace, activate_trace, finish_trace
+
+INGESTION_WORKER = IngestionWorker(get_job_store())
+UPLOAD_WRITE_BLOCK = 1024 * 1024  # byte accumulati prima di ogni scrittura su disco
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Ogni worker esegue i job della coda condivisa e precarica i modelli locali
+    INGESTION_WORKER.start()
+    warm_all_on_startup()
+    yield
+
+
+def require_token(authorization: str = Header(default="")):
+    if API_TOKEN and not hmac.compare_digest(authorization, f"Bearer {API_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Token non valido")
+
+
+app = FastAPI(title="RAGnova API", lifespan=lifespan)
+api = APIRouter(dependencies=[Depends(require_token)])
+
+
+class QueryRequest(BaseModel):
+    question: str
+    model: Optional[str] = None
+    expertise_level: str = "expert"
+    stream: bool = False
+    conversation_history: str = ""
+    retrieval_query: Optional[str] = None
+    user: Optional[str] = None  # solo per le metriche
+
+
+class UrlRequest(BaseModel):
+    url: str
+    depth_level: int = 1
+
+
+def _kb_name(kb):
+    """Nome completo della KB (`<utente>_<kb>`), rifiutando nomi che escono dalla cartella di lavoro."""
+    if not kb or kb.startswith(".") or "/" in kb or "\\" in kb:
+        raise HTTPException(status_code=400, detail="Nome della knowledge base non valido")
+    return kb
+
+
+def _existing_kb(kb):
+    kb = _kb_name(kb)
+    if not os.path.isdir(kb_storage_path(kb)):
+        raise HTTPException(status_code=404, detail=f"Knowledge base '{kb}' non trovata")
+    return kb
+
+
+def _public_references(references):
+    """Riferimenti con i link firmati ai file, così i client non devono avere accesso al disco."""
+    public = []
+    for ref in references:
+        ref = dict(ref)
+        file_path = ref.get("file_path")
+        if file_path and not ref.get("source_url") and os.path.exists(file_path):
+            ref["file_url"] = signed_file_url(file_path)
+            ref["download_url"] = signed_file_url(file_path, download=True)
+        public.append(ref)
+    return public
+
+
+def _ndjson(event):
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+
+def _stream_events(routed, head, trace):
+    """
+    Eventi NDJSON di una risposta in streaming: "start" (backend e riferimenti),
+    un "token" per frammento, "end" con la risposta completa oppure "error".
+    """
+    yield _ndjson({"event": "start", **head})
+    answer = routed.answer
+    if isinstance(answer, str):
+        # Backend senza streaming (es. Deepseek): un solo frammento
+        yield _ndjson({"event": "token", "text": answer})
+        yield _ndjson({"event": "end", "answer": answer, "stats": None})
+        finish_trace(trace)
+        return
+    pieces = iter(answer)
+    try:
+        for piece in pieces:
+            yield _ndjson({"event": "token", "text": piece})
+        yield _ndjson({"event": "end", "answer": answer.text, "stats": answer.stats})
+    except Exception as e:
+        trace.completed = False
+        yield _ndjson({"event": "error", "error": str(e)})
+    finally:
+        # Anche se il client si disconnette: chiude lo stream e libera lo slot del modello
+        pieces.close()
+        answer.close()
+        finish_trace(trace)
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok", "worker": INGESTION_WORKER.worker_id}
+
+
+@api.get("/models")
+def models():
+    router = get_model_router()
+    status = router.status()
+    for name, backend_status in status.items():
+        backend_status["model_status"] = backend_model_status(name)
+    return status
+
+
+@api.get("/kbs")
+def knowledge_bases(user: str):
+    return {"user": user, "kbs": list_user_kbs(user)}
+
+
+@api.post("/kbs/{kb}", status_code=201)
+async def create_knowledge_base(kb: str):
+    kb = _kb_name(kb)
+    if await asyncio.to_thread(load_or_create_chroma_db, kb) is None:
+        raise HTTPException(status_code=500, detail=f"Impossibile creare la knowledge base '{kb}'")
+    return {"kb": kb}
+
+
+@api.post("/kbs/{kb}/query")
+async def query(kb: str, request: QueryRequest):
+    kb = _existing_kb(kb)
+    router = get_model_router()
+    model = request.model or router.names()[0]
+    if model not in router.names():
+        raise HTTPException(status_code=400, detail=f"Modello non registrato: {model}")
+    vector_store = await asyncio.to_thread(load_or_create_chroma_db, kb)
+    if vector_store is None:
+        raise HTTPException(status_code=503, detail=f"Knowledge base '{kb}' non disponibile")
+
+    # Nelle metriche la KB ha il nome mostrato all'utente, come nell'app
+    kb_label = kb[len(request.user) + 1:] if request.user and kb.startswith(f"{request.user}_") else kb
+    trace = QueryTrace(user=request.user, kb=kb_label, model=model)
+    with activate_trace(trace):
+        try:
+            routed = await router.route(
+                model,
+                request.question,
+                vector_store,
+                request.expertise_level,
+                request.stream,
+                conversation_history=request.conversation_history,
+                retrieval_query=request.retrieval_query,
+            )
+        except LLMBackendError as e:
+            trace.completed = False
+            finish_trace(trace)
+            raise HTTPException(status_code=503, detail=str(e))
+    trace.model = routed.backend
+
+    head = {
+        "backend": routed.backend,
+        "requested": routed.requested,
+        "skipped": routed.skipped,
+        "references": _public_references(routed.references),
+    }
+    if request.stream:
+        return StreamingResponse(_stream_events(routed, head, trace), media_type="application/x-ndjson")
+    finish_trace(trace)
+    return {**head, "answer": routed.answer}
+
+
+def _manager(kb):
+    return DocumentManager(load_or_create_chroma_db(kb), upload_dir=kb_upload_dir(kb), notify=lambda *_: None)
+
+
+@api.get("/kbs/{kb}/documents")
+async def documents(kb: str):
+    kb = _existing_kb(kb)
+    manager = await asyncio.to_thread(_manager, kb)
+    documents = await asyncio.to_thread(manager.list_documents)
+    for document in documents:
+        file_path = document.get("file_path")
+        if file_path and not document.get("source_url") and os.path.exists(file_path):
+            document["file_url"] = signed_file_url(file_path)
+    return {"kb": kb, "documents": documents}
+
+
+def _submit(kind, kb, payload):
+    job_id = get_job_store().submit(kind, kb, payload)
+    INGESTION_WORKER.wake()
+    return {"job_id": job_id, "status": "queued"}
+
+
+@api.put("/kbs/{kb}/files/{file_name}", status_code=202)
+async def upload_file(kb: str, file_name: str, request: Request):
+    """Riceve il file nel corpo della richiesta e ne accoda l'indicizzazione."""
+    kb = _kb_name(kb)
+    file_name = os.path.basename(file_name)
+    if os.path.splitext(file_name)[1].lower() not in DocumentManager.ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=415, detail=f"Tipo di file non supportato: {file_name}")
+    directory = kb_upload_dir(kb)
+    await asyncio.to_thread(os.makedirs, directory, exist_ok=True)
+    path = os.path.join(directory, file_name)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+    size = 0
+    # Le operazioni su disco girano in un thread: un upload grande non blocca l'event loop
+    f = await asyncio.to_thread(open, tmp_path, "wb")
+    try:
+        try:
+            block = bytearray()
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > API_MAX_UPLOAD_MB * 1024 * 1024:
+                    raise HTTPException(status_code=413, detail=f"File oltre {API_MAX_UPLOAD_MB} MB")
+                block += chunk
+                if len(block) >= UPLOAD_WRITE_BLOCK:
+                    await asyncio.to_thread(f.write, bytes(block))
+                    block.clear()
+            await asyncio.to_thread(f.write, bytes(block))
+        finally:
+            await asyncio.to_thread(f.close)
+        await asyncio.to_thread(os.replace, tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            await asyncio.to_thread(os.remove, tmp_path)
+    return await asyncio.to_thread(_submit, "file", kb, {"path": os.path.abspath(path)})
+
+
+@api.post("/kbs/{kb}/urls", status_code=202)
+def add_url(kb: str, request: UrlRequest):
+    kb = _kb_name(kb)
+    if not validators.url(request.url):
+        raise HTTPException(status_code=400, detail="URL non valido")
+    return _submit("url", kb, {"url": request.url, "depth_level": max(1, min(request.depth_level, 5))})
+
+
+@api.delete("/kbs/{kb}/documents/{doc_id}", status_code=202)
+def delete_document(kb: str, doc_id: str):
+    return _submit("delete", _existing_kb(kb), {"doc_id": doc_id})
+
+
+@api.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = get_job_store().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return job
+
+
+app.include_router(api)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Servizio HTTP di RAGnova.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=API_WORKERS)
+    args = parser.parse_args()
+    uvicorn.run("api_server:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
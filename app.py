@@ -1,23 +1,25 @@
 # app.py
 
 import os
-import json
-import uuid
 import logging
 import streamlit as st
 import validators
 
-from core.database import load_or_create_chroma_db
+from core.api_client import RemoteDocumentManager, RemoteKnowledgeBase, get_api_client
+from core.database import list_user_kbs, load_or_create_chroma_db
 from ui.document_interface import DocumentInterface
 from core.formatter import format_response
+from core.conversation_memory import ConversationMemory
+from core.history_store import get_history_store
+from core.llm_client import LLMBackendError, is_backend_failure
+from core.model_router import get_model_router
+from core.ollama_models import backend_model_status, warm_all_on_startup, warm_backend
+from core.query_metrics import QueryTrace, activate_trace, finish_trace
+from core.session_store import get_session_store
+from core.users import get_user_directory
+from config import ADMIN_USERS, HISTORY_MAX_ENTRIES, HISTORY_PAGE_SIZE, HISTORY_RETENTION_DAYS
 from ui.ui_components import apply_custom_css
-
-# Gestione dei token di sessione per gli utenti loggati
-SESSION_TOKENS = {}
-
-def load_users():
-    with open("users.json", "r", encoding="utf-8") as f:
-        return json.load(f)
+from ui.metrics_page import show_metrics_page
 
 class FinanceQAApp:
     def __init__(self, config_file='app_config.txt'):
@@ -33,6 +35,8 @@ class FinanceQAApp:
         self.vector_store = None
         self.doc_interface = None
         self.model_choice = None  # verrà impostato nella sidebar
+        # Con RAGNOVA_API_URL l'app è un client del servizio API: niente KB né modelli in questo processo
+        self.api = get_api_client()
 
     def load_config(self, filename):
         config = {}
@@ -49,8 +53,8 @@ class FinanceQAApp:
             st.session_state["use_previous_answer"] = False
         if "history" not in st.session_state:
             st.session_state["history"] = []
-        if "previous_answer" not in st.session_state:
-            st.session_state["previous_answer"] = ""
+        if "conversation_memory" not in st.session_state:
+            st.session_state["conversation_memory"] = ConversationMemory()
         if "current_question" not in st.session_state:
             st.session_state["current_question"] = ""
         if "logged_in" not in st.session_state:
@@ -63,27 +67,38 @@ class FinanceQAApp:
             username = st.session_state["username"]
             st.sidebar.title(self.config.get('sidebar_navigation', '📚 Navigazione'))
             st.sidebar.divider()
-            self.page = st.sidebar.radio("Vai a:", ["❓ Domande", "🗂️ Gestione Documenti"])
-
-            # Selezione del modello: Cloud, Deepseek (Locale) o Gemma (Locale)
-            model_options = ["Cloude (Antrophic)", "Deepseek (Locale)", "Gemma (Locale)"]
-            self.model_choice = st.sidebar.selectbox("Modello", model_options, index=0)
+            pages = ["❓ Domande", "🗂️ Gestione Documenti"]
+            if username in ADMIN_USERS:
+                pages.append("📊 Metriche")
+            self.page = st.sidebar.radio("Vai a:", pages)
+
+            # Selezione del modello tra i backend registrati nel router
+            router = get_model_router()
+            self.model_choice = st.sidebar.selectbox(
+                "Modello", router.names(), index=0, format_func=router.label
+            )
+            # Precarica il modello locale appena selezionato, prima della prima domanda
+            # (in modalità client i modelli vengono precaricati dal servizio API)
+            if not self.api:
+                if st.session_state.get("warmed_model") != self.model_choice:
+                    warm_backend(self.model_choice)
+                    st.session_state["warmed_model"] = self.model_choice
+                self.show_model_status(self.model_choice)
 
             st.session_state["use_previous_answer"] = st.sidebar.checkbox(
                 "Usa contesto della risposta precedente",
                 value=st.session_state["use_previous_answer"],
-                help="Includi la risposta precedente come contesto."
+                help="Includi le domande e le risposte precedenti come contesto."
             )
             if not st.session_state["use_previous_answer"]:
-                st.session_state["previous_answer"] = ""
+                st.session_state["conversation_memory"].clear()
 
             self.select_knowledge_base(username)
             st.sidebar.divider()
             self.display_history_in_sidebar()
             st.sidebar.divider()
 
-            query_params = st.query_params
-            token = query_params.get("token", [None])[0]
+            token = st.query_params.get("token")
             col_user, col_logout = st.sidebar.columns([2, 1])
             with col_user:
                 st.markdown(
@@ -99,25 +114,41 @@ class FinanceQAApp:
 
     def display_history_in_sidebar(self):
         st.sidebar.markdown(f"### {self.config.get('sidebar_history', '📜 Cronologia delle Domande')}")
-        if st.session_state["history"]:
-            for i, entry in enumerate(reversed(st.session_state["history"])):
+        username = st.session_state["username"]
+        if st.session_state.get("history_user") != username:
+            self.load_user_history(username)
+        # Solo le voci più recenti (o i risultati della ricerca), non l'intera cronologia
+        search = st.sidebar.text_input("Cerca nella cronologia", key="history_search")
+        if search:
+            entries = get_history_store().search(username, search, limit=HISTORY_PAGE_SIZE)
+        else:
+            entries = list(reversed(st.session_state["history"]))
+        if entries:
+            for entry in entries:
                 with st.sidebar.expander(f"❓ {entry['question']}", expanded=False):
                     st.markdown(f"**Risposta:** {entry['answer']}")
                     if entry["references"]:
                         st.markdown("**Riferimenti:**")
                         for source, name in entry["references"]:
                             st.markdown(f"- **{name}** ({source})")
-                    if st.button("Usa", key=f"history_button_{i}"):
+                    if st.button("Usa", key=f"history_button_{entry['id']}"):
                         st.session_state["current_question"] = entry["question"]
+            if not search and st.session_state.get("history_has_more"):
+                if st.sidebar.button("Mostra precedenti", key="history_more"):
+                    self.load_older_history(username)
+                    st.rerun()
+        elif search:
+            st.sidebar.info("Nessuna domanda trovata.")
         else:
             st.sidebar.info("La cronologia è vuota.")
 
     def handle_user_login(self):
-        query_params = st.query_params
-        token = query_params.get("token", [None])[0]
-        if token and token in SESSION_TOKENS:
+        # Sessione condivisa tra i processi dell'app: il token dell'URL vale su qualunque worker
+        token = st.query_params.get("token")
+        session_user = get_session_store().get(token) if token else None
+        if session_user:
             st.session_state["logged_in"] = True
-            st.session_state["username"] = SESSION_TOKENS[token]
+            st.session_state["username"] = session_user
         else:
             if "logged_in" not in st.session_state:
                 st.session_state["logged_in"] = False
@@ -130,40 +161,32 @@ class FinanceQAApp:
                 password = st.text_input("Password", type="password").strip()
                 submit_button = st.form_submit_button("Login")
             if submit_button:
-                users = load_users()
-                normalized_users = {key.upper(): value.strip() for key, value in users.items()}
-                if username in normalized_users and password == normalized_users[username]:
+                if get_user_directory().authenticate(username, password):
                     st.session_state["logged_in"] = True
                     st.session_state["username"] = username
                     self.load_user_history(username)
-                    session_token = str(uuid.uuid4())
-                    SESSION_TOKENS[session_token] = username
-                    st.query_params = {"token": session_token}
+                    st.query_params = {"token": get_session_store().create(username)}
                 else:
                     st.error("Credenziali non valide.")
             st.stop()
 
     def load_user_history(self, username):
-        user_history_file = f"chat_log_{username}.txt"
-        if os.path.exists(user_history_file):
-            with open(user_history_file, "r", encoding="utf-8") as f:
-                lines = f.readlines()
-            history = []
-            for line in lines:
-                try:
-                    entry = json.loads(line.strip())
-                    history.append(entry)
-                except:
-                    pass
-            st.session_state["history"] = history
-        else:
-            st.session_state["history"] = []
-
-    def save_user_history(self, username):
-        user_history_file = f"chat_log_{username}.txt"
-        with open(user_history_file, "w", encoding="utf-8") as f:
-            for entry in st.session_state["history"]:
-                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        # Importa il vecchio chat_log_<utente>.txt, applica la retention e carica solo la pagina più recente
+        store = get_history_store()
+        store.import_legacy_log(username)
+        if HISTORY_RETENTION_DAYS or HISTORY_MAX_ENTRIES:
+            store.apply_retention(username, HISTORY_RETENTION_DAYS or None, HISTORY_MAX_ENTRIES or None)
+        page = store.page(username, limit=HISTORY_PAGE_SIZE)
+        st.session_state["history"] = list(reversed(page))
+        st.session_state["history_has_more"] = len(page) == HISTORY_PAGE_SIZE
+        st.session_state["history_user"] = username
+
+    def load_older_history(self, username):
+        history = st.session_state["history"]
+        before_id = history[0]["id"] if history else None
+        page = get_history_store().page(username, limit=HISTORY_PAGE_SIZE, before_id=before_id)
+        st.session_state["history"] = list(reversed(page)) + history
+        st.session_state["history_has_more"] = len(page) == HISTORY_PAGE_SIZE
 
     def log_interaction(self, question, context, formatted_context, answer, history):
         logging.info("Domanda: %s", question)
@@ -176,29 +199,39 @@ class FinanceQAApp:
         unique_references = {}
         for ref in references:
             source = ref.get("source_url", ref.get("file_path", "Sconosciuto"))
-            unique_references[source] = ref.get("file_name", "Web Content")
+            unique_references[source] = ref.get("title") or ref.get("file_name", "Web Content")
+        references = list(unique_references.items())
+        entry_id = get_history_store().append(
+            st.session_state["username"], question, answer, references,
+            kb=st.session_state.get("selected_kb"), model=self.model_choice
+        )
         history_entry = {
+            "id": entry_id,
             "question": question,
             "answer": answer,
-            "references": list(unique_references.items())
+            "references": references
         }
         st.session_state["history"].append(history_entry)
 
     def logout_user(self, token):
-        if token and token in SESSION_TOKENS:
-            del SESSION_TOKENS[token]
+        get_session_store().delete(token)
         st.query_params = {}
         st.session_state["logged_in"] = False
         st.session_state["username"] = None
         st.session_state["history"] = []
+        st.session_state["history_user"] = None
+        st.session_state["conversation_memory"].clear()
         st.rerun()
 
     def select_knowledge_base(self, username):
-        kb_list = [
-            name.replace(f"chroma_{username}_", "")
-            for name in os.listdir(".")
-            if name.startswith(f"chroma_{username}_")
-        ]
+        if self.api:
+            try:
+                kb_list = self.api.list_kbs(username)
+            except LLMBackendError as e:
+                st.sidebar.error(f"Servizio API non disponibile: {e}")
+                kb_list = []
+        else:
+            kb_list = list_user_kbs(username)
         st.session_state["knowledge_bases"] = kb_list
         if "selected_kb" not in st.session_state:
             st.session_state["selected_kb"] = kb_list[0] if kb_list else None
@@ -218,9 +251,33 @@ class FinanceQAApp:
     def load_vector_store(self, username):
         if st.session_state['selected_kb']:
             full_kb_name = f"{username}_{st.session_state['selected_kb']}"
+            if self.api:
+                return RemoteKnowledgeBase(self.api, full_kb_name)
             return load_or_create_chroma_db(full_kb_name)
         return None
 
+    def open_remote_kb(self, full_kb_name):
+        """Crea (se non esiste) la KB nel servizio API; usato da `DocumentInterface` in modalità client."""
+        self.api.create_kb(full_kb_name)
+        return RemoteKnowledgeBase(self.api, full_kb_name)
+
+    def model_label(self, name):
+        router = get_model_router()
+        return router.label(name) if name in router.names() else name
+
+    def route_question(self, question, expertise_level, conversation_history, retrieval_query):
+        """Risposta in streaming alla domanda, dal router dei modelli o dal servizio API."""
+        options = {"conversation_history": conversation_history, "retrieval_query": retrieval_query}
+        if self.api:
+            return self.api.query(
+                self.vector_store.name, question, self.model_choice, expertise_level,
+                stream=True, user=st.session_state["username"], **options
+            )
+        return get_model_router().answer(
+            self.model_choice, question, self.vector_store,
+            expertise_level=expertise_level, stream=True, **options
+        )
+
     def load_web_content(self, url):
         try:
             from langchain_community.document_loaders import WebBaseLoader
@@ -268,72 +325,107 @@ class FinanceQAApp:
             self.doc_interface.add_web_document(question)
             st.success("Contenuto web caricato correttamente.")
         elif self.vector_store and question:
-            if st.session_state["use_previous_answer"] and st.session_state["previous_answer"]:
-                question_with_context = (
-                    f"{st.session_state['previous_answer']}\n\nDomanda attuale: {question}"
-                )
-            else:
-                question_with_context = question
-
-            # Seleziona il modello in base alla scelta
-            if self.model_choice == "Cloude (Antrophic)":
-                from core.retriever import query_rag_with_cloud
-                answer, references = query_rag_with_cloud(
-                    question_with_context,
-                    self.vector_store,
-                    expertise_level=expertise_level
-                )
-            elif self.model_choice == "Deepseek (Locale)":
-                from core.retriever_deepseek import query_rag_with_deepseek
-                answer, references = query_rag_with_deepseek(
-                    question_with_context,
-                    self.vector_store,
-                    expertise_level=expertise_level
-                )
-            elif self.model_choice == "Gemma (Locale)":
-                from core.retriever_gemma import query_rag_with_gemma
-                answer, references = query_rag_with_gemma(
-                    question_with_context,
-                    self.vector_store,
-                    expertise_level=expertise_level
-                )
+            # Memoria della conversazione: ultimi turni e riepilogo dei precedenti nel prompt,
+            # domanda resa autonoma per il retrieval
+            memory = st.session_state["conversation_memory"]
+            if st.session_state["use_previous_answer"]:
+                conversation_history = memory.render()
+                retrieval_query = memory.standalone_query(question)
             else:
-                answer = "Modello non selezionato correttamente."
-                references = []
-
-            format_response(answer, references, self.doc_interface.doc_manager)
+                conversation_history = ""
+                retrieval_query = question
+
+            # Traccia della domanda: tempi delle fasi, token e costo (vedi pagina Metriche);
+            # in modalità client la traccia viene registrata dal servizio API
+            trace = QueryTrace(
+                user=st.session_state["username"],
+                kb=st.session_state.get("selected_kb"),
+                model=self.model_choice
+            )
+            with activate_trace(trace):
+                # Il router sceglie il backend (con fallback se saturo o non disponibile)
+                try:
+                    routed = self.route_question(question, expertise_level, conversation_history, retrieval_query)
+                except LLMBackendError as e:
+                    trace.completed = False
+                    if not self.api:
+                        finish_trace(trace)
+                    st.error(f"Errore durante la generazione della risposta: {e}")
+                    return
+                trace.model = routed.backend
+                if routed.fallback:
+                    st.info(
+                        f"{self.model_label(routed.requested)} non disponibile: "
+                        f"risposta generata con {self.model_label(routed.backend)}."
+                    )
+                answer, references = routed.answer, routed.references
+
+                # Con i modelli in streaming la risposta completa è disponibile a fine stream
+                try:
+                    answer = format_response(answer, references, self.doc_interface.doc_manager)
+                except Exception as e:
+                    # Stream interrotto dopo l'avvio: non c'è più un fallback possibile
+                    if not isinstance(e, LLMBackendError) and not is_backend_failure(e):
+                        raise
+                    trace.completed = False
+                    if not self.api:
+                        finish_trace(trace)
+                    st.error(f"Errore durante la generazione della risposta: {e}")
+                    return
+            if not self.api:
+                finish_trace(trace)
             self.add_to_history(question, answer, references)
-            self.save_user_history(st.session_state["username"])
             self.log_interaction(
                 question,
-                question_with_context,
-                question_with_context,
+                retrieval_query,
+                conversation_history,
                 answer,
                 st.session_state["history"]
             )
 
             if st.session_state["use_previous_answer"]:
-                st.session_state["previous_answer"] = answer
+                memory.add_turn(question, answer)
 
             st.session_state["current_question"] = ""
             st.divider()
         elif not self.vector_store:
             st.warning("🚨 Nessuna knowledge base disponibile. Carica un documento nella sezione 'Gestione Documenti'.")
 
+    def show_model_status(self, name):
+        status = backend_model_status(name)
+        if status is None:
+            return
+        if status["loaded"]:
+            st.sidebar.caption("🟢 Modello caricato in memoria")
+        elif status["loading"]:
+            st.sidebar.caption("🟡 Caricamento del modello in corso...")
+        else:
+            st.sidebar.caption("⚪ Modello non in memoria: la prima risposta sarà più lenta")
+
     def run(self):
+        # Modelli locali precaricati una volta per processo, in background
+        if not self.api:
+            warm_all_on_startup()
         self.handle_user_login()
         if st.session_state["logged_in"]:
             self.setup_sidebar()
             username = st.session_state["username"]
             self.vector_store = self.load_vector_store(username)
             if not self.doc_interface:
-                self.doc_interface = DocumentInterface(self.vector_store)
+                if self.api:
+                    self.doc_interface = DocumentInterface(
+                        self.vector_store, kb_loader=self.open_remote_kb, manager_factory=RemoteDocumentManager
+                    )
+                else:
+                    self.doc_interface = DocumentInterface(self.vector_store)
             else:
                 self.doc_interface.update_vector_store(self.vector_store)
             if self.page == "❓ Domande":
                 self.handle_questions_page()
             elif self.page == "🗂️ Gestione Documenti":
                 self.handle_documents_page()
+            elif self.page == "📊 Metriche" and username in ADMIN_USERS:
+                show_metrics_page()
 
     @staticmethod
     def main():
@@ -7,3 +7,109 @@ load_dotenv(find_dotenv(), override=True)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 DEFAULT_MODEL = os.getenv("DEFAULT_MODEL")
+
+# Backend dei vettori per le nuove knowledge base: "chroma" oppure "hnsw"
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+
+# Handle dei vector store condivisi dal processo: memoria stimata massima (MB) e
+# inattività minima (secondi) prima che una KB possa uscire dalla cache
+VECTOR_STORE_CACHE_MB = int(os.getenv("VECTOR_STORE_CACHE_MB", "2048"))
+VECTOR_STORE_IDLE_SECONDS = float(os.getenv("VECTOR_STORE_IDLE_SECONDS", "300"))
+
+# Budget di token del contesto RAG per modello (documenti recuperati inseriti nel prompt)
+CONTEXT_TOKEN_BUDGETS = {
+    "cloud": int(os.getenv("CONTEXT_BUDGET_CLOUD", "6000")),
+    "gemma": int(os.getenv("CONTEXT_BUDGET_GEMMA", "3000")),
+}
+
+# HyDE speculativo (pipeline Deepseek): attesa massima della risposta ipotetica in secondi,
+# generazioni contemporanee e cache delle risposte ipotetiche (voci, durata in secondi)
+HYDE_DEADLINE = float(os.getenv("HYDE_DEADLINE", "3"))
+HYDE_MAX_WORKERS = int(os.getenv("HYDE_MAX_WORKERS", "2"))
+HYDE_CACHE_SIZE = int(os.getenv("HYDE_CACHE_SIZE", "256"))
+HYDE_CACHE_TTL = float(os.getenv("HYDE_CACHE_TTL", "86400"))
+
+# Memoria della conversazione: turni conservati testualmente, loro budget di token
+# e budget del riepilogo dei turni più vecchi
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "3"))
+MEMORY_MAX_TOKENS = int(os.getenv("MEMORY_MAX_TOKENS", "1500"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "400"))
+
+# Cronologia delle domande: database, voci per pagina nella sidebar e retention
+# (giorni e voci per utente, 0 = nessun limite) applicata all'accesso dell'utente
+CHAT_HISTORY_DB = os.getenv("CHAT_HISTORY_DB", "chat_history.sqlite")
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "0"))
+HISTORY_MAX_ENTRIES = int(os.getenv("HISTORY_MAX_ENTRIES", "0"))
+
+# Sessioni di accesso condivise tra i processi dell'app: backend ("sqlite", "memory" o "modulo:Classe"),
+# database e durata in secondi senza attività; file delle credenziali (riletto solo quando cambia)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")
+SESSION_DB = os.getenv("SESSION_DB", "sessions.sqlite")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(12 * 3600)))
+USERS_FILE = os.getenv("USERS_FILE", "users.json")
+
+# Registro delle knowledge base (proprietario, dimensioni, versione, ultimo accesso)
+KB_REGISTRY_DB = os.getenv("KB_REGISTRY_DB", "kb_registry.sqlite")
+
+# Cache persistente dei titoli delle pagine web (fallback per i chunk senza `page_title`)
+WEB_TITLE_CACHE_DB = os.getenv("WEB_TITLE_CACHE_DB", "web_titles.sqlite")
+
+# Endpoint dei documenti di riferimento (link firmati, richieste Range): indirizzo di ascolto,
+# URL pubblico usato nei link, cartelle servibili (separate da virgola) e validità dei link
+FILE_SERVER_HOST = os.getenv("FILE_SERVER_HOST", "127.0.0.1")
+FILE_SERVER_PORT = int(os.getenv("FILE_SERVER_PORT", "8502"))
+FILE_SERVER_PUBLIC_URL = os.getenv("FILE_SERVER_PUBLIC_URL", f"http://localhost:{FILE_SERVER_PORT}")
+FILE_SERVER_ROOTS = [root.strip() for root in os.getenv("FILE_SERVER_ROOTS", "uploaded_documents").split(",") if root.strip()]
+FILE_SERVER_SECRET = os.getenv("FILE_SERVER_SECRET")
+FILE_LINK_TTL = int(os.getenv("FILE_LINK_TTL", "3600"))
+
+# Servizio API (`api_server.py`): indirizzo, worker, token richiesto ai client (vuoto = nessun
+# controllo, solo per l'ascolto locale), coda dei job di indicizzazione e dimensione massima degli upload
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8600"))
+API_WORKERS = int(os.getenv("API_WORKERS", "2"))
+API_TOKEN = os.getenv("API_TOKEN", "")
+API_JOBS_DB = os.getenv("API_JOBS_DB", "ingestion_jobs.sqlite")
+API_INGEST_THREADS = int(os.getenv("API_INGEST_THREADS", "1"))
+# Un job "running" il cui worker non dà segni di vita (heartbeat) da API_JOB_STALE_SECONDS è considerato interrotto
+API_JOB_HEARTBEAT_SECONDS = float(os.getenv("API_JOB_HEARTBEAT_SECONDS", "15"))
+API_JOB_STALE_SECONDS = float(os.getenv("API_JOB_STALE_SECONDS", "120"))
+API_MAX_UPLOAD_MB = int(os.getenv("API_MAX_UPLOAD_MB", "200"))
+# URL del servizio API: se impostato l'app Streamlit ne è un client (domande e documenti
+# passano dal servizio) invece di aprire direttamente KB e modelli
+RAGNOVA_API_URL = os.getenv("RAGNOVA_API_URL", "")
+
+# Server Ollama dei modelli locali
+DEEPSEEK_OLLAMA_HOST = os.getenv("DEEPSEEK_OLLAMA_HOST", "http://localhost:11434")
+GEMMA_OLLAMA_HOST = os.getenv("GEMMA_OLLAMA_HOST", "http://127.0.0.1:11436")
+DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-r1:7b")
+GEMMA_MODEL = os.getenv("GEMMA_MODEL", "gemma3:latest")
+
+# Permanenza in memoria dei modelli Ollama dopo l'ultima richiesta ("30m", "2h", "-1" = sempre)
+# e precaricamento all'avvio e alla selezione del modello
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_PRELOAD = os.getenv("OLLAMA_PRELOAD", "1").lower() in ("1", "true", "yes")
+
+# Client dei modelli: timeout (secondi), retry e richieste contemporanee per backend
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "3.05"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+ANTHROPIC_MAX_CONCURRENCY = int(os.getenv("ANTHROPIC_MAX_CONCURRENCY", "8"))
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+
+# Router dei modelli: backend provati, in ordine, se quello scelto è saturo o non disponibile
+# (di default solo i modelli locali, così i documenti non vengono inviati al cloud senza una scelta esplicita)
+MODEL_FALLBACK_ORDER = [name.strip() for name in os.getenv("MODEL_FALLBACK_ORDER", "gemma,deepseek").split(",") if name.strip()]
+ROUTER_MAX_QUEUE = int(os.getenv("ROUTER_MAX_QUEUE", "8"))
+ROUTER_QUEUE_TIMEOUT = float(os.getenv("ROUTER_QUEUE_TIMEOUT", "30"))
+# Backend deterministico per test e benchmark
+ENABLE_STUB_MODEL = os.getenv("ENABLE_STUB_MODEL", "false").lower() in ("1", "true", "yes")
+
+# Metriche per domanda (tempi delle fasi, token, costo) e utenti che possono consultarle
+QUERY_METRICS_DB = os.getenv("QUERY_METRICS_DB", "query_metrics.sqlite")
+ADMIN_USERS = {name.strip().upper() for name in os.getenv("ADMIN_USERS", "admin").split(",") if name.strip()}
+# Prezzi in USD per milione di token (input, output); i modelli locali non hanno costo
+MODEL_PRICES = {
+    "claude-3-5-sonnet-20240620": (3.0, 15.0),
+}
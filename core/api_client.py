@@ -0,0 +1,280 @@
+# api_client.py
+
+"""
+Client del servizio API (`api_server.py`), usato dall'app Streamlit quando
+`RAGNOVA_API_URL` è impostato.
+
+In questa modalità l'app non apre KB né modelli: le domande, l'elenco dei
+documenti, gli upload e le eliminazioni passano dal servizio. `RemoteKnowledgeBase`
+prende il posto del vector store e `RemoteDocumentManager` quello del
+`DocumentManager`, con la stessa interfaccia usata da `DocumentInterface`.
+"""
+
+import json
+import os
+import threading
+import time
+from urllib.parse import quote
+
+import requests
+import streamlit as st
+import validators
+
+from config import API_TOKEN, LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT, RAGNOVA_API_URL
+from core.document_manager import DocumentManager, document_row, streamlit_notify
+from core.llm_client import LLMBackendError
+from core.model_router import RoutedAnswer
+
+
+class APIError(LLMBackendError):
+    """Errore restituito dal servizio API, o servizio non raggiungibile."""
+
+
+def _segment(value):
+    """Valore quotato per un segmento del percorso (nomi con `#`, `?`, `%` o `/`)."""
+    return quote(str(value), safe="")
+
+
+class RemoteStreamingAnswer:
+    """
+    Risposta in streaming ricevuta dal servizio (eventi NDJSON). Come `StreamingAnswer`
+    si consuma una sola volta e, a fine stream, espone `text` e `stats`.
+    """
+
+    def __init__(self, response, events):
+        self.text = ""
+        self.stats = None
+        self._response = response
+        self._events = events
+
+    def __iter__(self):
+        parts, ended = [], False
+        try:
+            try:
+                for event in self._events:
+                    if event["event"] == "token":
+                        parts.append(event["text"])
+                        yield event["text"]
+                    elif event["event"] == "end":
+                        self.stats = event.get("stats")
+                        ended = True
+                    elif event["event"] == "error":
+                        raise APIError(event["error"])
+            except (requests.RequestException, ValueError) as e:
+                # Connessione caduta o riga NDJSON troncata a metà risposta
+                raise APIError(f"Risposta del servizio interrotta: {e}")
+            if not ended:
+                raise APIError("Risposta del servizio interrotta prima della fine.")
+        finally:
+            self.text = "".join(parts)
+            self._response.close()
+
+    def close(self):
+        self._response.close()
+
+    def __str__(self):
+        return self.text
+
+
+class APIClient:
+    """
+    Client HTTP del servizio, con connessioni keep-alive condivise.
+
+    Parameters:
+    - base_url (str): URL del servizio (es. "http://localhost:8600").
+    - token (str): Token del servizio (`API_TOKEN`), se richiesto.
+    """
+
+    def __init__(self, base_url=RAGNOVA_API_URL, token=API_TOKEN):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT)
+        self.session = requests.Session()
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def _request(self, method, path, **kwargs):
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise APIError(f"Servizio API non raggiungibile: {e}")
+        if response.status_code >= 400:
+            try:
+                detail = response.json().get("detail")
+            except ValueError:
+                detail = response.text
+            response.close()
+            raise APIError(detail or f"Errore del servizio API ({response.status_code})")
+        return response
+
+    def list_kbs(self, user):
+        return self._request("GET", "/kbs", params={"user": user}).json()["kbs"]
+
+    def create_kb(self, kb):
+        self._request("POST", f"/kbs/{_segment(kb)}")
+
+    def query(self, kb, question, model=None, expertise_level="expert", stream=False, user=None, **options):
+        """
+        Domanda sulla KB. Con `stream=True` attende solo l'evento iniziale (backend e
+        riferimenti) e restituisce la risposta come `RemoteStreamingAnswer`.
+
+        Returns:
+        - RoutedAnswer: Come `ModelRouter.answer`.
+        """
+        body = {"question": question, "model": model, "expertise_level": expertise_level,
+                "stream": stream, "user": user, **options}
+        response = self._request("POST", f"/kbs/{_segment(kb)}/query", json=body, stream=stream)
+        if not stream:
+            data = response.json()
+            return RoutedAnswer(data["answer"], data["references"], data["backend"], data["requested"],
+                                data["skipped"])
+        events = (json.loads(line) for line in response.iter_lines(decode_unicode=True) if line)
+        try:
+            start = next(events, None)
+        except (requests.RequestException, ValueError) as e:
+            response.close()
+            raise APIError(f"Risposta del servizio interrotta: {e}")
+        if start is None or start["event"] != "start":
+            response.close()
+            raise APIError(start["error"] if start and start.get("error") else "Risposta del servizio non valida")
+        return RoutedAnswer(RemoteStreamingAnswer(response, events), start["references"], start["backend"],
+                            start["requested"], start["skipped"])
+
+    def list_documents(self, kb):
+        return self._request("GET", f"/kbs/{_segment(kb)}/documents").json()["documents"]
+
+    def upload_file(self, kb, file_path):
+        with open(file_path, "rb") as f:
+            return self._request("PUT", f"/kbs/{_segment(kb)}/files/{_segment(os.path.basename(file_path))}", data=f).json()
+
+    def add_url(self, kb, url, depth_level=1):
+        return self._request("POST", f"/kbs/{_segment(kb)}/urls", json={"url": url, "depth_level": depth_level}).json()
+
+    def delete_document(self, kb, doc_id):
+        return self._request("DELETE", f"/kbs/{_segment(kb)}/documents/{_segment(doc_id)}").json()
+
+    def job(self, job_id):
+        return self._request("GET", f"/jobs/{_segment(job_id)}").json()
+
+    def wait_job(self, job_id, timeout=600, poll_interval=0.5):
+        """Attende la fine del job e ne restituisce lo stato finale."""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.job(job_id)
+            if job["status"] in ("done", "failed"):
+                return job
+            if time.monotonic() > deadline:
+                raise APIError(f"Il job {job_id} non è terminato entro {timeout} secondi.")
+            time.sleep(poll_interval)
+
+
+class RemoteKnowledgeBase:
+    """KB del servizio API: prende il posto del vector store nell'app in modalità client."""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.path = f"api:{name}"  # chiave dello stato della KB, come `VectorStore.path`
+
+
+class RemoteDocumentManager:
+    """
+    Operazioni sui documenti di una `RemoteKnowledgeBase`, con l'interfaccia di
+    `DocumentManager` usata da `DocumentInterface`. Upload ed eliminazioni
+    attendono la fine del job e ne riportano i messaggi.
+    """
+
+    ALLOWED_EXTENSIONS = DocumentManager.ALLOWED_EXTENSIONS
+
+    def __init__(self, vector_store, upload_dir="uploaded_documents", notify=None):
+        self.vector_store = vector_store
+        self.upload_dir = upload_dir
+        self.notify = notify or streamlit_notify
+        self.state = {} if notify else st.session_state
+        self._documents = None
+
+    def _kb_key(self):
+        return f"document_names_{self.vector_store.path}"
+
+    def _run(self, submitted):
+        try:
+            job = self.vector_store.client.wait_job(submitted["job_id"])
+        except APIError as e:
+            self.notify("error", str(e))
+            return {}
+        for message in job["messages"]:
+            self.notify(message["level"], message["message"])
+        if job["error"]:
+            self.notify("error", f"Errore durante l'elaborazione: {job['error']}")
+        self._documents = None
+        return job.get("result") or {}
+
+    def add_document(self, file_path_or_url, chunk_size=1024, chunk_overlap=128):
+        if isinstance(file_path_or_url, list):
+            return [self.add_document(single_path, chunk_size, chunk_overlap) for single_path in file_path_or_url]
+        if validators.url(file_path_or_url):
+            return self.add_web_document(file_path_or_url, chunk_size, chunk_overlap)
+        try:
+            submitted = self.vector_store.client.upload_file(self.vector_store.name, file_path_or_url)
+        except APIError as e:
+            self.notify("error", f"Errore durante il caricamento di '{os.path.basename(file_path_or_url)}': {e}")
+            return None
+        return self._run(submitted).get("doc_id")
+
+    def add_web_document(self, url, chunk_size=1024, chunk_overlap=128, depth_level=1):
+        try:
+            submitted = self.vector_store.client.add_url(self.vector_store.name, url, depth_level)
+        except APIError as e:
+            self.notify("error", f"Errore durante l'aggiunta del documento web: {e}")
+            return None
+        return self._run(submitted).get("doc_id")
+
+    def list_documents(self):
+        if self._documents is None:
+            self._documents = self.vector_store.client.list_documents(self.vector_store.name)
+        return self._documents
+
+    def load_existing_documents(self):
+        self.state[self._kb_key()] = {
+            document["doc_id"]: {
+                "file_name": document["file_name"],
+                "file_path": document.get("file_path"),
+                "file_url": document.get("file_url"),
+            }
+            for document in self.list_documents()
+        }
+
+    def get_document_metadata(self):
+        return [document_row(document) for document in self.list_documents()]
+
+    def delete_document(self, doc_id):
+        try:
+            submitted = self.vector_store.client.delete_document(self.vector_store.name, doc_id)
+        except APIError as e:
+            self.notify("error", f"Errore durante l'eliminazione del documento: {e}")
+            return False
+        deleted = bool(self._run(submitted).get("deleted"))
+        if deleted:
+            self.state.get(self._kb_key(), {}).pop(doc_id, None)
+            self.state["refresh_counter"] = self.state.get("refresh_counter", 0) + 1
+        return deleted
+
+    def get_document_path(self, doc_id):
+        return self.state.get(self._kb_key(), {}).get(doc_id, {}).get("file_path")
+
+    def get_document_url(self, doc_id):
+        return self.state.get(self._kb_key(), {}).get(doc_id, {}).get("file_url")
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_api_client():
+    """Client condiviso dal processo, oppure None se l'app non usa il servizio API."""
+    global _client
+    if not RAGNOVA_API_URL:
+        return None
+    with _client_lock:
+        if _client is None:
+            _client = APIClient()
+        return _client
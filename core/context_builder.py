@@ -0,0 +1,194 @@
+# context_builder.py
+
+"""
+Assemblaggio del contesto RAG entro un budget di token.
+
+I risultati del retriever vengono:
+- deduplicati (chunk identici o contenuti in un chunk già scelto);
+- raggruppati per documento (`doc_id`, e pagina per i contenuti web) e
+  ordinati per `chunk_index`, l'ordinale assegnato in fase di caricamento,
+  così i chunk adiacenti vengono uniti eliminando le parti sovrapposte;
+- inseriti in ordine di rilevanza finché il budget lo consente, troncando
+  l'ultimo chunk se necessario;
+- estesi, se avanza budget, con i chunk vicini a quelli scelti.
+
+I token sono contati con tiktoken; se non è disponibile si usa una stima
+di 4 caratteri per token.
+"""
+
+import threading
+
+from core.query_metrics import stage
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 2000
+MIN_TRUNCATED_TOKENS = 64
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                _encoding = False  # tiktoken assente o vocabolario non scaricabile: stima
+    return _encoding
+
+
+def count_tokens(text):
+    """Numero di token del testo (stima se tiktoken non è disponibile)."""
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Tronca il testo ai primi `max_tokens` token."""
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def _fingerprint(text):
+    return " ".join(text.split()).lower()
+
+
+def _strip_overlap(previous, text):
+    """Rimuove dall'inizio di `text` la parte che ripete la fine di `previous`."""
+    tail = previous[-MAX_OVERLAP_CHARS:]
+    probe = text[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return text
+    start = tail.find(probe)
+    while start != -1:
+        # La prima occorrenza valida corrisponde alla sovrapposizione più lunga
+        if text.startswith(tail[start:]):
+            return text[len(tail) - start:]
+        start = tail.find(probe, start + 1)
+    return text
+
+
+def _group_key(doc, position):
+    metadata = doc.metadata or {}
+    if metadata.get("doc_id") is None or metadata.get("chunk_index") is None:
+        return (None, position)  # KB caricate prima degli ordinali: nessuna unione
+    return (metadata["doc_id"], metadata.get("source_url"))
+
+
+class _Group:
+    def __init__(self, key):
+        self.key = key
+        self.chunks = {}  # chunk_index (o posizione) -> testo
+
+    def render(self):
+        parts, previous_index = [], None
+        for index in sorted(self.chunks):
+            text = self.chunks[index]
+            if parts and previous_index == index - 1:
+                parts[-1] = parts[-1] + "\n" + _strip_overlap(parts[-1], text)
+            else:
+                parts.append(text)
+            previous_index = index
+        return "\n\n[...]\n\n".join(parts)
+
+
+def _fetch_neighbors(vector_store, group, expand):
+    doc_id, source_url = group.key
+    wanted = sorted({
+        index + offset
+        for index in group.chunks
+        for offset in range(-expand, expand + 1)
+        if index + offset >= 0 and index + offset not in group.chunks
+    })
+    if not wanted:
+        return []
+    found = vector_store.get(
+        where={"$and": [{"doc_id": doc_id}, {"chunk_index": {"$in": wanted}}]},
+        include=["documents", "metadatas"],
+    )
+    neighbors = []
+    for text, metadata in zip(found["documents"], found["metadatas"]):
+        if text and (metadata or {}).get("source_url") == source_url:
+            neighbors.append((metadata["chunk_index"], text.strip()))
+    return neighbors
+
+
+def build_context(results, budget_tokens, vector_store=None, expand_neighbors=1, separator=CONTEXT_SEPARATOR):
+    """
+    Costruisce il contesto del prompt a partire dai risultati del retriever.
+
+    Parameters:
+    - results (list): Lista di (Document, punteggio) in ordine di rilevanza.
+    - budget_tokens (int): Numero massimo di token del contesto.
+    - vector_store: Vector store della KB, usato per recuperare i chunk vicini (opzionale).
+    - expand_neighbors (int): Quanti chunk prima e dopo ogni chunk scelto aggiungere se avanza budget.
+    - separator (str): Separatore tra i blocchi di documenti diversi.
+
+    Returns:
+    - dict: "text" (contesto), "sources" (Document dei risultati usati, per i riferimenti),
+      "tokens" (token del contesto) e "truncated" (True se un chunk è stato troncato).
+    """
+    with stage("context"):
+        return _build_context(results, budget_tokens, vector_store, expand_neighbors, separator)
+
+
+def _build_context(results, budget_tokens, vector_store, expand_neighbors, separator):
+    separator_tokens = count_tokens(separator)
+    groups, sources, seen = {}, [], []
+    used, truncated = 0, False
+
+    for position, (doc, _) in enumerate(results):
+        text = (doc.page_content or "").strip()
+        fingerprint = _fingerprint(text)
+        if not fingerprint or any(fingerprint in other for other in seen):
+            continue
+
+        key = _group_key(doc, position)
+        cost = count_tokens(text) + (0 if key in groups else separator_tokens)
+        if used + cost > budget_tokens:
+            remaining = budget_tokens - used - separator_tokens
+            # Un chunk troppo grande viene troncato solo se resta spazio utile
+            if remaining < MIN_TRUNCATED_TOKENS and sources:
+                continue
+            text = truncate_to_tokens(text, max(remaining, 0))
+            cost = count_tokens(text) + separator_tokens
+            truncated = True
+            if not text:
+                break
+
+        group = groups.setdefault(key, _Group(key))
+        group.chunks[position if key[0] is None else doc.metadata["chunk_index"]] = text
+        sources.append(doc)
+        seen.append(fingerprint)
+        used += cost
+        if truncated:
+            break
+
+    if vector_store is not None and expand_neighbors and not truncated:
+        for group in list(groups.values()):
+            if group.key[0] is None:
+                continue
+            for index, text in _fetch_neighbors(vector_store, group, expand_neighbors):
+                cost = count_tokens(text)
+                fingerprint = _fingerprint(text)
+                if used + cost > budget_tokens or any(fingerprint in other for other in seen):
+                    continue
+                group.chunks[index] = text
+                seen.append(fingerprint)
+                used += cost
+
+    context = separator.join(group.render() for group in groups.values())
+    tokens = count_tokens(context)
+    if tokens > budget_tokens:
+        context = truncate_to_tokens(context, budget_tokens)
+        tokens, truncated = count_tokens(context), True
+    return {"text": context, "sources": sources, "tokens": tokens, "truncated": truncated}
@@ -0,0 +1,135 @@
+# conversation_memory.py
+
+"""
+Memoria della conversazione per le domande successive alla prima.
+
+Gli ultimi turni (domanda e risposta) restano testuali entro un limite di
+turni e di token; quelli più vecchi confluiscono in un riepilogo progressivo
+di lunghezza limitata. Il testo risultante alimenta il campo
+`conversation_history` del prompt, mentre il retrieval usa una query
+autonoma: la domanda attuale, arricchita con i termini della domanda
+precedente solo quando sembra un seguito ("e per quello?", "spiegalo meglio").
+"""
+
+import re
+
+from config import MEMORY_MAX_TOKENS, MEMORY_MAX_TURNS, MEMORY_SUMMARY_TOKENS
+from core.context_builder import count_tokens, truncate_to_tokens
+
+STOPWORDS = {
+    "il", "lo", "la", "i", "gli", "le", "un", "uno", "una", "di", "a", "da", "in", "con", "su", "per",
+    "tra", "fra", "e", "o", "ma", "che", "chi", "cosa", "come", "dove", "quando", "quale", "quali",
+    "del", "dello", "della", "dei", "degli", "delle", "al", "allo", "alla", "ai", "agli", "alle",
+    "dal", "dalla", "dai", "nel", "nello", "nella", "nei", "sul", "sulla", "non", "si", "mi", "ti",
+    "ci", "vi", "ne", "è", "sono", "ha", "hanno", "puoi", "può", "mio", "tuo", "suo", "questo",
+    "questa", "quello", "quella", "anche", "più", "meno", "molto", "poi", "the", "of", "and", "to",
+    "is", "what", "how", "for",
+}
+# Riferimenti alla conversazione precedente che rendono la domanda non autonoma
+FOLLOW_UP_MARKERS = re.compile(
+    r"\b(questo|questa|questi|queste|quello|quella|quelli|quelle|esso|essa|lo stesso|la stessa|"
+    r"sopra|precedente|prima|detto|anche|invece|inoltre|ancora|meglio|altro|altri|"
+    r"it|this|that|these|those|above|previous)\b",
+    re.IGNORECASE,
+)
+SHORT_QUESTION_WORDS = 4
+MAX_CARRIED_TERMS = 8
+
+
+def _content_words(text):
+    return [word for word in re.findall(r"\w+", text.lower()) if word not in STOPWORDS and len(word) > 2]
+
+
+def _first_sentences(text, max_chars=300):
+    text = " ".join(text.split())
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    end = max(cut.rfind(". "), cut.rfind("? "), cut.rfind("! "))
+    return cut[:end + 1] if end > max_chars // 3 else cut + "…"
+
+
+def extractive_summary(summary, turn, max_tokens=MEMORY_SUMMARY_TOKENS):
+    """
+    Aggiunge un turno al riepilogo (domanda e inizio della risposta) mantenendo
+    il riepilogo entro `max_tokens`: se serve si scartano i turni più vecchi.
+    """
+    line = f"- {turn['question'].strip()} → {_first_sentences(turn['answer'])}"
+    lines = (summary.splitlines() if summary else []) + [line]
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    text = "\n".join(lines)
+    return text if count_tokens(text) <= max_tokens else truncate_to_tokens(text, max_tokens)
+
+
+class ConversationMemory:
+    """
+    Ultimi turni testuali più riepilogo progressivo dei precedenti.
+
+    Parameters:
+    - max_turns (int): Turni conservati testualmente.
+    - max_tokens (int): Token massimi dei turni testuali.
+    - summarizer (callable): (riepilogo, turno) -> nuovo riepilogo; di default estrattivo, senza LLM.
+    """
+
+    def __init__(self, max_turns=MEMORY_MAX_TURNS, max_tokens=MEMORY_MAX_TOKENS, summarizer=extractive_summary):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer
+        self.turns = []
+        self.summary = ""
+
+    def __len__(self):
+        return len(self.turns)
+
+    def clear(self):
+        self.turns = []
+        self.summary = ""
+
+    def add_turn(self, question, answer):
+        self.turns.append({"question": question, "answer": answer})
+        self._compact()
+
+    def _turns_tokens(self):
+        return sum(count_tokens(turn["question"]) + count_tokens(turn["answer"]) for turn in self.turns)
+
+    def _compact(self):
+        # L'ultimo turno resta sempre testuale (eventualmente troncato in `render`)
+        while len(self.turns) > 1 and (len(self.turns) > self.max_turns or self._turns_tokens() > self.max_tokens):
+            self.summary = self.summarizer(self.summary, self.turns.pop(0))
+
+    def render(self):
+        """Testo per il campo `conversation_history` del prompt ("" se la memoria è vuota)."""
+        parts = []
+        if self.summary:
+            parts.append(f"Riepilogo delle domande precedenti:\n{self.summary}")
+        for turn in self.turns:
+            answer = truncate_to_tokens(turn["answer"], self.max_tokens)
+            parts.append(f"Utente: {turn['question']}\nAssistente: {answer}")
+        return "\n\n".join(parts)
+
+    def standalone_query(self, question):
+        """
+        Query autonoma per il retrieval: la domanda stessa, oppure, se è un seguito
+        della precedente (breve o con riferimenti anaforici), la domanda con i termini
+        principali della domanda precedente.
+        """
+        if not self.turns:
+            return question
+        words = _content_words(question)
+        if len(words) > SHORT_QUESTION_WORDS and not FOLLOW_UP_MARKERS.search(question):
+            return question
+        carried = [word for word in _content_words(self.turns[-1]["question"]) if word not in words]
+        if not carried:
+            return question
+        return f"{question} ({' '.join(dict.fromkeys(carried[:MAX_CARRIED_TERMS]))})"
+
+    def to_dict(self):
+        return {"turns": list(self.turns), "summary": self.summary}
+
+    @classmethod
+    def from_dict(cls, data, **options):
+        memory = cls(**options)
+        memory.turns = list(data.get("turns", []))
+        memory.summary = data.get("summary", "")
+        return memory
@@ -1,16 +1,56 @@
 # database.py
-from langchain.vectorstores import Chroma
-from langchain.embeddings import HuggingFaceEmbeddings
+import os
+
+from config import VECTOR_BACKEND
+from core.store_cache import STORE_CACHE
 
 CHROMA_PATH = "chroma"
+UPLOAD_PATH = "uploaded_documents"
+
+
+def kb_storage_path(kb_name):
+    """Cartella su disco della knowledge base (`chroma_<kb>`, indipendentemente dal backend)."""
+    return f"{CHROMA_PATH}_{kb_name}"
+
+
+def kb_upload_dir(kb_name):
+    """Cartella dei file caricati nella knowledge base (`uploaded_documents/kb_<kb>`)."""
+    return os.path.join(UPLOAD_PATH, f"kb_{kb_name}")
+
+
+def kb_name_from_path(persist_directory):
+    """Nome completo della KB (`<utente>_<kb>`) dalla sua cartella."""
+    return os.path.basename(os.path.normpath(persist_directory))[len(CHROMA_PATH) + 1:]
+
+
+def list_user_kbs(username):
+    """Nomi (senza prefisso dell'utente) delle knowledge base dell'utente, dal registro delle KB."""
+    # Import locale: il registro usa a sua volta le funzioni di questo modulo
+    from core.kb_registry import get_kb_registry
+    return get_kb_registry().list_kbs(username)
+
+
+def load_or_create_chroma_db(kb_name, backend=None):
+    """
+    Carica o crea una knowledge base.
+    Le KB esistenti usano il backend con cui sono state create; quelle nuove
+    usano `backend` o, se non indicato, `VECTOR_BACKEND` della configurazione.
+    L'handle è condiviso dal processo (vedi `core.store_cache`); le KB nuove vengono
+    aggiunte al registro delle KB (`core.kb_registry`).
+    """
+    from core.kb_registry import get_kb_registry
 
-def load_or_create_chroma_db(kb_name):
-    """Carica o crea una knowledge base usando Chroma."""
-    CHROMA_PATH = f"chroma_{kb_name}"
-    embedding_function = HuggingFaceEmbeddings()
+    persist_directory = kb_storage_path(kb_name)
+    created = not os.path.isdir(persist_directory)
+    if backend is None and created:
+        backend = VECTOR_BACKEND
     try:
-        vector_store = Chroma(persist_directory=CHROMA_PATH, embedding_function=embedding_function)
-        return vector_store
+        store = STORE_CACHE.get(persist_directory, backend=backend)
     except Exception as e:
         print(f"Errore durante il caricamento della knowledge base '{kb_name}': {e}")
         return None
+    registry = get_kb_registry()
+    if created:
+        registry.register(kb_name, persist_directory, store.backend_name, getattr(store.embeddings, "model_name", None))
+    registry.touch(kb_name)
+    return store
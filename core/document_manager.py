@@ -5,48 +5,263 @@ import os
 import uuid
 import hashlib
 from datetime import datetime
-from core.embeddings import create_embeddings
-from utils.document_loader import load_document, split_text_semantic
+from core.embeddings import create_embeddings, get_embedding_function
+from core.file_server import signed_file_url
+from core.kb_registry import get_kb_registry
+from core.kb_version import bump_kb_version, kb_write_lock
+from core.store_cache import STORE_CACHE
+from core.web_metadata import extract_page_metadata, get_title_cache
 import validators
 from urllib.parse import urljoin
 import requests
-from langchain.schema import Document
-from bs4 import BeautifulSoup
+
+
+def streamlit_notify(level, message):
+    """Mostra un messaggio del DocumentManager nella pagina Streamlit (`st.success`, `st.warning`, ...)."""
+    getattr(st, level)(message)
+
+
+def document_row(document):
+    """Riga della tabella dei documenti a partire dal riepilogo di `DocumentManager.list_documents`."""
+    fonte = document.get("source_url") or document.get("file_path") or "N/A"
+    # Rendi la colonna "Fonte" cliccabile se è un URL
+    if validators.url(fonte):
+        fonte = f"[Apri URL]({fonte})"
+    return {
+        "ID Documento": document["doc_id"],
+        "Nome Documento": document.get("file_name") or "Senza Nome",
+        "Tipo": "Web" if document.get("source_url") else "File",
+        "Fonte": fonte,
+        "Dimensione (KB)": f"{document.get('file_size') or 0:.2f}",
+        "Data Caricamento": document.get("upload_date") or "N/A",
+    }
+
+
+def calculate_file_hash(file_path):
+    """Calcola un hash univoco per il file per identificare duplicati basati sul contenuto."""
+    hash_md5 = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            hash_md5.update(chunk)
+    return hash_md5.hexdigest()
+
+
+def chunk_local_file(file_path, file_hash=None, stored_path=None, embeddings=None):
+    """
+    Carica un documento locale e lo suddivide in chunk (semantic chunking) con i metadati della KB.
+    Usata dal DocumentManager e dall'indicizzazione da riga di comando (`tools.bulk_index`).
+
+    Parameters:
+    - file_path (str): Il file da caricare.
+    - file_hash (str): Hash del file, se già calcolato.
+    - stored_path (str): Percorso salvato nei metadati (default: il percorso assoluto del file).
+    - embeddings: Modello di embedding del semantic chunker (default: quello condiviso delle KB).
+
+    Returns:
+    - tuple: (doc_id, chunk).
+
+    Raises:
+    - ValueError: Se il documento non può essere caricato o suddiviso in chunk.
+    """
+    # Import locale: loader e semantic chunker servono solo all'indicizzazione
+    from utils.document_loader import load_document, split_text_semantic
+
+    file_name = os.path.basename(file_path)
+    data = load_document(file_path)
+    if not data:
+        raise ValueError(f"Errore: Impossibile caricare il documento '{file_name}'.")
+
+    # Utilizza il semantic chunking
+    chunks = split_text_semantic(
+        data,
+        breakpoint_type="percentile",
+        breakpoint_amount=90,
+        embeddings=embeddings or get_embedding_function()
+    )
+    if not chunks:
+        raise ValueError(f"Errore: Il documento '{file_name}' non può essere suddiviso in chunk.")
+
+    doc_id = str(uuid.uuid4())
+    for chunk_index, chunk in enumerate(chunks):
+        chunk.metadata.update({
+            "doc_id": doc_id,
+            "chunk_index": chunk_index,  # ordinale per unire i chunk adiacenti nel contesto
+            "file_name": file_name,
+            "file_size": os.path.getsize(file_path) / 1024,
+            "creation_date": datetime.fromtimestamp(os.path.getctime(file_path)).strftime("%Y-%m-%d %H:%M:%S"),
+            "upload_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "file_hash": file_hash or calculate_file_hash(file_path),
+            "file_path": stored_path or os.path.abspath(file_path),
+        })
+    return doc_id, chunks
+
+
+def fetch_web_pages(url, depth_level=1, visited=None, max_pages=50):
+    """Scarica e analizza il contenuto di una pagina web fino al livello di profondità specificato."""
+    if visited is None:
+        visited = set()
+    if depth_level < 1 or len(visited) >= max_pages:
+        return []
+
+    # Controlla se l'URL è già stato visitato per prevenire loop
+    if url in visited:
+        return []
+    visited.add(url)
+
+    try:
+        response = requests.get(url, headers={
+            "User-Agent": "Mozilla/5.0"
+        })
+
+        if "text/html" not in response.headers.get("Content-Type", ""):
+            return []
+
+        response.raise_for_status()
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(response.text, 'html.parser')
+
+        # Titolo e metadati di visualizzazione, letti una volta sola qui e non a ogni risposta
+        page_metadata = extract_page_metadata(soup)
+        # Estrarre solo il testo visibile
+        text = soup.get_text(separator="\n", strip=True)
+        documents = [{"url": url, "content": text, "metadata": page_metadata}]
+
+        if depth_level > 1:
+            # Trova tutti i link nella pagina
+            links = [a.get('href') for a in soup.find_all('a', href=True)]
+            # Processa i link per ottenere URL assoluti
+            links = [urljoin(url, link) if not link.startswith('http') else link for link in links]
+            # Filtra link non validi
+            links = [
+                link for link in links
+                if not link.startswith('mailto:')
+                   and not link.startswith('javascript:')
+                   and link not in visited
+            ]
+
+            # Scarica il contenuto dei link ricorsivamente
+            for link in links:
+                if len(visited) >= max_pages:
+                    break
+                documents.extend(
+                    fetch_web_pages(
+                        link,
+                        depth_level=depth_level - 1,
+                        visited=visited,
+                        max_pages=max_pages
+                    )
+                )
+
+        return documents
+    except Exception as e:
+        return []
+
+
+def chunk_web_pages(url, web_documents, embeddings=None):
+    """
+    Suddivide in chunk le pagine scaricate da `fetch_web_pages` a partire da `url`,
+    come un unico documento della KB.
+
+    Returns:
+    - tuple: (doc_id, chunk).
+    """
+    from langchain.schema import Document
+    from utils.document_loader import split_text_semantic
+
+    doc_id = str(uuid.uuid4())
+    upload_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    chunk_index = 0
+    # Titolo del documento: quello della pagina di partenza
+    doc_title = web_documents[0]["metadata"].get("page_title") or url
+    all_chunks = []
+
+    embeddings = embeddings or get_embedding_function()
+
+    for web_doc in web_documents:
+        page_content = web_doc['content']
+        page_url = web_doc['url']
+        # Creiamo un oggetto Document per ogni pagina
+        document = Document(page_content=page_content, metadata={"source_url": page_url})
+        # Suddividiamo il documento in chunk
+        chunks = split_text_semantic([document], embeddings=embeddings)
+        if not chunks:
+            continue  # Salta se non ci sono chunk
+
+        for chunk in chunks:
+            chunk.metadata.update({
+                "doc_id": doc_id,
+                "chunk_index": chunk_index,
+                "file_name": "Contenuto Web",
+                "file_size": len(chunk.page_content) / 1024,  # Dimensione in KB
+                "creation_date": "N/A",
+                "upload_date": upload_date,
+                "source_url": page_url,
+                "doc_title": doc_title,
+                **web_doc["metadata"],
+            })
+            chunk_index += 1
+        all_chunks.extend(chunks)
+    return doc_id, all_chunks
+
+
 class DocumentManager:
+    """
+    Aggiunta, elenco ed eliminazione dei documenti di una knowledge base.
+
+    Parameters:
+    - vector_store: Vector store della KB.
+    - upload_dir (str): Cartella dei file caricati.
+    - notify (callable): Funzione `(livello, messaggio)` per gli esiti ("success", "warning",
+      "error", "info"). Se indicata il manager è headless: non usa né la pagina né il
+      session state di Streamlit (servizio API, job di indicizzazione).
+    """
     ALLOWED_EXTENSIONS = {".pdf", ".docx", ".docs", ".txt", ".csv"}
     WEB_DOCUMENT_ID_PREFIX = "web_"  # Prefisso per documenti caricati da URL
 
-    def __init__(self, vector_store, upload_dir="uploaded_documents"):
+    def __init__(self, vector_store, upload_dir="uploaded_documents", notify=None):
         if vector_store is None:
             vector_store = create_embeddings([])  # Usa una funzione che crea un nuovo vector store
         self.vector_store = vector_store
+        self.upload_dir = upload_dir
+        self.headless = notify is not None
+        self.notify = notify or streamlit_notify
+        # Stato dei documenti: session state nella UI, un dizionario proprio se headless
+        self.state = {} if self.headless else st.session_state
         self.init_session_state()
-        self.table_placeholder = st.empty()
+        self.table_placeholder = None if self.headless else st.empty()
 
     def init_session_state(self):
         """Inizializza variabili nel session state."""
-        kb_key = f"document_names_{self.vector_store._persist_directory}"
-        if kb_key not in st.session_state:
-            st.session_state[kb_key] = {}
-        if "loaded_documents" not in st.session_state:
-            st.session_state["loaded_documents"] = {}
-        if "refresh_counter" not in st.session_state:
-            st.session_state["refresh_counter"] = 0
+        kb_key = f"document_names_{self.vector_store.path}"
+        if kb_key not in self.state:
+            self.state[kb_key] = {}
+        if "loaded_documents" not in self.state:
+            self.state["loaded_documents"] = {}
+        if "refresh_counter" not in self.state:
+            self.state["refresh_counter"] = 0
+
+    def bump_version(self):
+        """
+        Registra una modifica della KB (aggiunta, eliminazione, sincronizzazione)
+        incrementandone la versione persistente. Le cache basate sulla versione
+        vengono così invalidate automaticamente.
+        """
+        version = bump_kb_version(self.vector_store.path)
+        # L'handle condiviso di questo processo è già aggiornato: niente riapertura
+        STORE_CACHE.note_version(self.vector_store.path, self.vector_store, version)
+        get_kb_registry().record_write(self.vector_store, version)
+        return version
 
     def calculate_file_hash(self, file_path):
         """Calcola un hash univoco per il file per identificare duplicati basati sul contenuto."""
-        hash_md5 = hashlib.md5()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        return calculate_file_hash(file_path)
 
     def document_exists(self, file_hash=None, url=None):
         """Controlla se un documento con lo stesso hash o URL è già presente nel database."""
-        if not self.vector_store or not hasattr(self.vector_store, '_collection'):
+        if not self.vector_store:
             return False
 
-        results = self.vector_store._collection.get(include=["metadatas"])
+        results = self.vector_store.get(include=["metadatas"])
         for metadata in results["metadatas"]:
             if file_hash and metadata.get("file_hash") == file_hash:
                 return True
@@ -57,17 +272,15 @@ class DocumentManager:
     def add_document(self, file_path_or_url, chunk_size=1024, chunk_overlap=128):
         """
         Carica e aggiunge un documento (locale o URL) al vector store.
+        Restituisce l'ID del documento aggiunto (una lista per più documenti), None se non aggiunto.
         """
         if isinstance(file_path_or_url, list):
-            for single_path in file_path_or_url:
-                self.add_document(single_path, chunk_size, chunk_overlap)
-            return
+            return [self.add_document(single_path, chunk_size, chunk_overlap) for single_path in file_path_or_url]
 
         if validators.url(file_path_or_url):
-            self.add_web_document(file_path_or_url, chunk_size, chunk_overlap)
-            return
+            return self.add_web_document(file_path_or_url, chunk_size, chunk_overlap)
 
-        self.add_local_document(file_path_or_url, chunk_size, chunk_overlap)
+        return self.add_local_document(file_path_or_url, chunk_size, chunk_overlap)
 
     def add_local_document(self, file_path, chunk_size=1024, chunk_overlap=128):
         """
@@ -75,172 +288,83 @@ class DocumentManager:
         """
         file_name = os.path.basename(file_path)
         file_hash = self.calculate_file_hash(file_path)
-        abs_file_path = os.path.abspath(file_path)
 
         if self.document_exists(file_hash):
-            st.warning(f"Il documento '{file_name}' è già presente nella knowledge base.")
-            return
+            self.notify("warning", f"Il documento '{file_name}' è già presente nella knowledge base.")
+            return None
 
         try:
-            data = load_document(file_path)
-            if not data:
-                st.error(f"Errore: Impossibile caricare il documento '{file_name}'.")
-                return
-
-            # Utilizza il semantic chunking
-            chunks = split_text_semantic(
-                data,
-                breakpoint_type="percentile",
-                breakpoint_amount=90
-            )
-            if not chunks:
-                st.error(f"Errore: Il documento '{file_name}' non può essere suddiviso in chunk.")
-                return
-
-            doc_id = str(uuid.uuid4())
-            for chunk in chunks:
-                chunk.metadata.update({
-                    "doc_id": doc_id,
-                    "file_name": file_name,
-                    "file_size": os.path.getsize(file_path) / 1024,
-                    "creation_date": datetime.fromtimestamp(os.path.getctime(file_path)).strftime("%Y-%m-%d %H:%M:%S"),
-                    "upload_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "file_hash": file_hash,
-                    "file_path": abs_file_path,
-                })
-
-            self.vector_store.add_documents(chunks)
-            self.vector_store.persist()
-            st.session_state["refresh_counter"] += 1
-            st.success(f"Documento '{file_name}' aggiunto con successo!")
+            doc_id, chunks = chunk_local_file(file_path, file_hash)
+            with kb_write_lock(self.vector_store.path):
+                self.vector_store.add_documents(chunks)
+                self.vector_store.persist()
+                self.bump_version()
+            self.state["refresh_counter"] += 1
+            self.notify("success", f"Documento '{file_name}' aggiunto con successo!")
+            return doc_id
+        except ValueError as e:
+            self.notify("error", str(e))
+            return None
         except Exception as e:
-            st.error(f"Errore durante l'elaborazione del documento '{file_name}': {e}")
+            self.notify("error", f"Errore durante l'elaborazione del documento '{file_name}': {e}")
+            return None
 
     def fetch_web_content(self, url, depth_level=1, visited=None, max_pages=50):
         """Scarica e analizza il contenuto di una pagina web fino al livello di profondità specificato."""
-        if visited is None:
-            visited = set()
-        if depth_level < 1 or len(visited) >= max_pages:
-            return []
-
-        # Controlla se l'URL è già stato visitato per prevenire loop
-        if url in visited:
-            return []
-        visited.add(url)
-
-        try:
-            response = requests.get(url, headers={
-                "User-Agent": "Mozilla/5.0"
-            })
-
-            if "text/html" not in response.headers.get("Content-Type", ""):
-                return []
-
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            # Estrarre solo il testo visibile
-            text = soup.get_text(separator="\n", strip=True)
-            documents = [{"url": url, "content": text}]
-
-            if depth_level > 1:
-                # Trova tutti i link nella pagina
-                links = [a.get('href') for a in soup.find_all('a', href=True)]
-                # Processa i link per ottenere URL assoluti
-                links = [urljoin(url, link) if not link.startswith('http') else link for link in links]
-                # Filtra link non validi
-                links = [
-                    link for link in links
-                    if not link.startswith('mailto:')
-                       and not link.startswith('javascript:')
-                       and link not in visited
-                ]
-
-                # Scarica il contenuto dei link ricorsivamente
-                for link in links:
-                    if len(visited) >= max_pages:
-                        break
-                    documents.extend(
-                        self.fetch_web_content(
-                            link,
-                            depth_level=depth_level - 1,
-                            visited=visited,
-                            max_pages=max_pages
-                        )
-                    )
-
-            return documents
-        except Exception as e:
-            return []
+        return fetch_web_pages(url, depth_level, visited, max_pages)
 
     def add_web_document(self, url, chunk_size=1024, chunk_overlap=128, depth_level=1):
         """
         Scarica il contenuto di un sito web, lo divide in chunk e lo aggiunge alla knowledge base.
         """
         if not validators.url(url):
-            st.error("URL non valido. Inserisci un URL corretto.")
-            return
+            self.notify("error", "URL non valido. Inserisci un URL corretto.")
+            return None
 
         # Scaricare il contenuto web usando fetch_web_content
         web_documents = self.fetch_web_content(url, depth_level=depth_level)
 
         if not web_documents:
-            st.error(f"Errore: Nessun contenuto trovato per l'URL: {url}")
-            return
-
-        doc_id = str(uuid.uuid4())
-        upload_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        for web_doc in web_documents:
-            page_content = web_doc['content']
-            page_url = web_doc['url']
-            # Creiamo un oggetto Document per ogni pagina
-            document = Document(page_content=page_content, metadata={"source_url": page_url})
-            # Suddividiamo il documento in chunk
-            chunks = split_text_semantic([document])
-            if not chunks:
-                continue  # Salta se non ci sono chunk
-
-            for chunk in chunks:
-                chunk.metadata.update({
-                    "doc_id": doc_id,
-                    "file_name": "Contenuto Web",
-                    "file_size": len(chunk.page_content) / 1024,  # Dimensione in KB
-                    "creation_date": "N/A",
-                    "upload_date": upload_date,
-                    "source_url": page_url,
-                })
-
+            self.notify("error", f"Errore: Nessun contenuto trovato per l'URL: {url}")
+            return None
+
+        doc_id, chunks = chunk_web_pages(url, web_documents)
+        get_title_cache().put_many({
+            web_doc["url"]: web_doc["metadata"].get("page_title") for web_doc in web_documents
+        })
+        with kb_write_lock(self.vector_store.path):
             try:
                 self.vector_store.add_documents(chunks)
             except Exception as e:
-                st.error(f"Errore durante l'aggiunta del documento web: {e}")
+                self.notify("error", f"Errore durante l'aggiunta del documento web: {e}")
+                return None
 
-        self.vector_store.persist()
-        st.success(f"Contenuto da '{url}' aggiunto con successo!")
-        st.session_state["refresh_counter"] += 1
+            self.vector_store.persist()
+            self.bump_version()
+        self.notify("success", f"Contenuto da '{url}' aggiunto con successo!")
+        self.state["refresh_counter"] += 1
+        return doc_id
 
     def load_existing_documents(self):
         """Carica i documenti esistenti dal database e li memorizza in `session_state` per evitare duplicati."""
-        kb_key = f"document_names_{self.vector_store._persist_directory}"
-        if self.vector_store and not st.session_state.get(f"loaded_documents_{self.vector_store._persist_directory}",
-                                                          False):
-            if kb_key not in st.session_state:
-                st.session_state[kb_key] = {}
-            results = self.vector_store._collection.get(include=["metadatas"])
+        kb_key = f"document_names_{self.vector_store.path}"
+        if self.vector_store and not self.state.get(f"loaded_documents_{self.vector_store.path}", False):
+            if kb_key not in self.state:
+                self.state[kb_key] = {}
+            results = self.vector_store.get(include=["metadatas"])
             for metadata in results["metadatas"]:
                 doc_id = metadata.get("doc_id")
                 file_name = metadata.get("file_name", "Senza Nome")
                 file_hash = metadata.get("file_hash")
                 file_path = metadata.get("file_path")
 
-                if doc_id and file_name and doc_id not in st.session_state[kb_key]:
-                    st.session_state[kb_key][doc_id] = {
+                if doc_id and file_name and doc_id not in self.state[kb_key]:
+                    self.state[kb_key][doc_id] = {
                         "file_name": file_name,
                         "file_hash": file_hash,
                         "file_path": file_path
                     }
-            st.session_state[f"loaded_documents_{self.vector_store._persist_directory}"] = True
+            self.state[f"loaded_documents_{self.vector_store.path}"] = True
 
     def truncate_text(self, text, max_length=50):
         """
@@ -323,41 +447,48 @@ class DocumentManager:
 
     def delete_document(self, doc_id):
         """Elimina un documento dal database e dal vector store usando il suo ID."""
-        kb_key = f"document_names_{self.vector_store._persist_directory}"
+        kb_key = f"document_names_{self.vector_store.path}"
         try:
-            if doc_id in st.session_state.get(kb_key, {}):
+            if doc_id in self.state.get(kb_key, {}):
                 # Elimina tutti i vettori associati al documento tramite il filtro sul metadato 'doc_id'
-                self.vector_store._collection.delete(where={"doc_id": doc_id})
-                self.vector_store.persist()
+                with kb_write_lock(self.vector_store.path):
+                    self.vector_store.delete(where={"doc_id": doc_id})
+                    self.vector_store.persist()
+                    self.bump_version()
+                # L'handle condiviso viene riaperto (e rimisurato) alla richiesta successiva
+                STORE_CACHE.invalidate(self.vector_store.path)
 
                 # Verifica l'eliminazione
-                exists = self.vector_store._collection.get(
+                exists = self.vector_store.get(
                     where={"doc_id": doc_id},
                     include=["metadatas"]
                 )
                 if exists['metadatas']:
-                    st.warning(f"Il documento con ID '{doc_id}' non è stato eliminato correttamente.")
+                    self.notify("warning", f"Il documento con ID '{doc_id}' non è stato eliminato correttamente.")
                 else:
-                    del st.session_state[kb_key][doc_id]
-                    st.success(f"Documento con ID '{doc_id}' rimosso con successo.")
+                    del self.state[kb_key][doc_id]
+                    self.notify("success", f"Documento con ID '{doc_id}' rimosso con successo.")
 
                     # Aggiorna il session_state per forzare l'aggiornamento della tabella
-                    st.session_state["refresh_counter"] += 1
+                    self.state["refresh_counter"] += 1
+                    return True
             else:
-                st.warning(f"Il documento con ID '{doc_id}' non è presente nella knowledge base.")
+                self.notify("warning", f"Il documento con ID '{doc_id}' non è presente nella knowledge base.")
         except Exception as e:
-            st.error(f"Errore durante l'eliminazione del documento: {e}")
+            self.notify("error", f"Errore durante l'eliminazione del documento: {e}")
+        return False
 
-    def get_document_metadata(self):
-        """Recupera i metadati dei documenti per la visualizzazione nella knowledge base."""
+    def list_documents(self):
+        """
+        Riepilogo dei documenti della KB, uno per `doc_id` (dal primo chunk).
+
+        Returns:
+        - list of dict: "doc_id", "file_name", "source_url", "file_path", "file_size", "upload_date".
+        """
         if not self.vector_store:
             return []
 
-        kb_key = f"document_names_{self.vector_store._persist_directory}"
-        if kb_key not in st.session_state:
-            st.session_state[kb_key] = {}
-
-        results = self.vector_store._collection.get(include=["metadatas"])
+        results = self.vector_store.get(include=["metadatas"])
         documents = []
         seen_doc_ids = set()
 
@@ -365,22 +496,26 @@ class DocumentManager:
             doc_id = metadata.get("doc_id")
             if doc_id not in seen_doc_ids:
                 seen_doc_ids.add(doc_id)
-                fonte = metadata.get("source_url", metadata.get("file_path", "N/A"))
-
-                # Rendi la colonna "Fonte" cliccabile se è un URL
-                if validators.url(fonte):
-                    fonte = f"[Apri URL]({fonte})"
-
                 documents.append({
-                    "ID Documento": doc_id,
-                    "Nome Documento": metadata.get("file_name", "Senza Nome"),
-                    "Tipo": "Web" if metadata.get("source_url") else "File",
-                    "Fonte": fonte,
-                    "Dimensione (KB)": f"{metadata.get('file_size', 0):.2f}",
-                    "Data Caricamento": metadata.get("upload_date", "N/A"),
+                    "doc_id": doc_id,
+                    "file_name": metadata.get("file_name", "Senza Nome"),
+                    "source_url": metadata.get("source_url"),
+                    "file_path": metadata.get("file_path"),
+                    "file_size": metadata.get("file_size", 0),
+                    "upload_date": metadata.get("upload_date", "N/A"),
                 })
         return documents
 
+    def get_document_metadata(self):
+        """Recupera i metadati dei documenti per la visualizzazione nella knowledge base."""
+        if not self.vector_store:
+            return []
+
+        kb_key = f"document_names_{self.vector_store.path}"
+        if kb_key not in self.state:
+            self.state[kb_key] = {}
+        return [document_row(document) for document in self.list_documents()]
+
     def get_document_path(self, doc_id):
         """
         Recupera il percorso del documento usando l'ID.
@@ -391,23 +526,33 @@ class DocumentManager:
         Returns:
         - str or None: Il percorso del file se trovato, altrimenti None.
         """
-        kb_key = f"document_names_{self.vector_store._persist_directory}"
-        document_names = st.session_state.get(kb_key, {})
+        kb_key = f"document_names_{self.vector_store.path}"
+        document_names = self.state.get(kb_key, {})
         if doc_id in document_names:
             return document_names[doc_id].get("file_path")
         return None
+    def get_document_url(self, doc_id):
+        """
+        Link per aprire il documento: URL firmato dell'endpoint dei file (il percorso
+        se l'endpoint non è disponibile), None se il file non esiste.
+        """
+        file_path = self.get_document_path(doc_id)
+        if not file_path or not os.path.exists(file_path):
+            return None
+        return signed_file_url(file_path) or file_path
+
     def open_document(self, doc_id):
         """Apre il documento usando il percorso assoluto memorizzato in `session_state`."""
-        kb_key = f"document_names_{self.vector_store._persist_directory}"
-        document_names = st.session_state.get(kb_key, {})
+        kb_key = f"document_names_{self.vector_store.path}"
+        document_names = self.state.get(kb_key, {})
         if doc_id in document_names:
             file_path = document_names[doc_id]["file_path"]
             if os.path.exists(file_path):
                 os.startfile(file_path)
             else:
-                st.error("Il file non è stato trovato al percorso specificato.")
+                self.notify("error", "Il file non è stato trovato al percorso specificato.")
         else:
-            st.error("Documento non trovato in `session_state`.")
+            self.notify("error", "Documento non trovato in `session_state`.")
 
     def add_folder(self, folder_path, chunk_size, chunk_overlap):
         """Carica ricorsivamente tutti i file accettati dalla cartella specificata."""
@@ -419,4 +564,4 @@ class DocumentManager:
                     # Passa chunk_size e chunk_overlap al metodo add_document
                     self.add_document(file_path, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
                 else:
-                    st.warning(f"Il file '{file}' è stato scartato perché non supportato.")
+                    self.notify("warning", f"Il file '{file}' è stato scartato perché non supportato.")
@@ -1,13 +1,66 @@
 # embeddings.py
 
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.vectorstores import Chroma
+from core.vector_store import ChromaVectorStore
 import os
 import shutil
 import logging
+import threading
 
 CHROMA_PATH = "chroma"
 
+
+_embedding_function = None
+_embedding_lock = threading.Lock()
+
+
+def get_embedding_function():
+    """
+    Restituisce la funzione di embedding usata dalle knowledge base.
+    Il modello viene caricato una sola volta ed è condiviso da tutte le KB e le sessioni.
+    """
+    global _embedding_function
+    with _embedding_lock:
+        if _embedding_function is None:
+            # Import locale: il modello (e torch) si carica solo alla prima KB aperta, non all'avvio
+            from langchain.embeddings import HuggingFaceEmbeddings
+            _embedding_function = HuggingFaceEmbeddings()
+        return _embedding_function
+
+
+def set_embedding_function(embedding_function):
+    """Sostituisce la funzione di embedding condivisa (es. con un embedder deterministico nei benchmark)."""
+    global _embedding_function
+    with _embedding_lock:
+        _embedding_function = embedding_function
+
+
+class PrecomputedEmbeddings:
+    """
+    Funzione di embedding che restituisce i vettori già calcolati per i testi noti
+    (es. domande di un batch calcolate con una sola `embed_documents`) e delega
+    gli altri alla funzione originale.
+    """
+
+    def __init__(self, base, vectors=None):
+        self.base = base
+        self.vectors = dict(vectors or {})
+
+    def precompute(self, texts, batch_size=64):
+        """Calcola a blocchi gli embedding dei testi non ancora noti."""
+        missing = list(dict.fromkeys(text for text in texts if text not in self.vectors))
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            self.vectors.update(zip(batch, self.base.embed_documents(batch)))
+        return len(missing)
+
+    def embed_query(self, text):
+        vector = self.vectors.get(text)
+        return list(vector) if vector is not None else self.base.embed_query(text)
+
+    def embed_documents(self, texts):
+        return self.base.embed_documents(texts)
+
+
 def create_embeddings(chunks, reset=False):
     logging.basicConfig(level=logging.INFO)
     if reset:
@@ -16,10 +69,7 @@ def create_embeddings(chunks, reset=False):
             logging.info(f"Cartella {CHROMA_PATH} resettata.")
     if not os.path.exists(CHROMA_PATH):
         logging.info("Creazione di un nuovo database Chroma.")
-        db = Chroma(
-            persist_directory=CHROMA_PATH,
-            embedding_function=HuggingFaceEmbeddings()
-        )
+        db = ChromaVectorStore(CHROMA_PATH, get_embedding_function())
         if chunks:
             db.add_documents(chunks)
             db.persist()
@@ -27,10 +77,7 @@ def create_embeddings(chunks, reset=False):
             logging.info("Nessun documento da indicizzare.")
     else:
         logging.info("Caricamento del database Chroma esistente.")
-        db = Chroma(
-            persist_directory=CHROMA_PATH,
-            embedding_function=HuggingFaceEmbeddings()
-        )
+        db = ChromaVectorStore(CHROMA_PATH, get_embedding_function())
         if chunks:
             db.add_documents(chunks)
             db.persist()
@@ -0,0 +1,272 @@
+# faiss_index.py
+
+"""
+Indice FAISS persistente e condiviso per knowledge base.
+
+L'indice vive nella cartella della KB (`chroma_<kb>/faiss/`) ed è allineato in
+modo incrementale con il vector store: ad ogni cambio di versione della KB
+vengono aggiunti solo i chunk nuovi (riusando gli embedding già salvati, senza
+ricalcolarli) e rimossi quelli eliminati. La lettura usa il memory-mapping,
+quindi più sessioni e processi condividono le stesse pagine in memoria.
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+from core.kb_version import get_kb_version
+from core.query_metrics import stage
+from core.retrieval_cache import RETRIEVAL_CACHE
+from utils.file_utils import file_lock, write_json_atomic
+
+INDEX_DIR = "faiss"
+STATE_FILE = "state.json"
+SYNC_BATCH_SIZE = 1000
+LOAD_ATTEMPTS = 5  # riletture dello stato se la generazione indicata è appena stata rimossa
+
+
+def _faiss():
+    import faiss  # import ritardato: dipendenza necessaria solo per la pipeline Deepseek
+    return faiss
+
+
+class KBFaissIndex:
+    """
+    Indice FAISS (`IndexIDMap2` su `IndexFlatL2`) di una singola KB.
+
+    Gli id interi di FAISS sono mappati sugli id dei chunk del vector store
+    tramite un file JSON affiancato all'indice.
+    """
+
+    def __init__(self, persist_directory):
+        self.persist_directory = persist_directory
+        self.index_dir = os.path.join(persist_directory, INDEX_DIR)
+        self.state_path = os.path.join(self.index_dir, STATE_FILE)
+        self._lock = threading.RLock()
+        self._index = None
+        self._faiss_to_chunk = {}
+        self._state = {}
+        self._state_stat = None  # (inode, mtime_ns) dello stato caricato
+
+    # ---- Caricamento ----
+
+    def _read_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _stat_state(self):
+        try:
+            stat = os.stat(self.state_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _load(self):
+        """
+        Carica (o ricarica) l'indice se su disco è presente una generazione più recente.
+        Se il file di stato non è cambiato (inode e mtime) il costo è un singolo `os.stat`.
+        """
+        for attempt in range(LOAD_ATTEMPTS):
+            stat = self._stat_state()
+            if stat is not None and stat == self._state_stat:
+                return
+            state = self._read_state()
+            if not state.get("index_file") or state.get("index_file") == self._state.get("index_file"):
+                # Nessun indice (KB vuota o mai sincronizzata) o stessa generazione già caricata
+                if not state.get("index_file"):
+                    self._index = None
+                    self._faiss_to_chunk = {}
+                self._state = state
+                self._state_stat = stat
+                return
+            try:
+                self._load_generation(state)
+                self._state_stat = stat
+                return
+            except (RuntimeError, FileNotFoundError):
+                # Generazione rimossa da un altro processo tra la lettura dello stato e quella
+                # dei file: lo stato ora punta a una generazione più recente
+                if attempt == LOAD_ATTEMPTS - 1:
+                    raise
+
+    def _load_generation(self, state):
+        faiss = _faiss()
+        index_path = os.path.join(self.index_dir, state["index_file"])
+        if not os.path.exists(index_path):
+            raise FileNotFoundError(index_path)
+        try:
+            # IO_FLAG_MMAP_IFC mappa anche i vettori di `IndexFlat` (con IO_FLAG_MMAP verrebbero copiati in memoria)
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # Non tutti i tipi di indice supportano il memory-mapping
+            index = faiss.read_index(index_path)
+        with open(os.path.join(self.index_dir, state["ids_file"]), "r", encoding="utf-8") as f:
+            ids = json.load(f)
+        self._index = index
+        self._faiss_to_chunk = {int(faiss_id): chunk_id for faiss_id, chunk_id in ids.items()}
+        self._state = state
+
+    # ---- Sincronizzazione incrementale ----
+
+    def sync(self, vector_store):
+        """
+        Allinea l'indice al contenuto attuale del vector store.
+        Non fa nulla (a parte un `stat`) se la versione della KB non è cambiata.
+        """
+        version = get_kb_version(self.persist_directory)
+        with self._lock:
+            self._load()
+            if self._state and self._state.get("kb_version") == version:
+                return
+            os.makedirs(self.index_dir, exist_ok=True)
+            with file_lock(self.state_path):
+                # Un altro processo potrebbe aver già eseguito la sincronizzazione
+                self._load()
+                if self._state and self._state.get("kb_version") == version:
+                    return
+                self._rebuild_incremental(vector_store, version)
+                self._load()
+
+    def _rebuild_incremental(self, vector_store, version):
+        faiss = _faiss()
+        current_ids = set(vector_store.get(include=[])["ids"])
+        chunk_to_faiss = {chunk_id: faiss_id for faiss_id, chunk_id in self._faiss_to_chunk.items()}
+
+        to_add = [chunk_id for chunk_id in current_ids if chunk_id not in chunk_to_faiss]
+        to_remove = [faiss_id for chunk_id, faiss_id in chunk_to_faiss.items() if chunk_id not in current_ids]
+
+        # L'indice letto in memory-mapping è in sola lettura: si lavora su una copia
+        index = None
+        if self._state.get("index_file"):
+            index = faiss.read_index(os.path.join(self.index_dir, self._state["index_file"]))
+        mapping = dict(self._faiss_to_chunk)
+        next_id = self._state.get("next_id", 0)
+
+        if to_remove and index is not None:
+            index.remove_ids(np.asarray(to_remove, dtype="int64"))
+            for faiss_id in to_remove:
+                mapping.pop(faiss_id, None)
+
+        for start in range(0, len(to_add), SYNC_BATCH_SIZE):
+            batch = vector_store.get(ids=to_add[start:start + SYNC_BATCH_SIZE], include=["embeddings"])
+            if not batch["ids"]:
+                continue
+            vectors = np.asarray(batch["embeddings"], dtype="float32")
+            if index is None:
+                index = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+            faiss_ids = np.arange(next_id, next_id + len(batch["ids"]), dtype="int64")
+            index.add_with_ids(vectors, faiss_ids)
+            for faiss_id, chunk_id in zip(faiss_ids.tolist(), batch["ids"]):
+                mapping[faiss_id] = chunk_id
+            next_id += len(batch["ids"])
+
+        generation = self._state.get("generation", 0) + 1
+        if index is None:
+            # KB vuota: lo stato registra comunque la versione, così le ricerche successive
+            # non ripetono la sincronizzazione
+            write_json_atomic(self.state_path, {"kb_version": version, "generation": generation, "next_id": next_id})
+            return
+
+        # Ogni generazione usa file nuovi, così i lettori che hanno ancora
+        # l'indice precedente in memory-mapping non vengono disturbati.
+        index_file = f"index-{generation}.faiss"
+        ids_file = f"ids-{generation}.json"
+        faiss.write_index(index, os.path.join(self.index_dir, index_file))
+        write_json_atomic(os.path.join(self.index_dir, ids_file), {str(k): v for k, v in mapping.items()})
+        write_json_atomic(self.state_path, {
+            "kb_version": version,
+            "generation": generation,
+            "index_file": index_file,
+            "ids_file": ids_file,
+            "next_id": next_id,
+        })
+        # Si conserva anche la generazione precedente: un lettore che ha appena letto il
+        # vecchio stato trova ancora i suoi file
+        keep = {index_file, ids_file, STATE_FILE}
+        if self._state.get("index_file"):
+            keep.update({self._state["index_file"], self._state["ids_file"]})
+        self._remove_old_generations(keep=keep)
+
+    def _remove_old_generations(self, keep):
+        for name in os.listdir(self.index_dir):
+            if name in keep or name.endswith(".lock"):
+                continue
+            try:
+                os.remove(os.path.join(self.index_dir, name))
+            except OSError:
+                pass  # ancora in uso (es. memory-mapping su Windows): verrà rimosso al prossimo giro
+
+    # ---- Ricerca ----
+
+    def search(self, query_vector, k=5):
+        """
+        Restituisce una lista di (chunk_id, distanza L2) ordinata per distanza.
+        """
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0:
+                return []
+            query = np.asarray([query_vector], dtype="float32")
+            distances, faiss_ids = self._index.search(query, k)
+            mapping = self._faiss_to_chunk
+        return [
+            (mapping[int(faiss_id)], float(distance))
+            for faiss_id, distance in zip(faiss_ids[0], distances[0])
+            if faiss_id != -1 and int(faiss_id) in mapping
+        ]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_kb_index(persist_directory):
+    """Restituisce l'indice FAISS condiviso a livello di processo per la KB."""
+    with _indexes_lock:
+        index = _indexes.get(persist_directory)
+        if index is None:
+            index = KBFaissIndex(persist_directory)
+            _indexes[persist_directory] = index
+        return index
+
+
+def faiss_similarity_search(vector_store, query, k=5):
+    """
+    Similarity search sull'indice FAISS persistente della KB.
+
+    Parameters:
+    - vector_store (VectorStore): Il vector store della KB (fonte dei chunk e degli embedding).
+    - query (str): Il testo della query.
+    - k (int): Numero di risultati.
+
+    Returns:
+    - list of (Document, float): I chunk trovati con la distanza L2.
+    """
+    from langchain_core.documents import Document
+
+    persist_directory = vector_store.path
+    key = RETRIEVAL_CACHE.make_key(persist_directory, get_kb_version(persist_directory), query, k, kind="faiss")
+    cached = RETRIEVAL_CACHE.get(key)
+    if cached is not None:
+        return list(cached)
+
+    with stage("embedding"):
+        query_vector = vector_store.embeddings.embed_query(query)
+    with stage("vector_search"):
+        index = get_kb_index(persist_directory)
+        index.sync(vector_store)
+        hits = index.search(query_vector, k=k)
+        if not hits:
+            return []
+        found = vector_store.get(ids=[chunk_id for chunk_id, _ in hits], include=["documents", "metadatas"])
+    by_id = {
+        chunk_id: Document(page_content=text, metadata=metadata or {})
+        for chunk_id, text, metadata in zip(found["ids"], found["documents"], found["metadatas"])
+    }
+    results = [(by_id[chunk_id], distance) for chunk_id, distance in hits if chunk_id in by_id]
+    RETRIEVAL_CACHE.put(key, results)
+    return list(results)
@@ -0,0 +1,271 @@
+# file_server.py
+
+"""
+Endpoint HTTP leggero per aprire e scaricare i documenti di riferimento.
+
+Prima ogni PDF citato veniva letto per intero e inserito nella pagina come
+URL `data:` in base64, e riletto per il pulsante di download: una risposta
+con un PDF da 50 MB diventava un messaggio websocket da 67 MB ad ogni rerun.
+Ora la pagina contiene solo un link firmato; i byte vengono letti dal disco
+solo quando l'utente apre o scarica il file, con supporto alle richieste
+`Range` (i visualizzatori PDF dei browser caricano le pagine a blocchi).
+
+I link sono firmati con HMAC (percorso e scadenza) e validi solo per file
+nelle cartelle di `FILE_SERVER_ROOTS`. Il segreto viene da
+`FILE_SERVER_SECRET` o da un file generato alla prima esecuzione, così più
+processi dell'app possono servire gli stessi link.
+"""
+
+import base64
+import hashlib
+import hmac
+import logging
+import mimetypes
+import os
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+import requests
+
+from config import (
+    FILE_LINK_TTL,
+    FILE_SERVER_HOST,
+    FILE_SERVER_PORT,
+    FILE_SERVER_PUBLIC_URL,
+    FILE_SERVER_ROOTS,
+    FILE_SERVER_SECRET,
+)
+from utils.file_utils import file_lock
+
+SECRET_FILE = ".file_server_secret"
+CHUNK_SIZE = 64 * 1024
+SERVER_HEADER = "X-RAGnova-Files"
+
+
+def _load_secret():
+    if FILE_SERVER_SECRET:
+        return FILE_SERVER_SECRET.encode("utf-8")
+    with file_lock(SECRET_FILE):
+        if not os.path.exists(SECRET_FILE):
+            fd = os.open(SECRET_FILE, os.O_CREAT | os.O_WRONLY, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(secrets.token_hex(32))
+        with open(SECRET_FILE, "r", encoding="utf-8") as f:
+            return f.read().strip().encode("utf-8")
+
+
+_secret = None
+_secret_lock = threading.Lock()
+
+
+def _get_secret():
+    global _secret
+    with _secret_lock:
+        if _secret is None:
+            _secret = _load_secret()
+        return _secret
+
+
+def _encode_path(path):
+    return base64.urlsafe_b64encode(path.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_path(value):
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode("utf-8")
+
+
+def _signature(encoded_path, expires):
+    message = f"{encoded_path}:{expires}".encode("utf-8")
+    return hmac.new(_get_secret(), message, hashlib.sha256).hexdigest()[:32]
+
+
+def _allowed(path):
+    real = os.path.realpath(path)
+    for root in FILE_SERVER_ROOTS:
+        root = os.path.realpath(root)
+        if real == root or real.startswith(root + os.sep):
+            return True
+    return False
+
+
+def parse_range(header, size):
+    """
+    Interpreta un header `Range: bytes=...` (un solo intervallo).
+
+    Returns:
+    - (int, int) | None | False: (inizio, fine inclusa); None senza header o se non
+      interpretabile (si invia il file intero); False se l'intervallo non è soddisfacibile.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if not start:
+            length = int(end)  # suffisso: ultimi `length` byte
+            if length <= 0 or size == 0:
+                return False  # nessun byte da restituire (anche per un file vuoto)
+            return max(0, size - length), size - 1
+        first = int(start)
+        last = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if first >= size or last < first:
+        return False
+    return first, min(last, size - 1)
+
+
+class FileRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # nessun log per richiesta
+
+    def _error(self, status, message):
+        body = message.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _resolve(self):
+        """Percorso del file richiesto se il link è valido, altrimenti invia l'errore e restituisce None."""
+        url = urlparse(self.path)
+        if url.path == "/health":
+            self.send_response(200)
+            self.send_header(SERVER_HEADER, "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        if not url.path.startswith("/files/"):
+            self._error(404, "Not found")
+            return None
+        query = parse_qs(url.query)
+        encoded = query.get("p", [""])[0]
+        expires = query.get("e", ["0"])[0]
+        signature = query.get("s", [""])[0]
+        if not hmac.compare_digest(signature, _signature(encoded, expires)):
+            self._error(403, "Link non valido")
+            return None
+        if not expires.isdigit() or int(expires) < time.time():
+            self._error(410, "Link scaduto")
+            return None
+        try:
+            path = _decode_path(encoded)
+        except (ValueError, UnicodeDecodeError):
+            self._error(400, "Link non valido")
+            return None
+        if not _allowed(path) or not os.path.isfile(path):
+            self._error(404, "File non trovato")
+            return None
+        self._download = query.get("download", ["0"])[0] == "1"
+        return path
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        path = self._resolve()
+        if path is None:
+            return
+        stat = os.stat(path)
+        size = stat.st_size
+        byte_range = parse_range(self.headers.get("Range"), size)
+        if byte_range is False:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start, end = byte_range or (0, size - 1)
+        length = max(0, end - start + 1)
+
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Last-Modified", self.date_time_string(stat.st_mtime))
+        self.send_header("Cache-Control", "private, max-age=3600")
+        disposition = "attachment" if self._download else "inline"
+        self.send_header("Content-Disposition", f"{disposition}; filename*=UTF-8''{quote(os.path.basename(path))}")
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                try:
+                    self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    return  # il browser ha interrotto la richiesta (es. nuova richiesta Range)
+                remaining -= len(chunk)
+
+
+_server = None
+_server_state = None  # None: non avviato; True: disponibile; False: non disponibile
+_server_lock = threading.Lock()
+
+
+def _other_process_serving(port):
+    try:
+        response = requests.get(f"http://127.0.0.1:{port}/health", timeout=1)
+    except requests.RequestException:
+        return False
+    return response.headers.get(SERVER_HEADER) == "1"
+
+
+def ensure_file_server():
+    """
+    Avvia (una volta per processo) il server dei file in un thread in background.
+    Se la porta è già usata da un altro processo dell'app, usa quello.
+
+    Returns:
+    - bool: True se l'endpoint è disponibile.
+    """
+    global _server, _server_state
+    with _server_lock:
+        if _server_state is not None:
+            return _server_state
+        _get_secret()
+        try:
+            _server = ThreadingHTTPServer((FILE_SERVER_HOST, FILE_SERVER_PORT), FileRequestHandler)
+        except OSError as e:
+            _server_state = _other_process_serving(FILE_SERVER_PORT)
+            if not _server_state:
+                logging.warning("Server dei file non avviato sulla porta %s: %s", FILE_SERVER_PORT, e)
+            return _server_state
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="file-server", daemon=True).start()
+        _server_state = True
+        return True
+
+
+def signed_file_url(file_path, download=False, ttl=FILE_LINK_TTL):
+    """
+    URL firmato per aprire (o scaricare, con `download=True`) un file locale.
+    La scadenza è arrotondata a multipli di `ttl`, così lo stesso file ha lo stesso
+    URL per tutta la finestra e la pagina non cambia ad ogni rerun.
+
+    Returns:
+    - str | None: L'URL, oppure None se il file non è servibile o l'endpoint non è disponibile.
+    """
+    path = os.path.abspath(file_path)
+    if not _allowed(path) or not ensure_file_server():
+        return None
+    expires = (int(time.time()) // ttl + 2) * ttl
+    encoded = _encode_path(path)
+    url = (
+        f"{FILE_SERVER_PUBLIC_URL.rstrip('/')}/files/{quote(os.path.basename(path))}"
+        f"?p={encoded}&e={expires}&s={_signature(encoded, str(expires))}"
+    )
+    return url + "&download=1" if download else url
@@ -1,57 +1,60 @@
+import html
 import platform
 import subprocess
 import os
 import streamlit as st
 import validators
 import mimetypes
-import base64
-import requests
-from bs4 import BeautifulSoup
-from functools import lru_cache
+from core.file_server import signed_file_url
+from core.web_metadata import reference_title
 
 
-@lru_cache(maxsize=128)
-def get_website_title(url):
+def format_response(answer, references, document_manager):
     """
-    Estrae il titolo del sito web dato un URL.
+    Formatta la risposta in Markdown e aggiunge i documenti di riferimento con il nome,
+    un link per aprirli in una nuova scheda se sono PDF, e un pulsante per scaricarli.
+    I riferimenti vengono mostrati subito; una risposta in streaming viene scritta
+    man mano che arrivano i token, nello spazio riservato sopra i riferimenti.
 
     Parameters:
-    - url (str): L'URL del sito web.
+    - answer (str o iterabile di str): Il testo della risposta o lo stream dei suoi frammenti.
+    - references (list of dict): Un elenco di dizionari con dettagli dei documenti di riferimento.
+    - document_manager (DocumentManager): L'istanza di DocumentManager per accedere ai documenti.
 
     Returns:
-    - str: Il titolo del sito web o l'URL stesso se non riesce a estrarlo.
+    - str: Il testo completo della risposta.
     """
-    try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        title_tag = soup.find('title')
-        if title_tag and title_tag.string:
-            return title_tag.string.strip()
-    except Exception as e:
-        st.error(f"Errore nell'estrazione del titolo dal sito {url}: {e}")
-    return url  # Ritorna l'URL se non riesce a estrarre il titolo
+    # Spazio riservato alla risposta, sopra i riferimenti
+    answer_container = st.container()
 
+    render_references(references, document_manager)
 
-def format_response(answer, references, document_manager):
+    with answer_container:
+        if isinstance(answer, str):
+            st.markdown(f"### 📝 Risposta\n\n{answer}\n\n---")
+            return answer
+        st.markdown("### 📝 Risposta")
+        streamed = st.write_stream(answer)
+        stats = getattr(answer, "stats", None)
+        if stats and stats["ttft_ms"] is not None:
+            st.caption(f"⏱️ Primo token in {stats['ttft_ms']:.0f} ms, risposta completa in {stats['total_ms'] / 1000:.1f} s")
+        st.markdown("---")
+    return streamed if isinstance(streamed, str) else "".join(map(str, streamed))
+
+
+def render_references(references, document_manager):
     """
-    Formatta la risposta in Markdown e aggiunge i documenti di riferimento con il nome,
-    un link per aprirli in una nuova scheda se sono PDF, e un pulsante per scaricarli.
+    Mostra i documenti di riferimento con link e pulsanti "Apri" e "Scarica".
 
     Parameters:
-    - answer (str): Il testo della risposta generata dall'IA.
     - references (list of dict): Un elenco di dizionari con dettagli dei documenti di riferimento.
     - document_manager (DocumentManager): L'istanza di DocumentManager per accedere ai documenti.
-
-    Returns:
-    - None: La funzione stampa direttamente nella UI di Streamlit.
     """
-    # Mostra la risposta generata
-    st.markdown(f"### 📝 Risposta\n\n{answer}\n\n---")
-
     if references:
         st.markdown("### 📄 Documenti di Riferimento")
         unique_references = {}
+        # Link firmati forniti dal servizio API (modalità client: i file non sono su questo disco)
+        remote_links = {}
 
         # Filtra i duplicati
         for ref in references:
@@ -62,36 +65,31 @@ def format_response(answer, references, document_manager):
             # Determina se è un file o un URL
             if source_url:
                 if source_url not in unique_references:
-                    unique_references[source_url] = file_name
+                    unique_references[source_url] = (file_name, reference_title(ref))
             elif file_path:
                 if file_path not in unique_references:
-                    unique_references[file_path] = file_name
+                    unique_references[file_path] = (file_name, None)
+                if ref.get("file_url"):
+                    remote_links[file_path] = (ref["file_url"], ref.get("download_url"))
 
         # Crea una riga per ogni documento, con nome e pulsanti/link
-        for ref_key, file_name in unique_references.items():
+        for ref_key, (file_name, title) in unique_references.items():
             col1, col2, col3 = st.columns([3, 1, 1])  # Layout con tre colonne
             with col1:
                 if validators.url(ref_key):
-                    # Ottieni il titolo del sito web
-                    title = get_website_title(ref_key)
-
-                    # Verifica se il file è un PDF
-                    mime_type, _ = mimetypes.guess_type(ref_key)
-                    if mime_type == "application/pdf":
-                        # Crea un link che apre il PDF in una nuova scheda usando base64
-                        pdf_link = create_pdf_link(ref_key, title, document_manager)
-                        st.markdown(f"- **{pdf_link}**", unsafe_allow_html=True)
-                    else:
-                        # Link standard che apre in una nuova scheda con il titolo
-                        st.markdown(
-                            f'- **<a href="{ref_key}" target="_blank">{title}</a>**',
-                            unsafe_allow_html=True
-                        )
+                    # Link standard (anche per i PDF online) che apre in una nuova scheda con il titolo
+                    st.markdown(
+                        f'- **<a href="{ref_key}" target="_blank">{html.escape(title)}</a>**',
+                        unsafe_allow_html=True
+                    )
                 else:
                     # File locale
                     if file_name.lower().endswith('.pdf'):
-                        # Crea un link PDF usando base64
-                        pdf_link = create_pdf_link(ref_key, file_name, document_manager)
+                        # Link firmato all'endpoint dei file: il PDF viene letto solo all'apertura
+                        if ref_key in remote_links:
+                            pdf_link = f'<a href="{remote_links[ref_key][0]}" target="_blank">{file_name}</a>'
+                        else:
+                            pdf_link = create_pdf_link(ref_key, file_name, document_manager)
                         st.markdown(f"- **{pdf_link}**", unsafe_allow_html=True)
                     else:
                         st.markdown(f"- **{file_name}**")  # Mostra il nome del file
@@ -102,31 +100,60 @@ def format_response(answer, references, document_manager):
                     if os.path.exists(ref_key):
                         if st.button("Apri", key=f"open_{ref_key}"):
                             open_file(ref_key)
+                    elif ref_key in remote_links:
+                        st.markdown(f'<a href="{remote_links[ref_key][0]}" target="_blank">Apri</a>',
+                                    unsafe_allow_html=True)
                     else:
                         st.warning("File non trovato")
 
             with col3:
                 if not validators.url(ref_key):
-                    # Aggiungi il pulsante "Download" per scaricare il file
+                    # Link di download: i byte vengono letti solo quando l'utente scarica il file
                     if os.path.exists(ref_key):
-                        with open(ref_key, "rb") as file:
-                            file_data = file.read()
-                        st.download_button(
-                            label="📥 Scarica",
-                            data=file_data,
-                            file_name=os.path.basename(ref_key),
-                            mime=mimetypes.guess_type(ref_key)[0] or "application/octet-stream",
-                            key=f"download_{ref_key}"
-                        )
+                        download_link(ref_key)
+                    elif ref_key in remote_links and remote_links[ref_key][1]:
+                        st.markdown(f'<a href="{remote_links[ref_key][1]}" download>📥 Scarica</a>',
+                                    unsafe_allow_html=True)
                     else:
                         st.warning("File non trovato")
     else:
         st.markdown("Nessun documento di riferimento trovato.")
 
 
+def download_link(file_path):
+    """
+    Mostra il link di download del file servito dall'endpoint dei file. Se il file non è
+    servibile (fuori da `FILE_SERVER_ROOTS` o endpoint non disponibile) il file viene
+    letto solo dopo la richiesta esplicita dell'utente.
+
+    Parameters:
+    - file_path (str): Percorso del file locale.
+    """
+    url = signed_file_url(file_path, download=True)
+    if url:
+        st.markdown(f'<a href="{url}" download>📥 Scarica</a>', unsafe_allow_html=True)
+        return
+    prepared_key = f"download_ready_{file_path}"
+    if not st.session_state.get(prepared_key):
+        if st.button("📥 Scarica", key=f"prepare_{file_path}"):
+            st.session_state[prepared_key] = True
+            st.rerun()
+        return
+    with open(file_path, "rb") as file:
+        st.download_button(
+            label="📥 Salva file",
+            data=file.read(),
+            file_name=os.path.basename(file_path),
+            mime=mimetypes.guess_type(file_path)[0] or "application/octet-stream",
+            key=f"download_{file_path}",
+            on_click=lambda: st.session_state.pop(prepared_key, None)
+        )
+
+
 def create_pdf_link(file_path, file_name, document_manager):
     """
-    Crea un link HTML per aprire un PDF in una nuova scheda del browser usando base64.
+    Crea un link HTML per aprire un PDF in una nuova scheda del browser tramite
+    l'endpoint dei file (link firmato, il PDF non viene incluso nella pagina).
 
     Parameters:
     - file_path (str): Percorso assoluto del file PDF.
@@ -134,22 +161,16 @@ def create_pdf_link(file_path, file_name, document_manager):
     - document_manager (DocumentManager): L'istanza di DocumentManager per accedere ai documenti.
 
     Returns:
-    - str: Link HTML per aprire il PDF.
+    - str: Link HTML per aprire il PDF (il solo nome se il file non è servibile).
     """
     try:
-        # Leggi il contenuto del file PDF
-        with open(file_path, "rb") as f:
-            pdf_data = f.read()
-        # Codifica in base64
-        b64_pdf = base64.b64encode(pdf_data).decode()
-        # Crea un URL data
-        href = f'data:application/pdf;base64,{b64_pdf}'
-        # Crea il link HTML
-        link = f'<a href="{href}" target="_blank">{file_name}</a>'
-        return link
+        href = signed_file_url(file_path)
     except Exception as e:
         st.error(f"Errore nella creazione del link PDF: {e}")
+        href = None
+    if not href:
         return file_name  # Fallback al nome del file senza link
+    return f'<a href="{href}" target="_blank">{file_name}</a>'
 
 
 def open_file(file_path):
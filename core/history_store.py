@@ -0,0 +1,262 @@
+# history_store.py
+
+"""
+Cronologia delle domande in SQLite, in sola aggiunta.
+
+Ogni domanda aggiunge una riga (niente più riscrittura dell'intero
+`chat_log_<utente>.txt`); l'indice per utente permette di leggere solo la
+pagina più recente e di scorrere le precedenti, e un indice full-text (FTS5,
+se disponibile; altrimenti `LIKE`) permette la ricerca. Retention (età
+massima e numero massimo di voci per utente) e compattazione del file sono
+operazioni esplicite, vedi `tools.history_maintenance`.
+
+I vecchi file `chat_log_<utente>.txt` vengono importati al primo accesso
+dell'utente e rinominati in `.migrated`.
+"""
+
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import CHAT_HISTORY_DB
+
+LEGACY_LOG = "chat_log_{user}.txt"
+LEGACY_IMPORT_STALE_SECONDS = 600  # importazioni rimaste a metà (processo terminato) da riprendere
+
+
+class ChatHistoryStore:
+    """Archivio SQLite della cronologia delle domande di tutti gli utenti."""
+
+    def __init__(self, path=CHAT_HISTORY_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self.fts = False
+
+    def _connection(self):
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS chat_history ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, user TEXT NOT NULL, ts REAL NOT NULL, "
+                "kb TEXT, model TEXT, question TEXT NOT NULL, answer TEXT, refs TEXT)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS chat_history_user ON chat_history (user, id)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS legacy_imports (id TEXT PRIMARY KEY, user TEXT, imported_at REAL)"
+            )
+            try:
+                # Indice full-text sincronizzato dai trigger (external content)
+                db.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS chat_history_fts USING fts5("
+                    "question, answer, content='chat_history', content_rowid='id')"
+                )
+                db.executescript(
+                    "CREATE TRIGGER IF NOT EXISTS chat_history_ai AFTER INSERT ON chat_history BEGIN "
+                    "INSERT INTO chat_history_fts (rowid, question, answer) "
+                    "VALUES (new.id, new.question, new.answer); END;"
+                    "CREATE TRIGGER IF NOT EXISTS chat_history_ad AFTER DELETE ON chat_history BEGIN "
+                    "INSERT INTO chat_history_fts (chat_history_fts, rowid, question, answer) "
+                    "VALUES ('delete', old.id, old.question, old.answer); END;"
+                )
+                self.fts = True
+            except sqlite3.OperationalError:
+                self.fts = False  # SQLite senza FTS5: ricerca con LIKE
+            self._db = db
+        return self._db
+
+    @staticmethod
+    def _entry(row):
+        entry_id, ts, kb, model, question, answer, refs = row
+        return {
+            "id": entry_id,
+            "ts": ts,
+            "kb": kb,
+            "model": model,
+            "question": question,
+            "answer": answer,
+            "references": json.loads(refs) if refs else [],
+        }
+
+    def append(self, user, question, answer, references=(), kb=None, model=None, ts=None):
+        """Aggiunge una voce e ne restituisce l'id."""
+        with self._lock:
+            cursor = self._connection().execute(
+                "INSERT INTO chat_history (user, ts, kb, model, question, answer, refs) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user, ts or time.time(), kb, model, question, answer,
+                 json.dumps([list(ref) for ref in references], ensure_ascii=False)),
+            )
+            return cursor.lastrowid
+
+    def page(self, user, limit=20, before_id=None):
+        """
+        Voci dell'utente dalla più recente, `limit` alla volta.
+        Per la pagina successiva passare come `before_id` l'id dell'ultima voce ricevuta.
+        """
+        sql = "SELECT id, ts, kb, model, question, answer, refs FROM chat_history WHERE user = ?"
+        params = [user]
+        if before_id is not None:
+            sql += " AND id < ?"
+            params.append(before_id)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._connection().execute(sql, params).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def search(self, user, text, limit=20):
+        """Voci dell'utente che contengono `text` nella domanda o nella risposta, dalla più recente."""
+        text = text.strip()
+        if not text:
+            return []
+        with self._lock:
+            db = self._connection()
+            if self.fts:
+                # Ogni parola come prefisso, tra virgolette per neutralizzare la sintassi FTS
+                match = " ".join('"{}"*'.format(word.replace('"', '""')) for word in text.split())
+                rows = db.execute(
+                    "SELECT h.id, h.ts, h.kb, h.model, h.question, h.answer, h.refs "
+                    "FROM chat_history_fts f JOIN chat_history h ON h.id = f.rowid "
+                    "WHERE chat_history_fts MATCH ? AND h.user = ? ORDER BY h.id DESC LIMIT ?",
+                    (match, user, limit),
+                ).fetchall()
+            else:
+                # `%` e `_` nel testo cercato sono caratteri letterali
+                escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                pattern = f"%{escaped}%"
+                rows = db.execute(
+                    "SELECT id, ts, kb, model, question, answer, refs FROM chat_history "
+                    "WHERE user = ? AND (question LIKE ? ESCAPE '\\' OR answer LIKE ? ESCAPE '\\') "
+                    "ORDER BY id DESC LIMIT ?",
+                    (user, pattern, pattern, limit),
+                ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def count(self, user):
+        with self._lock:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM chat_history WHERE user = ?", (user,)
+            ).fetchone()[0]
+
+    def apply_retention(self, user=None, max_age_days=None, max_entries=None):
+        """
+        Elimina le voci più vecchie di `max_age_days` e quelle oltre le `max_entries`
+        più recenti per utente (di un solo utente se indicato). Restituisce le voci eliminate.
+        """
+        deleted = 0
+        user_filter, user_params = ("user = ?", [user]) if user else ("1 = 1", [])
+        with self._lock:
+            db = self._connection()
+            if max_age_days:
+                deleted += db.execute(
+                    f"DELETE FROM chat_history WHERE {user_filter} AND ts < ?",
+                    user_params + [time.time() - max_age_days * 86400],
+                ).rowcount
+            if max_entries:
+                users = [user] if user else [row[0] for row in db.execute("SELECT DISTINCT user FROM chat_history")]
+                for name in users:
+                    deleted += db.execute(
+                        "DELETE FROM chat_history WHERE user = ? AND id <= ("
+                        "SELECT id FROM chat_history WHERE user = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                        (name, name, max_entries),
+                    ).rowcount
+        return deleted
+
+    def compact(self):
+        """Ottimizza l'indice full-text e recupera lo spazio delle voci eliminate."""
+        with self._lock:
+            db = self._connection()
+            if self.fts:
+                db.execute("INSERT INTO chat_history_fts (chat_history_fts) VALUES ('optimize')")
+            db.execute("VACUUM")
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def import_legacy_log(self, user, path=None):
+        """
+        Importa (una sola volta) il vecchio file JSONL `chat_log_<utente>.txt`,
+        poi lo rinomina in `.migrated`. Restituisce le voci importate.
+
+        Il file viene prima rinominato con un nome univoco `.importing-<istante>-<id>`:
+        tra più processi solo quello che riesce nella rinomina lo importa, gli altri non
+        trovano più il file. Un `.importing-*` rimasto da più di `LEGACY_IMPORT_STALE_SECONDS`
+        (processo terminato durante l'importazione) viene ripreso con lo stesso id, che è
+        registrato nella transazione delle voci: un file già importato non viene duplicato.
+        """
+        path = path or LEGACY_LOG.format(user=user)
+        claims = [(path, uuid.uuid4().hex)]
+        for stale in glob.glob(glob.escape(path) + ".importing-*"):
+            claimed_at, _, import_id = stale.rsplit(".importing-", 1)[1].partition("-")
+            try:
+                if import_id and time.time() - float(claimed_at) > LEGACY_IMPORT_STALE_SECONDS:
+                    claims.append((stale, import_id))
+            except ValueError:
+                continue
+        imported = 0
+        for source, import_id in claims:
+            importing = f"{path}.importing-{int(time.time())}-{import_id}"
+            try:
+                os.replace(source, importing)
+            except FileNotFoundError:
+                continue  # importato (o ripreso) da un altro processo
+            try:
+                imported += self._import_entries(user, importing, import_id)
+            except Exception:
+                os.replace(importing, source)  # l'importazione verrà ritentata al prossimo accesso
+                raise
+            migrated = path + ".migrated"
+            if os.path.exists(migrated):
+                migrated += f"-{import_id}"
+            os.replace(importing, migrated)
+        return imported
+
+    def _import_entries(self, user, path, import_id):
+        entries = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        # Le voci storiche non hanno data: conservano l'ordine con istanti crescenti
+        base = os.path.getmtime(path) - len(entries)
+        with self._lock:
+            db = self._connection()
+            db.execute("BEGIN")
+            try:
+                if db.execute("SELECT 1 FROM legacy_imports WHERE id = ?", (import_id,)).fetchone():
+                    db.execute("COMMIT")
+                    return 0  # importato prima che il processo terminasse
+                db.execute(
+                    "INSERT INTO legacy_imports (id, user, imported_at) VALUES (?, ?, ?)",
+                    (import_id, user, time.time()),
+                )
+                db.executemany(
+                    "INSERT INTO chat_history (user, ts, question, answer, refs) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (user, base + i, entry.get("question", ""), entry.get("answer", ""),
+                         json.dumps(entry.get("references", []), ensure_ascii=False))
+                        for i, entry in enumerate(entries)
+                    ],
+                )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return len(entries)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_history_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ChatHistoryStore()
+        return _store
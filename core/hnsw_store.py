@@ -0,0 +1,642 @@
+# hnsw_store.py
+
+"""
+Backend vettoriale in-process: grafo HNSW su vettori in memory-mapping.
+
+Struttura della cartella della KB:
+- `hnsw_meta.json`: parametri dell'indice, numero di nodi, entry point e nomi
+  dei file della generazione corrente (viene riscritto per ultimo ed è il
+  punto di commit di ogni scrittura);
+- `vectors-<g>.bin`: matrice (capacità x dim) float32 o float16 in memory-mapping;
+- `graph_l0-<g>.bin`: vicini del livello 0 (capacità x 2M) int32 in memory-mapping;
+- `graph_upper-<g>.json`: livelli e vicini dei pochi nodi dei livelli superiori;
+- `rows-<g>.bin`: riga dei metadati di ogni nodo (solo dopo una compattazione);
+- `metadata.sqlite`: testo e metadati dei chunk, con tombstone per le eliminazioni.
+
+L'apertura legge solo il file JSON e mappa i file binari, quindi richiede
+pochi millisecondi; le pagine dei vettori sono condivise tra i processi
+worker che aprono la stessa KB.
+
+Le scritture non modificano mai le righe visibili ai lettori: i file le cui
+righe cambiano (il grafo) o che devono crescere vengono copiati in una nuova
+generazione, negli altri si aggiungono solo righe oltre il numero di nodi
+pubblicato. Un processo che legge la generazione precedente continua quindi a
+vedere un indice coerente finché non rilegge `hnsw_meta.json`.
+
+Costo: ogni aggiunta (una chiamata a `add_embeddings`, qualunque sia il numero
+di chunk) riscrive l'intero `graph_l0` (capacità x 2M x 4 byte, ~13 MB ogni 100k
+righe di capacità con M=16); eliminazioni e ricerche non copiano nulla. Conviene quindi
+aggiungere i chunk a blocchi (come fanno `DocumentManager`, un documento per
+scrittura, e `tools.bulk_index` con `--batch-size`): `graph_copy_bytes` e
+`tools.benchmark_vector_store` riportano il costo di una scrittura.
+"""
+
+import copy
+import heapq
+import json
+import math
+import os
+import random
+import re
+import sqlite3
+import threading
+import uuid
+
+import numpy as np
+
+from core.vector_store import VectorStore
+from utils.file_utils import file_lock, write_json_atomic
+
+META_FILE = "hnsw_meta.json"
+METADATA_FILE = "metadata.sqlite"
+MIN_CAPACITY = 1024
+COPY_BLOCK_BYTES = 16 * 1024 * 1024
+LOAD_ATTEMPTS = 5  # riletture dei metadati se la generazione indicata è appena stata rimossa
+# File dell'indice delle KB create prima delle generazioni
+LEGACY_FILES = {"vectors": "vectors.bin", "graph": "graph_l0.bin", "upper": "graph_upper.json", "codes": "codes.bin"}
+INDEX_FILE_PATTERN = re.compile(r"^(vectors|graph_l0|graph_upper|codes|rows)(-\d+)?\.(bin|json)$")
+
+
+class HNSWVectorStore(VectorStore):
+    """
+    Vector store basato su un grafo HNSW (Hierarchical Navigable Small World).
+
+    Le eliminazioni sono logiche (tombstone nella tabella dei metadati): i nodi
+    eliminati restano nel grafo come nodi di transito e vengono esclusi dai
+    risultati; `compact()` ricostruisce l'indice senza di essi.
+    """
+
+    backend_name = "hnsw"
+
+    def __init__(self, persist_directory, embedding_function, dtype="float32", M=16,
+                 ef_construction=100, ef_search=64):
+        super().__init__(persist_directory, embedding_function)
+        os.makedirs(persist_directory, exist_ok=True)
+        self.meta_path = os.path.join(persist_directory, META_FILE)
+        self._lock = threading.RLock()
+        self._meta = {
+            "backend": self.backend_name,
+            "dtype": dtype,
+            "dim": None,
+            "M": M,
+            "ef_construction": ef_construction,
+            "count": 0,
+            "capacity": 0,
+            "entry_point": None,
+            "max_level": -1,
+            "generation": 0,
+        }
+        self.ef_search = ef_search
+        self._meta_mtime = None
+        self._vectors = None
+        self._graph = None
+        self._rows = None
+        self._levels = {}
+        self._upper = {}
+
+        self._db = sqlite3.connect(
+            os.path.join(persist_directory, METADATA_FILE),
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, doc_id TEXT, "
+            "document TEXT, metadata TEXT, deleted INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc_id ON chunks(doc_id)")
+        self._refresh()
+
+    # ---- Gestione file ----
+
+    @property
+    def dim(self):
+        return self._meta["dim"]
+
+    @property
+    def dtype(self):
+        return np.dtype(self._meta["dtype"])
+
+    @property
+    def max_connections(self):
+        return self._meta["M"]
+
+    def _file(self, name):
+        return os.path.join(self.persist_directory, name)
+
+    @property
+    def _next_row(self):
+        """Prima riga dei metadati non ancora pubblicata: le righe successive vengono ignorate."""
+        return self._meta.get("next_row", self._meta["count"])
+
+    def _files(self):
+        """Nomi dei file della generazione corrente."""
+        if "files" in self._meta:
+            return self._meta["files"]
+        if not self._meta["capacity"]:
+            return {}
+        return {key: name for key, name in LEGACY_FILES.items() if os.path.exists(self._file(name))}
+
+    def _file_layout(self):
+        """
+        File con una riga per nodo: chiave -> (prefisso, dtype, colonne, valore iniziale, copia).
+        I file con `copia` vengono riscritti in una nuova generazione a ogni scrittura perché
+        le loro righe cambiano; gli altri solo quando cresce la capacità.
+        """
+        layout = {
+            "vectors": ("vectors", self.dtype, self.dim, 0, False),
+            "graph": ("graph_l0", np.int32, 2 * self.max_connections, -1, True),
+        }
+        if self._meta.get("row_map"):
+            layout["rows"] = ("rows", np.int64, None, 0, False)
+        return layout
+
+    def _refresh(self):
+        """Rilegge l'indice se un'altra istanza (o processo) lo ha modificato."""
+        for attempt in range(LOAD_ATTEMPTS):
+            try:
+                mtime = os.stat(self.meta_path).st_mtime_ns
+            except FileNotFoundError:
+                return
+            if mtime == self._meta_mtime:
+                return
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self._meta.update(json.load(f))
+            try:
+                self._load_index_state()
+                self._map_files("r")
+            except FileNotFoundError:
+                # Generazione rimossa da un altro processo dopo la lettura dei metadati
+                if attempt == LOAD_ATTEMPTS - 1:
+                    raise
+                continue
+            self._meta_mtime = mtime
+            return
+
+    def _load_index_state(self):
+        name = self._files().get("upper")
+        upper = {"levels": {}, "links": {}}
+        if name:
+            with open(self._file(name), "r", encoding="utf-8") as f:
+                upper = json.load(f)
+        self._levels = {int(node): level for node, level in upper["levels"].items()}
+        self._upper = {
+            int(node): {int(level): neighbors for level, neighbors in links.items()}
+            for node, links in upper["links"].items()
+        }
+
+    def _save_index_state(self, generation):
+        name = f"graph_upper-{generation}.json"
+        write_json_atomic(self._file(name), {
+            "levels": {str(node): level for node, level in self._levels.items()},
+            "links": {
+                str(node): {str(level): neighbors for level, neighbors in links.items()}
+                for node, links in self._upper.items()
+            },
+        })
+        self._meta["files"]["upper"] = name
+
+    def _map_files(self, mode):
+        capacity = self._meta["capacity"]
+        files = self._files()
+        for key, (_, dtype, width, _, _) in self._file_layout().items():
+            mapped = None
+            if capacity and files.get(key):
+                shape = (capacity, width) if width else (capacity,)
+                mapped = np.memmap(self._file(files[key]), dtype=dtype, mode=mode, shape=shape)
+            setattr(self, f"_{key}", mapped)
+
+    def _copy_rows(self, source, name, dtype, width, fill, capacity):
+        """Crea `name` con `capacity` righe: le prime `count` copiate da `source`, le altre a `fill`."""
+        row_bytes = np.dtype(dtype).itemsize * (width or 1)
+        copied = self._meta["count"] if source else 0
+        with open(self._file(name), "wb") as target:
+            if copied:
+                with open(self._file(source), "rb") as f:
+                    remaining = copied * row_bytes
+                    while remaining:
+                        block = f.read(min(remaining, COPY_BLOCK_BYTES))
+                        if not block:
+                            break
+                        target.write(block)
+                        remaining -= len(block)
+            if fill == 0:
+                target.truncate(capacity * row_bytes)
+            else:
+                block_rows = max(1, COPY_BLOCK_BYTES // row_bytes)
+                for start in range(copied, capacity, block_rows):
+                    rows = min(block_rows, capacity - start)
+                    target.write(np.full(rows * (width or 1), fill, dtype=dtype).tobytes())
+        return name
+
+    def _begin_generation(self, needed):
+        """
+        Prepara i file della generazione successiva per una scrittura di righe fino a `needed`
+        e li mappa in scrittura. Restituisce i file della generazione corrente.
+        """
+        previous = dict(self._files())
+        capacity = self._meta["capacity"]
+        new_capacity = capacity if needed <= capacity else max(needed, 2 * capacity, MIN_CAPACITY)
+        generation = self._meta.get("generation", 0) + 1
+        files = {key: name for key, name in previous.items() if key != "upper"}
+        # I file non possono essere copiati o estesi mentre sono mappati (Windows)
+        for key in self._file_layout():
+            setattr(self, f"_{key}", None)
+        for key, (prefix, dtype, width, fill, always_copy) in self._file_layout().items():
+            if files.get(key) and not always_copy and new_capacity == capacity:
+                continue  # righe aggiunte oltre quelle pubblicate: il file resta condiviso
+            files[key] = self._copy_rows(files.get(key), f"{prefix}-{generation}.bin", dtype, width, fill,
+                                         new_capacity)
+        self._meta.update(generation=generation, capacity=new_capacity, files=files)
+        self._map_files("r+")
+        return previous
+
+    def _create_row_file(self, key, layout):
+        """
+        Aggiunge alla generazione in scrittura un file per nodo vuoto (es. dopo un addestramento),
+        descritto da `layout` come le voci di `_file_layout`.
+        """
+        prefix, dtype, width, fill, _ = layout
+        name = f"{prefix}-{self._meta['generation']}.bin"
+        self._copy_rows(None, name, dtype, width, fill, self._meta["capacity"])
+        self._meta["files"][key] = name
+        self._map_files("r+")
+
+    def _commit(self, previous):
+        """Pubblica la generazione in scrittura: da questo momento le modifiche sono visibili."""
+        for key in self._file_layout():
+            mapped = getattr(self, f"_{key}")
+            if mapped is not None:
+                mapped.flush()
+        self._save_index_state(self._meta["generation"])
+        write_json_atomic(self.meta_path, self._meta)
+        # Si conserva anche la generazione precedente: un lettore che ha appena letto i
+        # vecchi metadati trova ancora i suoi file
+        self._remove_old_files(keep=set(self._files().values()) | set(previous.values()))
+        self._meta_mtime = None
+        self._refresh()
+
+    def _remove_old_files(self, keep):
+        for name in os.listdir(self.persist_directory):
+            if name in keep or not INDEX_FILE_PATTERN.match(name):
+                continue
+            try:
+                os.remove(self._file(name))
+            except OSError:
+                pass  # ancora mappato (Windows): verrà rimosso alla prossima scrittura
+
+    def _snapshot(self):
+        return copy.deepcopy((self._meta, self._levels, self._upper))
+
+    def _rollback(self, snapshot):
+        """Ripristina lo stato pubblicato dopo una scrittura fallita."""
+        self._meta, self._levels, self._upper = snapshot
+        self._map_files("r")
+        self._meta_mtime = None
+
+    def _node_rows(self, nodes):
+        """Righe dei metadati dei nodi (coincidono con i nodi finché la KB non viene compattata)."""
+        if self._rows is None:
+            return [int(node) for node in nodes]
+        return self._rows[nodes].tolist()
+
+    def _row_nodes(self, rows):
+        if self._rows is None:
+            return list(rows)
+        # Le righe crescono con i nodi: ricerca binaria
+        return np.searchsorted(self._rows[:self._meta["count"]], rows).tolist()
+
+    # ---- Algoritmo HNSW ----
+
+    def _distances(self, query, nodes):
+        vectors = np.asarray(self._vectors[nodes], dtype="float32")
+        diff = vectors - query
+        return np.einsum("ij,ij->i", diff, diff)
+
+    def _neighbors(self, node, level):
+        if level == 0:
+            row = self._graph[node]
+            return row[row >= 0].tolist()
+        return self._upper.get(node, {}).get(level, [])
+
+    def _set_neighbors(self, node, level, neighbors):
+        if level == 0:
+            row = np.full(2 * self.max_connections, -1, dtype="int32")
+            row[:len(neighbors)] = neighbors
+            self._graph[node] = row
+        else:
+            self._upper.setdefault(node, {})[level] = list(neighbors)
+
+    def _search_layer(self, query, entry_points, ef, level):
+        """Ricerca greedy su un livello: restituisce fino a `ef` (distanza, nodo) ordinati."""
+        distances = self._distances(query, entry_points)
+        visited = set(entry_points)
+        candidates = [(float(d), node) for d, node in zip(distances, entry_points)]
+        heapq.heapify(candidates)
+        results = [(-d, node) for d, node in candidates]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            distance, node = heapq.heappop(candidates)
+            if distance > -results[0][0] and len(results) >= ef:
+                break
+            fresh = [n for n in self._neighbors(node, level) if n not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+            for d, neighbor in zip(self._distances(query, fresh), fresh):
+                d = float(d)
+                if len(results) < ef or d < -results[0][0]:
+                    heapq.heappush(candidates, (d, neighbor))
+                    heapq.heappush(results, (-d, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted((-d, node) for d, node in results)
+
+    def _random_level(self, rng):
+        return int(-math.log(1.0 - rng.random()) / math.log(self.max_connections))
+
+    def _insert(self, node, rng):
+        query = np.asarray(self._vectors[node], dtype="float32")
+        level = self._random_level(rng)
+        if level > 0:
+            self._levels[node] = level
+        entry_point = self._meta["entry_point"]
+        max_level = self._meta["max_level"]
+        if entry_point is None:
+            self._meta["entry_point"], self._meta["max_level"] = node, level
+            return
+
+        entry = [entry_point]
+        for current in range(max_level, level, -1):
+            entry = [self._search_layer(query, entry, 1, current)[0][1]]
+
+        for current in range(min(level, max_level), -1, -1):
+            found = self._search_layer(query, entry, self._meta["ef_construction"], current)
+            selected = [n for _, n in found[:self.max_connections]]
+            self._set_neighbors(node, current, selected)
+            limit = 2 * self.max_connections if current == 0 else self.max_connections
+            for neighbor in selected:
+                links = self._neighbors(neighbor, current) + [node]
+                if len(links) > limit:
+                    base = np.asarray(self._vectors[neighbor], dtype="float32")
+                    order = np.argsort(self._distances(base, links))[:limit]
+                    links = [links[i] for i in order]
+                self._set_neighbors(neighbor, current, links)
+            entry = [n for _, n in found]
+
+        if level > max_level:
+            self._meta["entry_point"], self._meta["max_level"] = node, level
+
+    def _index_rows(self, start, vectors):
+        """Inserisce nel grafo le righe appena scritte a partire da `start`."""
+        rng = random.Random(start)
+        for node in range(start, start + len(vectors)):
+            self._insert(node, rng)
+
+    def _candidate_search(self, query, k):
+        """Ricerca senza filtri: restituisce (distanza, nodo) ordinati, tombstone incluse."""
+        return self._graph_search(query, k)
+
+    def _graph_search(self, query, k):
+        entry_point = self._meta["entry_point"]
+        if entry_point is None:
+            return []
+        entry = [entry_point]
+        for level in range(self._meta["max_level"], 0, -1):
+            entry = [self._search_layer(query, entry, 1, level)[0][1]]
+        # I nodi eliminati restano nel grafo: si allarga la ricerca per compensarli
+        ef = max(self.ef_search, k + min(self._meta.get("deleted", 0), 4 * k))
+        return self._search_layer(query, entry, ef, 0)
+
+    # ---- Metadati ----
+
+    @staticmethod
+    def _where_sql(where):
+        """Traduce un filtro in stile Chroma (`$eq`/`$in`, eventualmente in `$and`) in SQL."""
+        if not where:
+            return "", []
+        conditions = where["$and"] if "$and" in where else [{k: v} for k, v in where.items()]
+        clauses, params = [], []
+        for condition in conditions:
+            for key, value in condition.items():
+                if isinstance(value, dict) and "$eq" in value:
+                    value = value["$eq"]
+                values = list(value["$in"]) if isinstance(value, dict) and "$in" in value else [value]
+                if not values:
+                    clauses.append("0")
+                    continue
+                placeholders = ", ".join("?" for _ in values)
+                if key == "doc_id":
+                    clauses.append(f"doc_id IN ({placeholders})")
+                else:
+                    clauses.append(f"json_extract(metadata, ?) IN ({placeholders})")
+                    params.append(f'$."{key}"')
+                params.extend(values)
+        return " AND " + " AND ".join(clauses), params
+
+    def _rows_to_documents(self, rows):
+        from langchain_core.documents import Document
+        return {
+            row: Document(page_content=document or "", metadata=json.loads(metadata or "{}"))
+            for row, document, metadata in rows
+        }
+
+    # ---- Interfaccia VectorStore ----
+
+    def add_documents(self, documents, ids=None):
+        texts = [doc.page_content for doc in documents]
+        embeddings = self.embedding_function.embed_documents(texts)
+        return self.add_embeddings(texts, embeddings, [doc.metadata for doc in documents], ids=ids)
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        """Aggiunge chunk con embedding già calcolati e restituisce i loro id."""
+        if not texts:
+            return []
+        with self._lock, file_lock(self.meta_path):
+            self._refresh()
+            return self._append(texts, embeddings, metadatas, ids)
+
+    def _append(self, texts, embeddings, metadatas=None, ids=None):
+        """Scrittura vera e propria: va chiamata con i lock acquisiti."""
+        if not texts:
+            return []
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = np.asarray(embeddings, dtype="float32")
+        snapshot = self._snapshot()
+        if self._meta["dim"] is None:
+            self._meta["dim"] = int(vectors.shape[1])
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Dimensione degli embedding {vectors.shape[1]} diversa da {self.dim}.")
+
+        start = self._meta["count"]
+        first_row = self._next_row
+        rows = list(range(first_row, first_row + len(texts)))
+        try:
+            previous = self._begin_generation(start + len(texts))
+            self._vectors[start:start + len(texts)] = vectors.astype(self.dtype)
+            if self._rows is not None:
+                self._rows[start:start + len(texts)] = rows
+            self._index_rows(start, vectors)
+            self._meta["count"] = start + len(texts)
+            self._meta["next_row"] = first_row + len(texts)
+
+            self._db.execute("BEGIN")
+            # Righe di una scrittura interrotta prima della pubblicazione
+            self._db.execute("DELETE FROM chunks WHERE row >= ?", (first_row,))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO chunks (row, id, doc_id, document, metadata) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (row, chunk_id, metadata.get("doc_id"), text, json.dumps(metadata, ensure_ascii=False))
+                    for row, chunk_id, text, metadata in zip(rows, ids, texts, metadatas)
+                ],
+            )
+            self._db.execute("COMMIT")
+            self._commit(previous)
+        except BaseException:
+            if self._db.in_transaction:
+                self._db.execute("ROLLBACK")
+            self._db.execute("DELETE FROM chunks WHERE row >= ?", (first_row,))
+            self._rollback(snapshot)
+            raise
+        return ids
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=None):
+        sql = "SELECT row, id, document, metadata FROM chunks WHERE deleted = 0 AND row < ?"
+        params = []
+        if ids is not None:
+            ids = list(ids)
+            if not ids:
+                return {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+            sql += f" AND id IN ({','.join('?' * len(ids))})"
+            params.extend(ids)
+        where_sql, where_params = self._where_sql(where)
+        sql += where_sql + " ORDER BY row"
+        params.extend(where_params)
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit, offset or 0])
+
+        with self._lock:
+            self._refresh()
+            rows = self._db.execute(sql, [self._next_row] + params).fetchall()
+            result = {"ids": [chunk_id for _, chunk_id, _, _ in rows]}
+            if "documents" in include:
+                result["documents"] = [document for _, _, document, _ in rows]
+            if "metadatas" in include:
+                result["metadatas"] = [json.loads(metadata or "{}") for _, _, _, metadata in rows]
+            if "embeddings" in include:
+                nodes = self._row_nodes([row for row, _, _, _ in rows])
+                result["embeddings"] = (
+                    np.asarray(self._vectors[nodes], dtype="float32").tolist() if nodes else []
+                )
+        return result
+
+    def delete(self, ids=None, where=None):
+        sql = "UPDATE chunks SET deleted = 1 WHERE deleted = 0"
+        params = []
+        if ids is not None:
+            ids = list(ids)
+            sql += f" AND id IN ({','.join('?' * len(ids))})"
+            params.extend(ids)
+        where_sql, where_params = self._where_sql(where)
+        with self._lock, file_lock(self.meta_path):
+            self._refresh()
+            self._db.execute(sql + where_sql, params + where_params)
+            self._meta["deleted"] = self._db.execute(
+                "SELECT COUNT(*) FROM chunks WHERE deleted = 1"
+            ).fetchone()[0]
+            write_json_atomic(self.meta_path, self._meta)
+
+    def count(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM chunks WHERE deleted = 0 AND row < ?", (self._next_row,)
+            ).fetchone()[0]
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None):
+        query = np.asarray(embedding, dtype="float32")
+        with self._lock:
+            self._refresh()
+            if self._vectors is None:
+                return []
+            if filter:
+                # Ricerca esatta sul sottoinsieme filtrato (di solito piccolo)
+                where_sql, params = self._where_sql(filter)
+                rows = [row for (row,) in self._db.execute(
+                    "SELECT row FROM chunks WHERE deleted = 0 AND row < ?" + where_sql, [self._next_row] + params
+                )]
+                if not rows:
+                    return []
+                distances = self._distances(query, self._row_nodes(rows))
+                order = np.argsort(distances)[:k]
+                found = [(float(distances[i]), rows[i]) for i in order]
+            else:
+                found = self._candidate_search(query, k)
+                rows = self._node_rows([node for _, node in found])
+                found = [(distance, row) for (distance, _), row in zip(found, rows)]
+
+            rows = [row for _, row in found]
+            documents = self._rows_to_documents(self._db.execute(
+                f"SELECT row, document, metadata FROM chunks WHERE deleted = 0 "
+                f"AND row IN ({','.join('?' * len(rows))})",
+                rows,
+            ).fetchall()) if rows else {}
+        return [(documents[row], distance) for distance, row in found if row in documents][:k]
+
+    def compact(self):
+        """
+        Ricostruisce l'indice escludendo i chunk eliminati.
+
+        La nuova generazione viene scritta in file nuovi e pubblicata solo a ricostruzione
+        completata: in caso di errore la KB resta invariata e durante la ricostruzione i
+        lettori continuano a usare l'indice precedente.
+        """
+        with self._lock, file_lock(self.meta_path):
+            self._refresh()
+            rows = [row for (row,) in self._db.execute(
+                "SELECT row FROM chunks WHERE deleted = 0 AND row < ? ORDER BY row", (self._next_row,)
+            )]
+            vectors = np.asarray(self._vectors[self._row_nodes(rows)], dtype="float32") if rows else None
+            snapshot = self._snapshot()
+            previous = dict(self._files())
+            try:
+                # Le righe dei metadati non cambiano: i nodi le ritrovano tramite `rows-<g>.bin`
+                self._meta.update({"count": 0, "capacity": 0, "files": {}, "entry_point": None,
+                                   "max_level": -1, "deleted": 0, "row_map": True})
+                self._levels, self._upper = {}, {}
+                if rows:
+                    self._begin_generation(len(rows))
+                    self._vectors[:len(rows)] = vectors.astype(self.dtype)
+                    self._rows[:len(rows)] = rows
+                    self._index_rows(0, vectors)
+                    self._meta["count"] = len(rows)
+                else:
+                    self._meta["generation"] = self._meta.get("generation", 0) + 1
+                self._commit(previous)
+            except BaseException:
+                self._rollback(snapshot)
+                raise
+            # Le tombstone non sono più nodi di nessuna generazione pubblicata
+            self._db.execute("DELETE FROM chunks WHERE deleted = 1")
+
+    def memory_footprint(self):
+        """Byte delle strutture lette da ogni ricerca (vettori e grafo del livello 0)."""
+        count = self._meta["count"]
+        if not count:
+            return 0
+        return count * (self.dim * self.dtype.itemsize + 2 * self.max_connections * 4)
+
+    def graph_copy_bytes(self):
+        """Byte del grafo del livello 0 copiati in una nuova generazione da ogni aggiunta."""
+        return self._meta["capacity"] * 2 * self.max_connections * 4
+
+    def close(self):
+        with self._lock:
+            for key in self._file_layout():
+                setattr(self, f"_{key}", None)
+            self._db.close()
@@ -0,0 +1,171 @@
+# hyde.py
+
+"""
+HyDE speculativo: espansione della query e retrieval in parallelo.
+
+La generazione della risposta ipotetica parte in background mentre il
+retrieval sulla domanda originale procede normalmente. Se la risposta
+ipotetica arriva entro la scadenza (`HYDE_DEADLINE`), si esegue anche la
+ricerca con la query espansa e i due elenchi vengono fusi con la Reciprocal
+Rank Fusion; altrimenti si restituiscono i risultati della sola domanda.
+Una generazione arrivata in ritardo non va persa: finisce comunque nella
+cache delle risposte ipotetiche (per modello e domanda) e la volta successiva
+l'espansione è immediata.
+"""
+
+import contextvars
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from config import HYDE_CACHE_SIZE, HYDE_CACHE_TTL, HYDE_DEADLINE, HYDE_MAX_WORKERS
+
+RRF_K = 60  # costante della Reciprocal Rank Fusion
+
+
+class HypotheticalAnswerCache:
+    """Cache LRU thread-safe, con scadenza, delle risposte ipotetiche per (modello, domanda)."""
+
+    def __init__(self, max_entries=HYDE_CACHE_SIZE, ttl=HYDE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model, query):
+        return (model, " ".join(query.lower().split()))
+
+    def get(self, model, query):
+        key = self.make_key(model, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, model, query, answer):
+        key = self.make_key(model, query)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+HYDE_CACHE = HypotheticalAnswerCache()
+HYDE_STATS = {"merged": 0, "timeouts": 0, "errors": 0}
+_stats_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=HYDE_MAX_WORKERS, thread_name_prefix="hyde")
+_pending = {}  # generazioni in corso, condivise da domande identiche contemporanee
+_pending_lock = threading.Lock()
+
+
+def _count(event):
+    with _stats_lock:
+        HYDE_STATS[event] += 1
+
+
+def _document_key(doc):
+    metadata = doc.metadata or {}
+    return (metadata.get("doc_id") or metadata.get("file_path") or metadata.get("source_url"),
+            metadata.get("chunk_index"), doc.page_content)
+
+
+def merge_results(result_lists, k):
+    """
+    Fonde più elenchi ordinati di (Document, punteggio) con la Reciprocal Rank Fusion.
+    I punteggi originali non sono confrontabili tra query diverse: conta solo la posizione.
+
+    Returns:
+    - list of Document: Al più `k` documenti, dal più rilevante.
+    """
+    fused = {}
+    documents = {}
+    for results in result_lists:
+        for rank, (doc, _) in enumerate(results):
+            key = _document_key(doc)
+            documents.setdefault(key, doc)
+            fused[key] = fused.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+    ranked = sorted(fused, key=fused.get, reverse=True)
+    return [documents[key] for key in ranked[:k]]
+
+
+def _submit_generation(model, query, generate):
+    """Avvia (o riusa, se già in corso) la generazione della risposta ipotetica."""
+    key = HypotheticalAnswerCache.make_key(model, query)
+    with _pending_lock:
+        future = _pending.get(key)
+        if future is not None:
+            return future
+
+        def run():
+            try:
+                answer = generate(query)
+                HYDE_CACHE.put(model, query, answer)
+                return answer
+            finally:
+                with _pending_lock:
+                    _pending.pop(key, None)
+
+        # La traccia della domanda (ContextVar) segue la generazione nel thread del pool
+        future = _executor.submit(contextvars.copy_context().run, run)
+        _pending[key] = future
+        return future
+
+
+def speculative_hyde_search(query, search, generate, model, k=5, deadline=HYDE_DEADLINE):
+    """
+    Retrieval con HyDE speculativo.
+
+    Parameters:
+    - query (str): La domanda.
+    - search (callable): search(testo) -> list of (Document, punteggio), dal più rilevante.
+    - generate (callable): generate(domanda) -> risposta ipotetica (può sollevare eccezioni).
+    - model (str): Modello che genera la risposta ipotetica (parte della chiave di cache).
+    - k (int): Numero di documenti restituiti.
+    - deadline (float): Secondi, dall'inizio della chiamata, entro cui attendere l'espansione.
+
+    Returns:
+    - list of Document: I documenti fusi, o quelli della sola domanda se l'espansione non è arrivata.
+    """
+    start = time.monotonic()
+    hypothetical = HYDE_CACHE.get(model, query)
+    future = None if hypothetical is not None else _submit_generation(model, query, generate)
+
+    plain = search(query)
+
+    if future is not None:
+        try:
+            hypothetical = future.result(timeout=max(0.0, deadline - (time.monotonic() - start)))
+        except FutureTimeoutError:
+            _count("timeouts")
+            logging.info("HyDE: espansione non arrivata entro %.1f s, uso la sola domanda", deadline)
+            return [doc for doc, _ in plain[:k]]
+        except Exception as e:
+            _count("errors")
+            logging.warning("HyDE: espansione della query non riuscita: %s", e)
+            return [doc for doc, _ in plain[:k]]
+
+    if not hypothetical:
+        return [doc for doc, _ in plain[:k]]
+    expanded = search(f"{query}\n{hypothetical}")
+    _count("merged")
+    return merge_results([plain, expanded], k)
@@ -0,0 +1,273 @@
+# ingestion_jobs.py
+
+"""
+Coda persistente dei job di scrittura sulle knowledge base (SQLite).
+
+Il servizio API (`api_server.py`) gira con più worker che condividono le KB
+su disco: ogni richiesta di indicizzazione o eliminazione diventa un job in
+`API_JOBS_DB`, e i thread `IngestionWorker` di qualunque processo se lo
+aggiudicano con una transazione `BEGIN IMMEDIATE`. Per ogni KB viene eseguito
+un solo job alla volta, quindi le scritture su una KB sono serializzate tra
+tutti i processi; lo stato del job è leggibile da qualunque worker.
+
+Mentre esegue un job il worker ne aggiorna l'heartbeat ogni
+`API_JOB_HEARTBEAT_SECONDS`; a ogni `claim` i job "running" senza heartbeat da
+più di `API_JOB_STALE_SECONDS` (worker terminato durante l'esecuzione) vengono
+segnati come falliti, così la loro KB torna disponibile senza riavvii.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import API_INGEST_THREADS, API_JOB_HEARTBEAT_SECONDS, API_JOB_STALE_SECONDS, API_JOBS_DB
+
+JOB_KINDS = ("file", "url", "delete")
+
+
+class IngestionJobStore:
+    """Job di indicizzazione ed eliminazione, condivisi tra processi."""
+
+    def __init__(self, path=API_JOBS_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ingestion_jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, kb TEXT NOT NULL, payload TEXT, "
+                "status TEXT NOT NULL, messages TEXT, result TEXT, error TEXT, worker TEXT, "
+                "created_at REAL, started_at REAL, finished_at REAL, heartbeat_at REAL)"
+            )
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(ingestion_jobs)")}
+            if "heartbeat_at" not in columns:
+                # Coda creata da una versione precedente
+                self._db.execute("ALTER TABLE ingestion_jobs ADD COLUMN heartbeat_at REAL")
+            self._db.execute("CREATE INDEX IF NOT EXISTS ingestion_jobs_status ON ingestion_jobs (status, created_at)")
+        return self._db
+
+    @staticmethod
+    def _job(row):
+        job_id, kind, kb, payload, status, messages, result, error, worker, created, started, finished, heartbeat = row
+        return {
+            "id": job_id,
+            "kind": kind,
+            "kb": kb,
+            "payload": json.loads(payload) if payload else {},
+            "status": status,
+            "messages": json.loads(messages) if messages else [],
+            "result": json.loads(result) if result else None,
+            "error": error,
+            "worker": worker,
+            "created_at": created,
+            "started_at": started,
+            "finished_at": finished,
+            "heartbeat_at": heartbeat,
+        }
+
+    def submit(self, kind, kb, payload):
+        """Accoda un job e ne restituisce l'id."""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Tipo di job non valido: {kind}")
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._connection().execute(
+                "INSERT INTO ingestion_jobs (id, kind, kb, payload, status, created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                (job_id, kind, kb, json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT id, kind, kb, payload, status, messages, result, error, worker, "
+                "created_at, started_at, finished_at, heartbeat_at FROM ingestion_jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        return self._job(row) if row else None
+
+    def claim(self, worker, max_age=API_JOB_STALE_SECONDS):
+        """
+        Si aggiudica il job in coda più vecchio di una KB senza job in esecuzione,
+        dopo aver segnato come falliti i job senza heartbeat da più di `max_age` secondi.
+
+        Returns:
+        - dict | None: Il job, ora "running", oppure None se non ce ne sono.
+        """
+        with self._lock:
+            db = self._connection()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                self._fail_stale(db, max_age)
+                row = db.execute(
+                    "SELECT id FROM ingestion_jobs WHERE status = 'queued' AND kb NOT IN "
+                    "(SELECT kb FROM ingestion_jobs WHERE status = 'running') ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row:
+                    now = time.time()
+                    db.execute(
+                        "UPDATE ingestion_jobs SET status = 'running', worker = ?, started_at = ?, heartbeat_at = ? "
+                        "WHERE id = ?",
+                        (worker, now, now, row[0]),
+                    )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return self.get(row[0]) if row else None
+
+    def finish(self, job_id, status, messages=(), result=None, error=None):
+        with self._lock:
+            self._connection().execute(
+                "UPDATE ingestion_jobs SET status = ?, messages = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, json.dumps(list(messages), ensure_ascii=False),
+                 json.dumps(result, ensure_ascii=False), error, time.time(), job_id),
+            )
+
+    def heartbeat(self, job_id):
+        """Segnala che il job è ancora in esecuzione."""
+        with self._lock:
+            self._connection().execute(
+                "UPDATE ingestion_jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'",
+                (time.time(), job_id),
+            )
+
+    @staticmethod
+    def _fail_stale(db, max_age):
+        now = time.time()
+        return db.execute(
+            "UPDATE ingestion_jobs SET status = 'failed', error = 'Job interrotto', finished_at = ? "
+            "WHERE status = 'running' AND COALESCE(heartbeat_at, started_at) < ?",
+            (now, now - max_age),
+        ).rowcount
+
+    def fail_stale(self, max_age=API_JOB_STALE_SECONDS):
+        """Segna come falliti i job "running" senza heartbeat da più di `max_age` secondi. Restituisce quanti."""
+        with self._lock:
+            return self._fail_stale(self._connection(), max_age)
+
+    def counts(self):
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT status, COUNT(*) FROM ingestion_jobs GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+
+def run_job(job):
+    """
+    Esegue un job con un `DocumentManager` headless.
+
+    Returns:
+    - tuple: (stato, messaggi, risultato).
+    """
+    # Import locali: solo i processi che eseguono job caricano loader e splitter
+    from core.database import kb_upload_dir, load_or_create_chroma_db
+    from core.document_manager import DocumentManager
+
+    messages = []
+
+    def notify(level, message):
+        messages.append({"level": level, "message": message})
+
+    vector_store = load_or_create_chroma_db(job["kb"])
+    if vector_store is None:
+        raise RuntimeError(f"Impossibile aprire la knowledge base '{job['kb']}'.")
+    manager = DocumentManager(vector_store, upload_dir=kb_upload_dir(job["kb"]), notify=notify)
+    payload = job["payload"]
+    if job["kind"] == "file":
+        result = {"doc_id": manager.add_local_document(payload["path"])}
+    elif job["kind"] == "url":
+        result = {"doc_id": manager.add_web_document(payload["url"], depth_level=payload.get("depth_level", 1))}
+    else:
+        manager.load_existing_documents()
+        result = {"deleted": manager.delete_document(payload["doc_id"])}
+    failed = any(message["level"] == "error" for message in messages)
+    return ("failed" if failed else "done"), messages, result
+
+
+class IngestionWorker:
+    """
+    Thread che eseguono i job della coda in questo processo.
+
+    Parameters:
+    - store (IngestionJobStore): Coda condivisa.
+    - threads (int): Job eseguiti contemporaneamente dal processo (su KB diverse).
+    - poll_interval (float): Attesa tra due controlli della coda vuota, in secondi.
+    - heartbeat_interval (float): Intervallo tra due heartbeat di un job in esecuzione, in secondi.
+    """
+
+    def __init__(self, store, threads=API_INGEST_THREADS, poll_interval=1.0,
+                 heartbeat_interval=API_JOB_HEARTBEAT_SECONDS):
+        self.store = store
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.threads):
+            threading.Thread(target=self._loop, name=f"ingestion-worker-{i}", daemon=True).start()
+
+    def wake(self):
+        """Sveglia i thread dopo un nuovo job (gli altri processi lo vedono al controllo successivo)."""
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            try:
+                job = self.store.claim(self.worker_id)
+            except sqlite3.OperationalError as e:
+                logging.warning("Coda dei job non disponibile: %s", e)
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            stop = threading.Event()
+            threading.Thread(
+                target=self._heartbeat, args=(job["id"], stop), name=f"ingestion-heartbeat-{job['id']}", daemon=True
+            ).start()
+            try:
+                status, messages, result = run_job(job)
+                self.store.finish(job["id"], status, messages, result)
+            except Exception as e:
+                logging.exception("Job %s fallito", job["id"])
+                self.store.finish(job["id"], "failed", error=str(e))
+            finally:
+                stop.set()
+
+    def _heartbeat(self, job_id, stop):
+        while not stop.wait(self.heartbeat_interval):
+            try:
+                self.store.heartbeat(job_id)
+            except sqlite3.OperationalError as e:
+                logging.warning("Heartbeat del job %s non registrato: %s", job_id, e)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_job_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = IngestionJobStore()
+        return _store
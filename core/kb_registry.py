@@ -0,0 +1,204 @@
+# kb_registry.py
+
+"""
+Registro persistente delle knowledge base (SQLite).
+
+Per ogni KB il registro conserva proprietario, nome, cartella, backend, modello
+di embedding, numero di vettori, byte su disco, versione e ultimo accesso. La
+sidebar legge le KB dell'utente con una query sull'indice per proprietario
+invece di scorrere la cartella di lavoro a ogni rerun; le statistiche servono
+alla pagina delle metriche e alla pianificazione della capacità (KB più
+grandi, KB inutilizzate da più tempo).
+
+Il registro viene aggiornato alla creazione della KB, a ogni scrittura
+(`record_write`) e all'apertura (`touch`, al più una volta al minuto per
+KB). Al primo avvio viene popolato con le KB già presenti su disco; dopo
+modifiche fatte fuori dall'app (copie o eliminazioni manuali delle cartelle)
+va riallineato con `python -m tools.kb_registry --sync`.
+"""
+
+import glob
+import os
+import sqlite3
+import threading
+import time
+
+from config import KB_REGISTRY_DB
+from core.database import CHROMA_PATH, kb_name_from_path
+from core.kb_version import get_kb_version
+from core.store_cache import directory_size
+from core.users import get_user_directory
+from core.vector_store import detect_backend, open_vector_store
+
+KB_DIR_PREFIX = f"{CHROMA_PATH}_"
+TOUCH_INTERVAL = 60.0  # secondi tra due aggiornamenti dell'ultimo accesso della stessa KB
+
+_COLUMNS = ("name", "owner", "kb", "path", "backend", "embedding_model", "vectors", "bytes", "version",
+            "created_at", "updated_at", "last_access")
+
+
+def split_kb_name(name):
+    """
+    (proprietario, nome mostrato) di una KB `<utente>_<kb>`: il proprietario è il più
+    lungo utente di `USERS_FILE` che fa da prefisso, altrimenti la parte prima di "_".
+    """
+    owners = [user for user in get_user_directory().usernames() if name.startswith(f"{user}_")]
+    if owners:
+        owner = max(owners, key=len)
+        return owner, name[len(owner) + 1:]
+    if "_" in name:
+        return tuple(name.split("_", 1))
+    return None, name
+
+
+class KBRegistry:
+    """Registro delle KB condiviso dai processi dell'app e del servizio API."""
+
+    def __init__(self, path=KB_REGISTRY_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self._touched = {}
+
+    def _connection(self):
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS knowledge_bases ("
+                "name TEXT PRIMARY KEY, owner TEXT, kb TEXT NOT NULL, path TEXT NOT NULL, backend TEXT, "
+                "embedding_model TEXT, vectors INTEGER, bytes INTEGER, version INTEGER, "
+                "created_at REAL, updated_at REAL, last_access REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS knowledge_bases_owner ON knowledge_bases (owner, kb)")
+            self._db = db
+            if not db.execute("SELECT 1 FROM knowledge_bases LIMIT 1").fetchone():
+                # Primo avvio: le KB create prima del registro
+                for name, path in self._disk_kbs().items():
+                    self._insert(name, path)
+        return self._db
+
+    @staticmethod
+    def _disk_kbs():
+        return {
+            os.path.basename(path)[len(KB_DIR_PREFIX):]: path
+            for path in glob.glob(f"{KB_DIR_PREFIX}*") if os.path.isdir(path)
+        }
+
+    def _insert(self, name, path, backend=None, embedding_model=None):
+        owner, kb = split_kb_name(name)
+        now = time.time()
+        self._db.execute(
+            "INSERT INTO knowledge_bases (name, owner, kb, path, backend, embedding_model, bytes, version, "
+            "created_at, updated_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(name) DO NOTHING",
+            (name, owner, kb, path, backend or detect_backend(path), embedding_model,
+             directory_size(path), get_kb_version(path), now, now, now),
+        )
+
+    def register(self, name, path, backend=None, embedding_model=None):
+        """Registra una KB appena creata (nessun effetto se è già registrata)."""
+        with self._lock:
+            self._connection()
+            self._insert(name, path, backend, embedding_model)
+
+    def record_write(self, store, version=None):
+        """Aggiorna vettori, byte su disco e versione della KB dopo una scrittura tramite `store`."""
+        path = store.path
+        name = kb_name_from_path(path)
+        if not name:
+            return  # vector store fuori dalle cartelle delle KB
+        values = (store.backend_name, store.count(), directory_size(path),
+                  version if version is not None else get_kb_version(path), time.time(), name)
+        with self._lock:
+            db = self._connection()
+            self._insert(name, path, store.backend_name)
+            db.execute(
+                "UPDATE knowledge_bases SET backend = ?, vectors = ?, bytes = ?, version = ?, updated_at = ? "
+                "WHERE name = ?",
+                values,
+            )
+
+    def touch(self, name):
+        """Aggiorna l'ultimo accesso della KB (al più una volta ogni `TOUCH_INTERVAL` secondi)."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._touched.get(name, -TOUCH_INTERVAL) < TOUCH_INTERVAL:
+                return
+            self._touched[name] = now
+            self._connection().execute(
+                "UPDATE knowledge_bases SET last_access = ? WHERE name = ?", (time.time(), name)
+            )
+
+    def list_kbs(self, owner):
+        """Nomi (senza prefisso) delle KB dell'utente, in ordine alfabetico."""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT kb, path FROM knowledge_bases WHERE owner = ? ORDER BY kb", (owner,)
+            ).fetchall()
+        return [kb for kb, path in rows if os.path.isdir(path)]
+
+    def get(self, name):
+        with self._lock:
+            row = self._connection().execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM knowledge_bases WHERE name = ?", (name,)
+            ).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def remove(self, name):
+        with self._lock:
+            self._connection().execute("DELETE FROM knowledge_bases WHERE name = ?", (name,))
+            self._touched.pop(name, None)
+
+    def stats(self):
+        """
+        Tutte le KB, dalla meno recentemente usata (candidate all'archiviazione), con i totali.
+        """
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM knowledge_bases ORDER BY last_access"
+            ).fetchall()
+        kbs = [dict(zip(_COLUMNS, row)) for row in rows]
+        return {
+            "kbs": kbs,
+            "count": len(kbs),
+            "vectors": sum(kb["vectors"] or 0 for kb in kbs),
+            "bytes": sum(kb["bytes"] or 0 for kb in kbs),
+            "owners": len({kb["owner"] for kb in kbs}),
+        }
+
+    def sync(self, refresh=False):
+        """
+        Riallinea il registro con le cartelle su disco: registra le KB mancanti e rimuove
+        quelle eliminate. Con `refresh` ricalcola vettori, byte e versione di tutte le KB.
+        """
+        disk = self._disk_kbs()
+        with self._lock:
+            db = self._connection()
+            registered = {name for (name,) in db.execute("SELECT name FROM knowledge_bases")}
+            for name in registered - set(disk):
+                db.execute("DELETE FROM knowledge_bases WHERE name = ?", (name,))
+            for name in set(disk) - registered:
+                self._insert(name, disk[name])
+        summary = {"added": len(set(disk) - registered), "removed": len(registered - set(disk)), "refreshed": 0}
+        if refresh:
+            for path in disk.values():
+                store = open_vector_store(path, embedding_function=None)
+                try:
+                    self.record_write(store)
+                finally:
+                    store.close()
+                summary["refreshed"] += 1
+        return summary
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_kb_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = KBRegistry()
+        return _registry
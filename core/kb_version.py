@@ -0,0 +1,94 @@
+# kb_version.py
+
+"""
+Versione persistente e monotona di ogni knowledge base.
+
+Ogni KB (la cartella `chroma_<kb>`) contiene un file `kb_version.json` con un
+contatore che viene incrementato ad ogni aggiunta, eliminazione o
+sincronizzazione di documenti. La versione permette di mettere in cache in
+modo sicuro tutto ciò che dipende dal contenuto della KB (es. risultati di
+retrieval), anche tra rerun e utenti diversi.
+
+Le scritture sui documenti della KB e la sua esportazione si escludono a vicenda
+tramite `kb_write_lock`.
+"""
+
+import json
+import os
+import threading
+import time
+
+from utils.file_utils import LOCK_TIMEOUT, file_lock, write_json_atomic
+
+VERSION_FILE = "kb_version.json"
+
+_lock = threading.Lock()
+# persist_directory -> (inode, mtime_ns, version)
+_version_cache = {}
+
+
+def _version_path(persist_directory):
+    return os.path.join(persist_directory, VERSION_FILE)
+
+
+def _read_version(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return int(json.load(f).get("version", 0))
+    except (FileNotFoundError, ValueError, json.JSONDecodeError):
+        return 0
+
+
+def get_kb_version(persist_directory):
+    """
+    Restituisce la versione corrente della KB (0 se non è mai stata modificata).
+
+    La lettura è servita da una cache in memoria validata con inode e mtime del
+    file, quindi il costo per query è un singolo `os.stat`.
+    """
+    if not persist_directory:
+        return 0
+    path = _version_path(persist_directory)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return 0
+
+    cached = _version_cache.get(persist_directory)
+    if cached and cached[0] == stat.st_ino and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+
+    version = _read_version(path)
+    _version_cache[persist_directory] = (stat.st_ino, stat.st_mtime_ns, version)
+    return version
+
+
+def bump_kb_version(persist_directory, minimum=0):
+    """
+    Incrementa in modo atomico la versione della KB e restituisce il nuovo valore.
+    Con `minimum` la nuova versione è comunque maggiore di `minimum` (es. la versione
+    della KB sostituita da un'importazione, così le cache degli altri processi la riaprono).
+    """
+    os.makedirs(persist_directory, exist_ok=True)
+    path = _version_path(persist_directory)
+    with _lock, file_lock(path):
+        version = max(_read_version(path), minimum) + 1
+        write_json_atomic(path, {"version": version, "updated_at": time.time()})
+        _version_cache.pop(persist_directory, None)
+    return version
+
+
+def kb_write_lock(persist_directory, timeout=LOCK_TIMEOUT):
+    """
+    Lock inter-processo delle scritture sulla KB: lo tengono l'aggiunta e l'eliminazione
+    dei documenti, l'esportazione (`tools.bulk_index export`), che così archivia una KB
+    che nessuno sta modificando, e le sostituzioni della cartella (importazione, compressione).
+    Non è rientrante: non va preso due volte dallo stesso thread.
+
+    Il file di lock (`chroma_<kb>.lock`) sta accanto alla cartella della KB, non dentro:
+    resta lo stesso quando la cartella viene sostituita con `os.rename`, che su Windows
+    fallirebbe con un file aperto al suo interno.
+    """
+    path = os.path.normpath(persist_directory)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return file_lock(path, timeout)
@@ -0,0 +1,233 @@
+# knowledge_graph.py
+
+"""
+Knowledge graph indicizzato e persistente per il graph-RAG.
+
+Il grafo di ogni KB è salvato in `chroma_<kb>/knowledge_graph.json` ed è
+costruito in modo incrementale per documento: quando la versione della KB
+cambia vengono elaborati solo i documenti nuovi e rimossi quelli eliminati.
+In memoria vengono mantenuti:
+- la lista di adiacenza tra entità (co-occorrenza consecutiva nel chunk);
+- un indice invertito token -> entità, per una lookup O(termini della query);
+- la mappa entità -> id dei chunk che la citano, per restituire passaggi reali.
+"""
+
+import json
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+from core.kb_version import get_kb_version
+from core.retrieval_cache import RETRIEVAL_CACHE
+from utils.file_utils import file_lock, write_json_atomic
+
+GRAPH_FILE = "knowledge_graph.json"
+ENTITY_PATTERN = re.compile(r'\b[A-Z][a-z]+(?: [A-Z][a-z]+)*\b')
+TOKEN_PATTERN = re.compile(r'\w+')
+MIN_TOKEN_LENGTH = 3
+
+
+def extract_entities(text):
+    """Estrae le entità (sequenze di parole con iniziale maiuscola) da un testo."""
+    return ENTITY_PATTERN.findall(text)
+
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if len(token) >= MIN_TOKEN_LENGTH]
+
+
+class KnowledgeGraphIndex:
+    """Knowledge graph di una singola KB con indici derivati in memoria."""
+
+    def __init__(self, persist_directory):
+        self.persist_directory = persist_directory
+        self.path = os.path.join(persist_directory, GRAPH_FILE)
+        self._lock = threading.RLock()
+        self._loaded_mtime = None
+        # Dati persistiti: doc_id -> {"mentions": {entità: [chunk_id]}, "edges": [[a, b], ...]}
+        self.documents = {}
+        self.kb_version = None
+        # Indici derivati
+        self.adjacency = defaultdict(Counter)
+        self.entity_chunks = defaultdict(set)
+        self.token_index = defaultdict(set)
+
+    # ---- Costruzione incrementale ----
+
+    @staticmethod
+    def build_document_entry(chunk_ids, texts):
+        """Estrae menzioni e archi per i chunk di un documento."""
+        mentions = defaultdict(list)
+        edges = []
+        for chunk_id, text in zip(chunk_ids, texts):
+            entities = extract_entities(text or "")
+            for entity in set(entities):
+                mentions[entity].append(chunk_id)
+            for i in range(len(entities) - 1):
+                if entities[i] != entities[i + 1]:
+                    edges.append([entities[i], entities[i + 1]])
+        return {"mentions": dict(mentions), "edges": edges}
+
+    def add_document(self, doc_id, chunk_ids, texts):
+        with self._lock:
+            if doc_id in self.documents:
+                self.remove_document(doc_id)
+            entry = self.build_document_entry(chunk_ids, texts)
+            self.documents[doc_id] = entry
+            self._index_entry(entry, sign=1)
+
+    def remove_document(self, doc_id):
+        with self._lock:
+            entry = self.documents.pop(doc_id, None)
+            if entry:
+                self._index_entry(entry, sign=-1)
+
+    def _index_entry(self, entry, sign):
+        for a, b in entry["edges"]:
+            for x, y in ((a, b), (b, a)):
+                self.adjacency[x][y] += sign
+                if self.adjacency[x][y] <= 0:
+                    del self.adjacency[x][y]
+                    if not self.adjacency[x]:
+                        del self.adjacency[x]
+        for entity, chunk_ids in entry["mentions"].items():
+            if sign > 0:
+                self.entity_chunks[entity].update(chunk_ids)
+                for token in tokenize(entity):
+                    self.token_index[token].add(entity)
+                continue
+            self.entity_chunks[entity].difference_update(chunk_ids)
+            if not self.entity_chunks[entity]:
+                del self.entity_chunks[entity]
+                for token in tokenize(entity):
+                    self.token_index[token].discard(entity)
+                    if not self.token_index[token]:
+                        del self.token_index[token]
+
+    def _rebuild_indexes(self):
+        self.adjacency = defaultdict(Counter)
+        self.entity_chunks = defaultdict(set)
+        self.token_index = defaultdict(set)
+        for entry in self.documents.values():
+            self._index_entry(entry, sign=1)
+
+    # ---- Persistenza e sincronizzazione ----
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._loaded_mtime:
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.documents = data.get("documents", {})
+        self.kb_version = data.get("kb_version")
+        self._loaded_mtime = mtime
+        self._rebuild_indexes()
+
+    def save(self):
+        write_json_atomic(self.path, {"kb_version": self.kb_version, "documents": self.documents})
+        self._loaded_mtime = os.stat(self.path).st_mtime_ns
+
+    def sync(self, vector_store):
+        """
+        Allinea il grafo ai documenti presenti nel vector store, elaborando
+        solo i documenti aggiunti o rimossi dall'ultima sincronizzazione.
+        """
+        version = get_kb_version(self.persist_directory)
+        with self._lock:
+            self._load()
+            if self.kb_version == version:
+                return
+            with file_lock(self.path):
+                self._load()
+                if self.kb_version == version:
+                    return
+                metadatas = vector_store.get(include=["metadatas"])["metadatas"]
+                current_doc_ids = {metadata.get("doc_id") for metadata in metadatas if metadata.get("doc_id")}
+
+                for doc_id in set(self.documents) - current_doc_ids:
+                    self.remove_document(doc_id)
+                for doc_id in current_doc_ids - set(self.documents):
+                    chunks = vector_store.get(where={"doc_id": doc_id}, include=["documents"])
+                    self.add_document(doc_id, chunks["ids"], chunks["documents"])
+
+                self.kb_version = version
+                self.save()
+
+    # ---- Ricerca ----
+
+    def search(self, query, top_k=5):
+        """
+        Restituisce gli id dei chunk collegati alle entità citate nella query.
+
+        Le entità trovate tramite l'indice invertito pesano 2, le entità vicine
+        nel grafo pesano 1; i chunk sono ordinati per punteggio complessivo.
+        """
+        with self._lock:
+            matched = set()
+            for token in tokenize(query):
+                matched.update(self.token_index.get(token, ()))
+            if not matched:
+                return []
+            scores = Counter()
+            for entity in matched:
+                for chunk_id in self.entity_chunks.get(entity, ()):
+                    scores[chunk_id] += 2
+                for neighbor in self.adjacency.get(entity, ()):
+                    for chunk_id in self.entity_chunks.get(neighbor, ()):
+                        scores[chunk_id] += 1
+        return [chunk_id for chunk_id, _ in scores.most_common(top_k)]
+
+
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+
+def get_kb_graph(persist_directory):
+    """Restituisce il knowledge graph condiviso a livello di processo per la KB."""
+    with _graphs_lock:
+        graph = _graphs.get(persist_directory)
+        if graph is None:
+            graph = KnowledgeGraphIndex(persist_directory)
+            _graphs[persist_directory] = graph
+        return graph
+
+
+def graph_search(vector_store, query, top_k=5):
+    """
+    Recupera i passaggi della KB collegati alle entità della query.
+
+    Parameters:
+    - vector_store (VectorStore): Il vector store della KB.
+    - query (str): Il testo della query.
+    - top_k (int): Numero massimo di chunk restituiti.
+
+    Returns:
+    - list of Document: I chunk che citano le entità trovate o le loro vicine.
+    """
+    from langchain_core.documents import Document
+
+    persist_directory = vector_store.path
+    key = RETRIEVAL_CACHE.make_key(persist_directory, get_kb_version(persist_directory), query, top_k, kind="graph")
+    cached = RETRIEVAL_CACHE.get(key)
+    if cached is not None:
+        return list(cached)
+
+    graph = get_kb_graph(persist_directory)
+    graph.sync(vector_store)
+    chunk_ids = graph.search(query, top_k=top_k)
+    if not chunk_ids:
+        return []
+
+    found = vector_store.get(ids=chunk_ids, include=["documents", "metadatas"])
+    by_id = {
+        chunk_id: Document(page_content=text, metadata=metadata or {})
+        for chunk_id, text, metadata in zip(found["ids"], found["documents"], found["metadatas"])
+    }
+    results = [by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in by_id]
+    RETRIEVAL_CACHE.put(key, results)
+    return list(results)
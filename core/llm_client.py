@@ -0,0 +1,297 @@
+# llm_client.py
+
+"""
+Client condivisi per i backend dei modelli.
+
+- `get_ollama_client(base_url)`: un `HTTPBackendClient` per server Ollama, con
+  sessione `requests` e pool di connessioni keep-alive riusati da tutte le
+  sessioni Streamlit del processo;
+- `get_anthropic_client()`: un unico client Anthropic (pool httpx, timeout e
+  retry dell'SDK) con il relativo `BackendGuard`.
+
+Ogni backend ha un `BackendGuard` che limita le richieste concorrenti e
+implementa il circuit breaking: dopo un certo numero di errori consecutivi
+(timeout, connessione rifiutata, 429/5xx dopo i retry) le richieste falliscono
+subito per `reset_timeout` secondi, poi una richiesta di prova decide se
+richiudere il circuito.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (
+    ANTHROPIC_MAX_CONCURRENCY,
+    LLM_CONNECT_TIMEOUT,
+    LLM_MAX_RETRIES,
+    LLM_READ_TIMEOUT,
+    OLLAMA_MAX_CONCURRENCY,
+)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+MAX_RETRY_DELAY = 30.0
+
+
+class LLMBackendError(RuntimeError):
+    """Errore restituito da un backend (HTTP o di protocollo)."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class CircuitOpenError(LLMBackendError):
+    """Il backend ha fallito ripetutamente: le richieste vengono rifiutate per un po'."""
+
+
+class BackendBusyError(LLMBackendError):
+    """Nessuno slot libero sul backend entro il tempo di attesa."""
+
+
+def retry_delay(attempt, backoff=0.5, retry_after=None):
+    """Attesa prima del tentativo `attempt` (da 0): backoff esponenziale con jitter."""
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), MAX_RETRY_DELAY)
+        except ValueError:
+            pass
+    return min(backoff * (2 ** attempt) * random.uniform(0.5, 1.5), MAX_RETRY_DELAY)
+
+
+def is_backend_failure(exc):
+    """True per gli errori che indicano un backend non disponibile (non per le richieste errate)."""
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(exc, LLMBackendError) and not isinstance(exc, (CircuitOpenError, BackendBusyError)):
+        return exc.status is None or exc.status in RETRY_STATUS
+    try:
+        import anthropic
+    except ImportError:
+        return False
+    if isinstance(exc, (anthropic.APIConnectionError, anthropic.RateLimitError, anthropic.InternalServerError)):
+        return True
+    return False
+
+
+class CircuitBreaker:
+    """Circuit breaker a tre stati: chiuso, aperto, semi-aperto (una richiesta di prova)."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def before_request(self, name):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._probing:
+                remaining = max(self.reset_timeout - (time.monotonic() - self.opened_at), 0)
+                raise CircuitOpenError(
+                    f"Il backend '{name}' non risponde: nuovo tentativo tra {remaining:.0f} s."
+                )
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """Chiude una richiesta di prova terminata senza esito (es. errore del client)."""
+        with self._lock:
+            self._probing = False
+
+
+class BackendGuard:
+    """
+    Limite di concorrenza e circuit breaker di un backend.
+
+    Parameters:
+    - name (str): Nome del backend, usato nei messaggi di errore.
+    - max_concurrency (int): Richieste contemporanee ammesse.
+    - queue_timeout (float): Secondi di attesa massima per uno slot libero.
+    """
+
+    def __init__(self, name, max_concurrency, queue_timeout=30.0, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._active = 0
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self._active
+
+    @contextmanager
+    def slot(self):
+        self.breaker.before_request(self.name)
+        if not self._semaphore.acquire(timeout=self.queue_timeout):
+            self.breaker.release_probe()
+            raise BackendBusyError(f"Il backend '{self.name}' è occupato, riprova tra poco.")
+        with self._lock:
+            self._active += 1
+        try:
+            yield
+        except GeneratorExit:
+            self.breaker.record_success()  # stream chiuso in anticipo dal consumatore
+            raise
+        except BaseException as exc:
+            if is_backend_failure(exc):
+                self.breaker.record_failure()
+            else:
+                self.breaker.release_probe()
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            with self._lock:
+                self._active -= 1
+            self._semaphore.release()
+
+
+class HTTPBackendClient:
+    """
+    Client HTTP JSON con sessione keep-alive, timeout, retry con jitter e `BackendGuard`.
+
+    Parameters:
+    - base_url (str): URL base del server (es. "http://localhost:11434").
+    - name (str): Nome del servizio, usato nei messaggi di errore.
+    - max_concurrency (int): Richieste contemporanee (anche dimensione del pool di connessioni).
+    """
+
+    def __init__(self, base_url, name="Ollama", max_concurrency=OLLAMA_MAX_CONCURRENCY,
+                 connect_timeout=LLM_CONNECT_TIMEOUT, read_timeout=LLM_READ_TIMEOUT,
+                 max_retries=LLM_MAX_RETRIES, backoff=0.5):
+        self.base_url = base_url.rstrip("/")
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.guard = BackendGuard(f"{name} ({self.base_url})", max_concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _post(self, path, payload, stream, timeout=None):
+        """POST con retry su errori di connessione e 429/5xx (mai dopo l'inizio della risposta)."""
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(url, json=payload, stream=stream, timeout=timeout or self.timeout)
+            except (requests.ConnectionError, requests.ConnectTimeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(retry_delay(attempt, self.backoff))
+                continue
+            if response.status_code < 400:
+                return response
+            error = LLMBackendError(f"{self.name} API Error {response.status_code}: {response.text}",
+                                    response.status_code)
+            response.close()
+            if response.status_code not in RETRY_STATUS or attempt == self.max_retries:
+                raise error
+            time.sleep(retry_delay(attempt, self.backoff, response.headers.get("Retry-After")))
+
+    def post_json(self, path, payload, timeout=None):
+        """Invia una richiesta JSON e restituisce la risposta decodificata."""
+        with self.guard.slot():
+            response = self._post(path, payload, stream=False, timeout=timeout)
+            try:
+                return response.json()
+            except ValueError as e:
+                raise LLMBackendError(f"Risposta non valida da {self.base_url}{path}: {e}") from e
+
+    def stream_json(self, path, payload, timeout=None):
+        """
+        Generatore degli oggetti JSON di una risposta NDJSON in streaming.
+        La richiesta parte alla prima iterazione e occupa uno slot fino alla fine dello stream.
+        """
+        with self.guard.slot():
+            response = self._post(path, payload, stream=True, timeout=timeout)
+            with response:
+                for line in response.iter_lines():
+                    if line:
+                        yield json.loads(line)
+
+    def get_json(self, path, timeout=None, guarded=True):
+        """
+        GET JSON. Con `guarded=False` la richiesta non occupa uno slot né passa dal circuit
+        breaker: serve per le interrogazioni di stato, che non devono attendere le generazioni.
+        """
+        if not guarded:
+            return self._get_json(path, timeout)
+        with self.guard.slot():
+            return self._get_json(path, timeout)
+
+    def _get_json(self, path, timeout=None):
+        response = self.session.get(f"{self.base_url}{path}", timeout=timeout or self.timeout)
+        if response.status_code >= 400:
+            raise LLMBackendError(f"{self.name} API Error {response.status_code}: {response.text}",
+                                  response.status_code)
+        return response.json()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_ollama_client(base_url):
+    """Client condiviso (uno per processo) per il server Ollama indicato."""
+    base_url = base_url.rstrip("/")
+    with _clients_lock:
+        if base_url not in _clients:
+            _clients[base_url] = HTTPBackendClient(base_url)
+        return _clients[base_url]
+
+
+ANTHROPIC_GUARD = BackendGuard("anthropic", ANTHROPIC_MAX_CONCURRENCY)
+_anthropic_client = None
+
+
+def get_anthropic_client():
+    """Client Anthropic condiviso: pool di connessioni, timeout e retry con jitter dell'SDK."""
+    global _anthropic_client
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        raise ValueError("La chiave API di Anthropic non è impostata. Verifica il file `.env`.")
+    with _clients_lock:
+        if _anthropic_client is None or _anthropic_client.api_key != api_key:
+            import httpx
+            from anthropic import Anthropic
+            _anthropic_client = Anthropic(
+                api_key=api_key,
+                max_retries=LLM_MAX_RETRIES,
+                timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            )
+        return _anthropic_client
@@ -0,0 +1,281 @@
+# model_router.py
+
+"""
+Router dei modelli di generazione.
+
+I backend (Anthropic, Deepseek, Gemma e, se abilitato, lo stub
+deterministico) sono registrati dietro un'unica interfaccia asincrona
+`ModelRouter.route`. Ogni backend ha i propri slot di concorrenza e un limite
+di richieste in coda, condivisi da tutte le sessioni del processo: se il
+backend scelto è saturo o non disponibile (circuit breaker aperto, errori di
+connessione o 5xx) la richiesta passa al successivo nell'ordine di fallback.
+
+Per le risposte in streaming il primo frammento viene letto prima di
+restituire la risposta, così anche gli errori che emergono solo all'avvio
+dello stream attivano il fallback; lo slot resta occupato finché lo stream non
+è stato consumato.
+"""
+
+import asyncio
+import importlib
+import threading
+from collections import OrderedDict
+
+from config import (
+    ANTHROPIC_MAX_CONCURRENCY,
+    DEEPSEEK_OLLAMA_HOST,
+    ENABLE_STUB_MODEL,
+    GEMMA_OLLAMA_HOST,
+    MODEL_FALLBACK_ORDER,
+    OLLAMA_MAX_CONCURRENCY,
+    ROUTER_MAX_QUEUE,
+    ROUTER_QUEUE_TIMEOUT,
+)
+from core.llm_client import ANTHROPIC_GUARD, LLMBackendError, get_ollama_client, is_backend_failure
+
+
+class BackendSaturatedError(LLMBackendError):
+    """Il backend ha raggiunto il limite di richieste in corso e in coda."""
+
+
+class NoBackendAvailableError(LLMBackendError):
+    """Né il backend scelto né quelli di fallback possono servire la richiesta."""
+
+
+class BackendSlots:
+    """
+    Slot di concorrenza di un backend, con limite sulla coda d'attesa.
+
+    Parameters:
+    - max_concurrency (int): Richieste eseguite contemporaneamente.
+    - max_queue (int): Richieste in attesa oltre le quali il backend è considerato saturo.
+    - queue_timeout (float): Attesa massima in coda, in secondi.
+    """
+
+    def __init__(self, max_concurrency, max_queue=ROUTER_MAX_QUEUE, queue_timeout=ROUTER_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+
+    def acquire(self, name):
+        if not self._semaphore.acquire(blocking=False):
+            with self._lock:
+                if self.waiting >= self.max_queue:
+                    raise BackendSaturatedError(f"Il modello '{name}' ha la coda piena.")
+                self.waiting += 1
+            try:
+                acquired = self._semaphore.acquire(timeout=self.queue_timeout)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+            if not acquired:
+                raise BackendSaturatedError(f"Il modello '{name}' non si è liberato in tempo.")
+        with self._lock:
+            self.active += 1
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+        self._semaphore.release()
+
+
+class ModelBackend:
+    """
+    Backend di generazione registrato nel router.
+
+    Parameters:
+    - name (str): Identificativo (es. "gemma"), usato nell'ordine di fallback.
+    - label (str): Nome mostrato nella UI.
+    - target (str): Funzione di query nel formato "modulo:funzione", importata alla prima richiesta.
+    - max_concurrency (int): Slot di concorrenza del backend.
+    - streaming (bool): True se la funzione accetta `stream=True`.
+    - guard (callable): Restituisce il `BackendGuard` del client, per conoscerne il circuit breaker.
+    """
+
+    def __init__(self, name, label, target, max_concurrency, streaming=True, guard=None,
+                 max_queue=ROUTER_MAX_QUEUE, queue_timeout=ROUTER_QUEUE_TIMEOUT):
+        self.name = name
+        self.label = label
+        self.target = target
+        self.streaming = streaming
+        self.slots = BackendSlots(max_concurrency, max_queue, queue_timeout)
+        self._guard = guard
+        self._function = None
+
+    @property
+    def function(self):
+        if self._function is None:
+            module_name, function_name = self.target.split(":")
+            self._function = getattr(importlib.import_module(module_name), function_name)
+        return self._function
+
+    def available(self):
+        """False se il circuit breaker del client è aperto."""
+        return self._guard is None or self._guard().breaker.state != "open"
+
+    def answer(self, query_text, vector_store, expertise_level="expert", stream=False, **options):
+        # `options` (es. conversation_history, retrieval_query) sono passate alla funzione di query
+        if self.streaming:
+            return self.function(query_text, vector_store, expertise_level=expertise_level, stream=stream, **options)
+        return self.function(query_text, vector_store, expertise_level=expertise_level, **options)
+
+    def status(self):
+        return {
+            "label": self.label,
+            "active": self.slots.active,
+            "waiting": self.slots.waiting,
+            "max_concurrency": self.slots.max_concurrency,
+            "available": self.available(),
+        }
+
+
+class RoutedAnswer:
+    """Esito di una richiesta instradata: risposta, riferimenti e backend che l'ha servita."""
+
+    def __init__(self, answer, references, backend, requested, skipped):
+        self.answer = answer
+        self.references = references
+        self.backend = backend
+        self.requested = requested
+        self.skipped = skipped  # [(backend, motivo)] dei backend scartati prima di quello usato
+
+    @property
+    def fallback(self):
+        return self.backend != self.requested
+
+
+def _bind_script_context(function):
+    """
+    Propaga il contesto dello script Streamlit al thread che esegue la funzione,
+    così i retriever possono continuare a usare `st.session_state` e `st.error`.
+    """
+    try:
+        from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+    except ImportError:
+        return function
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return function
+
+    def bound(*args, **kwargs):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return function(*args, **kwargs)
+    return bound
+
+
+class ModelRouter:
+    """
+    Instrada le domande verso i backend registrati, con fallback.
+
+    Parameters:
+    - fallback_order (list): Backend da provare, in ordine, dopo quello richiesto.
+    """
+
+    def __init__(self, fallback_order=()):
+        self.fallback_order = list(fallback_order)
+        self._backends = OrderedDict()
+
+    def register(self, backend):
+        self._backends[backend.name] = backend
+
+    def names(self):
+        return list(self._backends)
+
+    def label(self, name):
+        return self._backends[name].label
+
+    def get(self, name):
+        return self._backends[name]
+
+    def candidates(self, name):
+        return [name] + [other for other in self.fallback_order if other != name and other in self._backends]
+
+    def status(self):
+        return {name: backend.status() for name, backend in self._backends.items()}
+
+    async def route(self, name, query_text, vector_store, expertise_level="expert", stream=False, **options):
+        """
+        Esegue la domanda sul backend `name` o, se saturo o non disponibile, sui fallback.
+        Le `options` (es. `conversation_history`, `retrieval_query`) arrivano alla funzione di query.
+
+        Returns:
+        - RoutedAnswer: La risposta (stringa o `StreamingAnswer`) con riferimenti e backend usato.
+        """
+        if name not in self._backends:
+            raise ValueError(f"Modello non registrato: {name}")
+        skipped = []
+        for candidate in self.candidates(name):
+            backend = self._backends[candidate]
+            if not backend.available():
+                skipped.append((candidate, "non disponibile"))
+                continue
+            try:
+                await asyncio.to_thread(backend.slots.acquire, backend.label)
+            except BackendSaturatedError as e:
+                skipped.append((candidate, str(e)))
+                continue
+
+            call = _bind_script_context(backend.answer)
+            try:
+                answer, references = await asyncio.to_thread(
+                    call, query_text, vector_store, expertise_level, stream, **options
+                )
+                if hasattr(answer, "prefetch"):
+                    # Le risposte in streaming sono generatori: la richiesta parte al primo frammento
+                    await asyncio.to_thread(_bind_script_context(answer.prefetch))
+            except Exception as e:
+                backend.slots.release()
+                if isinstance(e, LLMBackendError) or is_backend_failure(e):
+                    skipped.append((candidate, str(e)))
+                    continue
+                raise
+
+            if hasattr(answer, "add_done_callback"):
+                answer.add_done_callback(backend.slots.release)
+            else:
+                backend.slots.release()
+            return RoutedAnswer(answer, references, candidate, name, skipped)
+
+        reasons = "; ".join(f"{self.label(n)}: {reason}" for n, reason in skipped)
+        raise NoBackendAvailableError(f"Nessun modello disponibile ({reasons}).")
+
+    def answer(self, name, query_text, vector_store, expertise_level="expert", stream=False, **options):
+        """Versione sincrona di `route`, per gli script Streamlit."""
+        return asyncio.run(self.route(name, query_text, vector_store, expertise_level, stream, **options))
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def stub_backend():
+    """Backend deterministico senza rete (test, benchmark, esecuzioni batch di prova)."""
+    return ModelBackend("stub", "Stub (Test)", "core.retriever_stub:query_rag_with_stub", 64)
+
+
+def get_model_router():
+    """Router condiviso dal processo, con i backend configurati."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            router = ModelRouter(fallback_order=MODEL_FALLBACK_ORDER)
+            router.register(ModelBackend(
+                "cloud", "Cloude (Antrophic)", "core.retriever:query_rag_with_cloud",
+                ANTHROPIC_MAX_CONCURRENCY, guard=lambda: ANTHROPIC_GUARD,
+            ))
+            router.register(ModelBackend(
+                "deepseek", "Deepseek (Locale)", "core.retriever_deepseek:query_rag_with_deepseek",
+                OLLAMA_MAX_CONCURRENCY, streaming=False, guard=lambda: get_ollama_client(DEEPSEEK_OLLAMA_HOST).guard,
+            ))
+            router.register(ModelBackend(
+                "gemma", "Gemma (Locale)", "core.retriever_gemma:query_rag_with_gemma",
+                OLLAMA_MAX_CONCURRENCY, guard=lambda: get_ollama_client(GEMMA_OLLAMA_HOST).guard,
+            ))
+            if ENABLE_STUB_MODEL:
+                router.register(stub_backend())
+            _router = router
+        return _router
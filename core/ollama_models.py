@@ -0,0 +1,184 @@
+# ollama_models.py
+
+"""
+Precaricamento e permanenza in memoria dei modelli Ollama.
+
+Ollama scarica un modello dalla memoria dopo qualche minuto di inattività e
+lo ricarica alla richiesta successiva, che paga così l'intero tempo di
+caricamento. Per evitarlo:
+- ogni richiesta di generazione porta il `keep_alive` configurato
+  (`OLLAMA_KEEP_ALIVE`);
+- i modelli locali vengono precaricati in background all'avvio
+  dell'applicazione e quando l'utente li seleziona (una richiesta
+  `/api/generate` senza prompt carica il modello senza generare);
+- `/api/ps` indica quali modelli sono in memoria e fino a quando.
+"""
+
+import logging
+import threading
+import time
+
+from config import (
+    DEEPSEEK_MODEL,
+    DEEPSEEK_OLLAMA_HOST,
+    GEMMA_MODEL,
+    GEMMA_OLLAMA_HOST,
+    OLLAMA_KEEP_ALIVE,
+    OLLAMA_PRELOAD,
+)
+from core.llm_client import get_ollama_client
+
+# Modelli locali per backend del router: (server Ollama, modello)
+LOCAL_MODELS = {
+    "deepseek": (DEEPSEEK_OLLAMA_HOST, DEEPSEEK_MODEL),
+    "gemma": (GEMMA_OLLAMA_HOST, GEMMA_MODEL),
+}
+STATUS_TTL = 10.0  # secondi di validità dello stato letto da /api/ps
+STATUS_TIMEOUT = (1.0, 2.0)
+
+
+def keep_alive_value(value=OLLAMA_KEEP_ALIVE):
+    """
+    `keep_alive` nel formato accettato da Ollama: i valori numerici (es. "-1", "3600")
+    sono secondi e vanno inviati come numero, gli altri sono durate ("30m", "2h").
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class ModelWarmer:
+    """
+    Precarica i modelli Ollama in background e ne legge lo stato.
+
+    Un solo precaricamento per modello alla volta; lo stato letto da `/api/ps`
+    resta in cache per `STATUS_TTL` secondi, così la UI può mostrarlo ad ogni
+    esecuzione dello script senza interrogare il server ogni volta.
+    """
+
+    def __init__(self, keep_alive=OLLAMA_KEEP_ALIVE):
+        self.keep_alive = keep_alive_value(keep_alive)
+        self._lock = threading.Lock()
+        self._loading = set()
+        self._status = {}  # host -> (istante, {modello: info})
+
+    def preload(self, host, model):
+        """Carica il modello e lo mantiene in memoria secondo `keep_alive` (bloccante)."""
+        start = time.perf_counter()
+        get_ollama_client(host).post_json("/api/generate", {"model": model, "keep_alive": self.keep_alive})
+        with self._lock:
+            self._status.pop(host, None)
+        logging.info("Modello %s precaricato su %s in %.1f s", model, host, time.perf_counter() - start)
+
+    def warm(self, host, model):
+        """
+        Precarica il modello in un thread in background, se non è già in memoria
+        o in caricamento. Restituisce True se il thread è stato avviato.
+        """
+        key = (host, model)
+        with self._lock:
+            if key in self._loading:
+                return False
+            self._loading.add(key)
+
+        def run():
+            try:
+                models = self.loaded_models(host)
+                if models is not None and self._find(models, model):
+                    return
+                self.preload(host, model)
+            except Exception as e:
+                logging.warning("Precaricamento di %s su %s non riuscito: %s", model, host, e)
+            finally:
+                with self._lock:
+                    self._loading.discard(key)
+
+        threading.Thread(target=run, name=f"ollama-warm-{model}", daemon=True).start()
+        return True
+
+    def loading(self, host, model):
+        with self._lock:
+            return (host, model) in self._loading
+
+    def loaded_models(self, host, refresh=False):
+        """
+        Modelli in memoria sul server secondo `/api/ps`: {nome: {"expires_at", "size_vram"}}.
+        Restituisce None se il server non risponde.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._status.get(host)
+        if cached is not None and not refresh and now - cached[0] < STATUS_TTL:
+            return cached[1]
+        try:
+            data = get_ollama_client(host).get_json("/api/ps", timeout=STATUS_TIMEOUT, guarded=False)
+        except Exception as e:
+            logging.debug("Stato dei modelli non disponibile su %s: %s", host, e)
+            models = None
+        else:
+            models = {
+                item.get("name") or item.get("model"): {
+                    "expires_at": item.get("expires_at"),
+                    "size_vram": item.get("size_vram"),
+                }
+                for item in data.get("models", [])
+            }
+        with self._lock:
+            self._status[host] = (now, models)
+        return models
+
+    @staticmethod
+    def _find(models, model):
+        # `ollama ps` riporta il nome con il tag (es. "gemma3:latest")
+        return models.get(model) or models.get(f"{model}:latest") or {}
+
+    def model_status(self, host, model, refresh=False):
+        """
+        Stato di un modello: {"loaded", "loading", "expires_at", "size_vram"},
+        oppure None se il server non risponde.
+        """
+        models = self.loaded_models(host, refresh=refresh)
+        if models is None:
+            return None
+        info = self._find(models, model)
+        return {
+            "loaded": bool(info),
+            "loading": self.loading(host, model),
+            "expires_at": info.get("expires_at"),
+            "size_vram": info.get("size_vram"),
+        }
+
+
+_warmer = ModelWarmer()
+_startup_done = False
+_startup_lock = threading.Lock()
+
+
+def get_model_warmer():
+    return _warmer
+
+
+def warm_backend(name):
+    """Precarica il modello del backend del router `name` (nessun effetto per i backend non locali)."""
+    if not OLLAMA_PRELOAD or name not in LOCAL_MODELS:
+        return False
+    return _warmer.warm(*LOCAL_MODELS[name])
+
+
+def warm_all_on_startup():
+    """Precarica una sola volta per processo tutti i modelli locali configurati."""
+    global _startup_done
+    with _startup_lock:
+        if _startup_done or not OLLAMA_PRELOAD:
+            return
+        _startup_done = True
+    for name in LOCAL_MODELS:
+        warm_backend(name)
+
+
+def backend_model_status(name, refresh=False):
+    """Stato del modello del backend `name`, None se non è locale o il server non risponde."""
+    if name not in LOCAL_MODELS:
+        return None
+    return _warmer.model_status(*LOCAL_MODELS[name], refresh=refresh)
@@ -0,0 +1,236 @@
+# quantization.py
+
+"""
+Compressione dei vettori per le knowledge base di grandi dimensioni.
+
+- `PCAReducer`: riduzione opzionale della dimensionalità;
+- `ScalarQuantizer`: quantizzazione scalare a 8 bit per dimensione (4x);
+- `ProductQuantizer`: product quantization, un byte per sottospazio
+  (es. 768 dimensioni float32 -> 48 byte con 48 sottospazi, 64x).
+
+Tutti i quantizzatori espongono `train`, `encode` e `distances` (distanze L2
+al quadrato approssimate tra una query e i codici), più `save`/`load` su un
+file `.npz`.
+"""
+
+import numpy as np
+
+SCAN_BLOCK_ROWS = 65536
+
+
+class PCAReducer:
+    """Proiezione sulle prime `out_dim` componenti principali."""
+
+    def __init__(self, out_dim):
+        self.out_dim = out_dim
+        self.mean = None
+        self.components = None
+
+    def train(self, vectors):
+        vectors = np.asarray(vectors, dtype="float32")
+        self.mean = vectors.mean(axis=0)
+        _, _, vt = np.linalg.svd(vectors - self.mean, full_matrices=False)
+        self.components = vt[:self.out_dim].astype("float32")
+
+    def transform(self, vectors):
+        return (np.asarray(vectors, dtype="float32") - self.mean) @ self.components.T
+
+    def state(self):
+        return {"pca_mean": self.mean, "pca_components": self.components}
+
+    @classmethod
+    def from_state(cls, state):
+        reducer = cls(int(state["pca_components"].shape[0]))
+        reducer.mean = state["pca_mean"]
+        reducer.components = state["pca_components"]
+        return reducer
+
+
+class ScalarQuantizer:
+    """Quantizzazione scalare uint8 con minimo e passo per dimensione."""
+
+    kind = "int8"
+
+    def __init__(self):
+        self.minimum = None
+        self.step = None
+
+    @property
+    def trained(self):
+        return self.minimum is not None
+
+    @property
+    def code_size(self):
+        return int(self.minimum.shape[0])
+
+    def train(self, vectors):
+        vectors = np.asarray(vectors, dtype="float32")
+        self.minimum = vectors.min(axis=0)
+        self.step = np.maximum((vectors.max(axis=0) - self.minimum) / 255.0, 1e-12).astype("float32")
+
+    def encode(self, vectors):
+        scaled = (np.asarray(vectors, dtype="float32") - self.minimum) / self.step
+        return np.clip(np.rint(scaled), 0, 255).astype("uint8")
+
+    def decode(self, codes):
+        return codes.astype("float32") * self.step + self.minimum
+
+    def distances(self, query, codes):
+        query = np.asarray(query, dtype="float32")
+        result = np.empty(len(codes), dtype="float32")
+        for start in range(0, len(codes), SCAN_BLOCK_ROWS):
+            diff = self.decode(codes[start:start + SCAN_BLOCK_ROWS]) - query
+            result[start:start + len(diff)] = np.einsum("ij,ij->i", diff, diff)
+        return result
+
+    def state(self):
+        return {"kind": np.array(self.kind), "sq_min": self.minimum, "sq_step": self.step}
+
+    @classmethod
+    def from_state(cls, state):
+        quantizer = cls()
+        quantizer.minimum = state["sq_min"]
+        quantizer.step = state["sq_step"]
+        return quantizer
+
+
+def _kmeans(data, k, iterations=20, seed=0):
+    """K-means di Lloyd essenziale (numpy), sufficiente per i codebook PQ."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _nearest(data, centroids)
+        for j in range(k):
+            members = data[assignments == j]
+            if len(members):
+                centroids[j] = members.mean(axis=0)
+    return centroids
+
+
+def _nearest(data, centroids):
+    assignments = np.empty(len(data), dtype="int64")
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    for start in range(0, len(data), SCAN_BLOCK_ROWS):
+        block = data[start:start + SCAN_BLOCK_ROWS]
+        scores = centroid_norms[None, :] - 2.0 * block @ centroids.T
+        assignments[start:start + len(block)] = scores.argmin(axis=1)
+    return assignments
+
+
+class ProductQuantizer:
+    """
+    Product quantization: il vettore è diviso in `subspaces` blocchi e ogni
+    blocco è sostituito dall'indice (un byte) del centroide più vicino.
+    La ricerca usa tabelle di distanze precalcolate per query (ADC).
+    """
+
+    kind = "pq"
+
+    def __init__(self, subspaces=16, centroids=256):
+        self.subspaces = subspaces
+        self.centroids = centroids
+        self.codebooks = None  # (subspaces, centroids, sub_dim)
+
+    @property
+    def trained(self):
+        return self.codebooks is not None
+
+    @property
+    def code_size(self):
+        return self.subspaces
+
+    def _split(self, vectors):
+        vectors = np.asarray(vectors, dtype="float32")
+        if vectors.shape[1] % self.subspaces:
+            raise ValueError(
+                f"La dimensione {vectors.shape[1]} non è divisibile per {self.subspaces} sottospazi."
+            )
+        return vectors.reshape(len(vectors), self.subspaces, -1)
+
+    def train(self, vectors, iterations=20):
+        parts = self._split(vectors)
+        books = [_kmeans(parts[:, j, :], self.centroids, iterations, seed=j) for j in range(self.subspaces)]
+        size = max(len(book) for book in books)
+        self.codebooks = np.zeros((self.subspaces, size, parts.shape[2]), dtype="float32")
+        for j, book in enumerate(books):
+            self.codebooks[j, :len(book)] = book
+            self.codebooks[j, len(book):] = np.inf  # centroidi mancanti (KB piccole): mai selezionati
+
+    def encode(self, vectors):
+        parts = self._split(vectors)
+        codes = np.empty((len(parts), self.subspaces), dtype="uint8")
+        for j in range(self.subspaces):
+            book = self.codebooks[j]
+            valid = np.isfinite(book[:, 0])
+            codes[:, j] = _nearest(parts[:, j, :], book[valid])
+        return codes
+
+    def decode(self, codes):
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.subspaces)], axis=1)
+
+    def distances(self, query, codes):
+        parts = self._split(np.asarray(query, dtype="float32")[None, :])[0]
+        tables = ((self.codebooks - parts[:, None, :]) ** 2).sum(axis=2)
+        result = np.zeros(len(codes), dtype="float32")
+        for j in range(self.subspaces):
+            result += tables[j][codes[:, j]]
+        return result
+
+    def state(self):
+        return {"kind": np.array(self.kind), "pq_codebooks": self.codebooks}
+
+    @classmethod
+    def from_state(cls, state):
+        books = state["pq_codebooks"]
+        quantizer = cls(subspaces=books.shape[0], centroids=books.shape[1])
+        quantizer.codebooks = books
+        return quantizer
+
+
+class VectorCompressor:
+    """Combinazione di riduzione opzionale (PCA) e quantizzazione."""
+
+    def __init__(self, mode="int8", reduce_dim=None, subspaces=16):
+        self.mode = mode
+        self.reducer = PCAReducer(reduce_dim) if reduce_dim else None
+        self.quantizer = ProductQuantizer(subspaces) if mode == "pq" else ScalarQuantizer()
+
+    @property
+    def trained(self):
+        return self.quantizer.trained
+
+    @property
+    def code_size(self):
+        return self.quantizer.code_size
+
+    def _prepare(self, vectors):
+        return self.reducer.transform(vectors) if self.reducer else np.asarray(vectors, dtype="float32")
+
+    def train(self, vectors):
+        if self.reducer:
+            self.reducer.train(vectors)
+        self.quantizer.train(self._prepare(vectors))
+
+    def encode(self, vectors):
+        return self.quantizer.encode(self._prepare(vectors))
+
+    def distances(self, query, codes):
+        return self.quantizer.distances(self._prepare(np.asarray(query)[None, :])[0], codes)
+
+    def save(self, path):
+        state = dict(self.quantizer.state())
+        if self.reducer:
+            state.update(self.reducer.state())
+        np.savez(path, **state)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            state = {key: data[key] for key in data.files}
+        compressor = cls.__new__(cls)
+        compressor.mode = str(state["kind"])
+        compressor.reducer = PCAReducer.from_state(state) if "pca_components" in state else None
+        quantizer_cls = ProductQuantizer if compressor.mode == "pq" else ScalarQuantizer
+        compressor.quantizer = quantizer_cls.from_state(state)
+        return compressor
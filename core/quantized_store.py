@@ -0,0 +1,146 @@
+# quantized_store.py
+
+"""
+Vector store compresso per le knowledge base di grandi dimensioni.
+
+Estende `HNSWVectorStore` mantenendo la stessa tabella dei metadati e lo
+stesso file dei vettori esatti (`vectors-<g>.bin`), che però resta solo su disco:
+la ricerca scorre i codici compressi (`codes-<g>.bin`, int8 o PQ, eventualmente
+dopo PCA) e rilegge dal disco i vettori esatti soltanto per i migliori
+candidati, che vengono riordinati con la distanza esatta.
+
+Il quantizzatore va addestrato su un campione rappresentativo: se non viene
+addestrato esplicitamente (`train()`, come fa `tools.compress_kb`), la KB resta
+non compressa, con ricerca esatta, finché non contiene almeno
+`MIN_TRAIN_VECTORS` vettori; a quel punto il quantizzatore viene addestrato su
+tutti i vettori presenti (al più `TRAIN_SAMPLE_SIZE`) e vengono codificati tutti.
+"""
+
+import os
+
+import numpy as np
+
+from core.hnsw_store import HNSWVectorStore
+from core.quantization import VectorCompressor
+
+QUANTIZER_FILE = "quantizer.npz"
+MIN_TRAIN_VECTORS = 1024  # vettori necessari per l'addestramento implicito
+TRAIN_SAMPLE_SIZE = 20000
+ENCODE_BLOCK_ROWS = 65536
+
+
+class QuantizedVectorStore(HNSWVectorStore):
+    """
+    Vector store con ricerca sui codici compressi e re-scoring esatto.
+
+    Parameters:
+    - compression (str): "int8" (quantizzazione scalare) o "pq" (product quantization).
+    - reduce_dim (int): Dimensione dopo PCA (None per non ridurre).
+    - subspaces (int): Numero di sottospazi per la PQ.
+    - rerank_factor (int): Candidati rivalutati con i vettori esatti = k * rerank_factor.
+    """
+
+    backend_name = "quantized"
+
+    def __init__(self, persist_directory, embedding_function, compression="int8", reduce_dim=None,
+                 subspaces=16, rerank_factor=10, **options):
+        if compression == "pq" and reduce_dim and reduce_dim % subspaces:
+            raise ValueError(f"La dimensione {reduce_dim} non è divisibile per {subspaces} sottospazi.")
+        self._codes = None
+        self._compressor = None
+        super().__init__(persist_directory, embedding_function, **options)
+        self._meta.setdefault("compression", compression)
+        self._meta.setdefault("reduce_dim", reduce_dim)
+        self._meta.setdefault("subspaces", subspaces)
+        self._meta.setdefault("rerank_factor", rerank_factor)
+        self._load_compressor()
+
+    def _load_compressor(self):
+        path = self._file(QUANTIZER_FILE)
+        if os.path.exists(path):
+            self._compressor = VectorCompressor.load(path)
+        else:
+            self._compressor = VectorCompressor(
+                mode=self._meta["compression"],
+                reduce_dim=self._meta["reduce_dim"],
+                subspaces=self._meta["subspaces"],
+            )
+
+    def train(self, vectors):
+        """Addestra il quantizzatore su un campione rappresentativo (prima di aggiungere dati)."""
+        self._compressor.train(np.asarray(vectors, dtype="float32"))
+        self._compressor.save(self._file(QUANTIZER_FILE))
+        self._meta["code_size"] = self._compressor.code_size
+
+    def _min_train_size(self):
+        # La PCA richiede almeno tanti campioni quante le componenti da calcolare
+        return max(MIN_TRAIN_VECTORS, self._meta["reduce_dim"] or 0)
+
+    # ---- Hook di HNSWVectorStore ----
+
+    def _file_layout(self):
+        layout = super()._file_layout()
+        del layout["graph"]
+        if "codes" in self._files():
+            layout["codes"] = self._codes_layout()
+        return layout
+
+    def _codes_layout(self):
+        return "codes", np.uint8, self._meta["code_size"], 0, False
+
+    def _load_index_state(self):
+        # Il quantizzatore potrebbe essere stato addestrato da un altro processo
+        if self._compressor is not None and not self._compressor.trained \
+                and os.path.exists(self._file(QUANTIZER_FILE)):
+            self._compressor = VectorCompressor.load(self._file(QUANTIZER_FILE))
+
+    def _save_index_state(self, generation):
+        pass  # nessuna struttura oltre ai file per nodo
+
+    def _index_rows(self, start, vectors):
+        total = start + len(vectors)
+        if "codes" in self._files():
+            self._codes[start:total] = self._compressor.encode(vectors)
+            return
+        if not self._compressor.trained:
+            if total < self._min_train_size():
+                return  # KB ancora piccola: vettori non compressi e ricerca esatta
+            sample = np.random.default_rng(0).choice(total, size=min(total, TRAIN_SAMPLE_SIZE), replace=False)
+            self.train(self._vectors[np.sort(sample)])
+        # Primo file dei codici: si codificano tutti i vettori presenti
+        self._meta["code_size"] = self._compressor.code_size
+        self._create_row_file("codes", self._codes_layout())
+        for block in range(0, total, ENCODE_BLOCK_ROWS):
+            end = min(block + ENCODE_BLOCK_ROWS, total)
+            self._codes[block:end] = self._compressor.encode(np.asarray(self._vectors[block:end], dtype="float32"))
+
+    def _candidate_search(self, query, k):
+        count = self._meta["count"]
+        if not count:
+            return []
+        if self._codes is None:
+            # Quantizzatore non ancora addestrato: ricerca esatta
+            exact = self._distances(query, np.arange(count))
+            order = np.argsort(exact)[:k + min(self._meta.get("deleted", 0), 4 * k)]
+            return [(float(exact[i]), int(i)) for i in order]
+        approximate = self._compressor.distances(query, self._codes[:count])
+        wanted = min(count, k * self._meta["rerank_factor"] + min(self._meta.get("deleted", 0), 4 * k))
+        candidates = np.argpartition(approximate, wanted - 1)[:wanted] if wanted < count else np.arange(count)
+        # Re-scoring con i vettori esatti letti dal disco solo per i candidati
+        candidates = np.sort(candidates)
+        exact = self._distances(query, candidates)
+        order = np.argsort(exact)
+        return [(float(exact[i]), int(candidates[i])) for i in order]
+
+    def memory_footprint(self):
+        """Byte delle strutture lette da ogni ricerca (codici e parametri del quantizzatore)."""
+        count = self._meta["count"]
+        if not count:
+            return 0
+        if self._codes is None:
+            return count * self.dim * self.dtype.itemsize  # ancora non compressa
+        quantizer_bytes = os.path.getsize(self._file(QUANTIZER_FILE))
+        return count * self._compressor.code_size + quantizer_bytes
+
+    def graph_copy_bytes(self):
+        return 0  # nessun grafo: le scritture aggiungono solo righe
@@ -0,0 +1,218 @@
+# query_metrics.py
+
+"""
+Metriche per singola domanda: tempi delle fasi, token e costo stimato.
+
+Una `QueryTrace` viene attivata (con `activate_trace`) per la durata di una
+domanda; le fasi instrumentate la trovano tramite una `ContextVar`, quindi
+anche nei thread avviati dal router dei modelli:
+- "embedding": calcolo dell'embedding della query;
+- "vector_search": ricerca nel vector store;
+- "context": assemblaggio del contesto;
+- generazione: tempo al primo token e totale, registrati a fine stream.
+
+Alla chiusura la traccia diventa un record nella tabella SQLite
+`query_metrics`, aggregabile per utente, KB e modello.
+"""
+
+import contextvars
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from config import MODEL_PRICES, QUERY_METRICS_DB
+from utils.stats import percentile
+
+STAGES = ("embedding", "vector_search", "context", "ttft", "generation", "total")
+
+_current_trace = contextvars.ContextVar("query_trace", default=None)
+
+
+def estimate_cost(model, input_tokens=0, output_tokens=0, cache_creation_tokens=0, cache_read_tokens=0):
+    """
+    Costo stimato in USD secondo `MODEL_PRICES` (prezzi per milione di token di input e output).
+    Scrittura e lettura della cache dei prompt costano 1.25x e 0.1x il prezzo di input.
+    """
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (
+        (input_tokens or 0) * input_price
+        + (cache_creation_tokens or 0) * input_price * 1.25
+        + (cache_read_tokens or 0) * input_price * 0.1
+        + (output_tokens or 0) * output_price
+    ) / 1_000_000
+
+
+class QueryTrace:
+    """Tempi e consumi di una singola domanda."""
+
+    def __init__(self, user=None, kb=None, model=None):
+        self.user = user
+        self.kb = kb
+        self.model = model  # backend del router (es. "gemma")
+        self.llm_model = None  # modello effettivo, usato per il costo
+        self.timings = {}
+        self.usage = {}
+        self.completed = True
+        self._start = time.perf_counter()
+
+    def add_time(self, stage, milliseconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + milliseconds
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, (time.perf_counter() - start) * 1000)
+
+    def record_generation(self, model, stats):
+        """Riceve le statistiche di `core.streaming.record_generation`."""
+        self.llm_model = model
+        self.completed = stats["completed"]
+        if stats["ttft_ms"] is not None:
+            self.timings["ttft"] = stats["ttft_ms"]
+        self.timings["generation"] = stats["total_ms"]
+        for key in ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"):
+            self.usage[key] = (self.usage.get(key) or 0) + (stats.get(key) or 0)
+
+    def to_record(self):
+        input_tokens = self.usage.get("input_tokens") or 0
+        output_tokens = self.usage.get("output_tokens") or 0
+        cache_creation = self.usage.get("cache_creation_input_tokens") or 0
+        cache_read = self.usage.get("cache_read_input_tokens") or 0
+        record = {
+            "ts": time.time(),
+            "user": self.user,
+            "kb": self.kb,
+            "model": self.model,
+            "llm_model": self.llm_model,
+            "completed": int(self.completed),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cache_creation_tokens": cache_creation,
+            "cache_read_tokens": cache_read,
+            "cost_usd": estimate_cost(self.llm_model, input_tokens, output_tokens, cache_creation, cache_read),
+        }
+        for stage_name in STAGES:
+            record[f"{stage_name}_ms"] = self.timings.get(stage_name)
+        if record["total_ms"] is None:
+            record["total_ms"] = (time.perf_counter() - self._start) * 1000
+        return record
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def stage(name):
+    """Misura una fase nella traccia attiva (nessun effetto se non c'è una traccia)."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name):
+        yield
+
+
+@contextmanager
+def activate_trace(trace):
+    """Rende `trace` la traccia attiva nel contesto corrente."""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+class QueryMetricsStore:
+    """Archivio SQLite dei record delle domande."""
+
+    COLUMNS = (
+        ["ts", "user", "kb", "model", "llm_model", "completed"]
+        + [f"{stage_name}_ms" for stage_name in STAGES]
+        + ["input_tokens", "output_tokens", "cache_creation_tokens", "cache_read_tokens", "cost_usd"]
+    )
+
+    def __init__(self, path=QUERY_METRICS_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_metrics (id INTEGER PRIMARY KEY, "
+                + ", ".join(f"{column} {'TEXT' if column in ('user', 'kb', 'model', 'llm_model') else 'REAL'}"
+                            for column in self.COLUMNS)
+                + ")"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS query_metrics_ts ON query_metrics (ts)")
+        return self._db
+
+    def add(self, record):
+        values = [record.get(column) for column in self.COLUMNS]
+        with self._lock:
+            self._connection().execute(
+                f"INSERT INTO query_metrics ({', '.join(self.COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in self.COLUMNS)})",
+                values,
+            )
+
+    def records(self, since=None):
+        sql = f"SELECT {', '.join(self.COLUMNS)} FROM query_metrics"
+        params = []
+        if since is not None:
+            sql += " WHERE ts >= ?"
+            params.append(since)
+        with self._lock:
+            rows = self._connection().execute(sql + " ORDER BY ts", params).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    def aggregate(self, group_by=("user", "kb", "model"), since=None):
+        """
+        Aggrega i record per le colonne indicate.
+
+        Returns:
+        - list of dict: Per gruppo numero di domande, token, costo e p50/p95/p99 di ogni fase.
+        """
+        groups = {}
+        for record in self.records(since):
+            groups.setdefault(tuple(record[column] for column in group_by), []).append(record)
+        result = []
+        for key, records in sorted(groups.items(), key=lambda item: [str(part) for part in item[0]]):
+            row = dict(zip(group_by, key))
+            row["queries"] = len(records)
+            row["input_tokens"] = int(sum(r["input_tokens"] or 0 for r in records))
+            row["output_tokens"] = int(sum(r["output_tokens"] or 0 for r in records))
+            row["cache_read_tokens"] = int(sum(r["cache_read_tokens"] or 0 for r in records))
+            row["cost_usd"] = sum(r["cost_usd"] or 0 for r in records)
+            for stage_name in STAGES:
+                values = [r[f"{stage_name}_ms"] for r in records if r[f"{stage_name}_ms"] is not None]
+                for q in (50, 95, 99):
+                    row[f"{stage_name}_p{q}_ms"] = percentile(values, q)
+            result.append(row)
+        return result
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_metrics_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = QueryMetricsStore()
+        return _store
+
+
+def finish_trace(trace):
+    """Salva il record della traccia; restituisce il record."""
+    record = trace.to_record()
+    get_metrics_store().add(record)
+    return record
@@ -0,0 +1,120 @@
+# retrieval_cache.py
+
+"""
+Cache dei risultati di retrieval condivisa a livello di processo.
+
+Le chiavi includono la versione della KB (vedi `core.kb_version`), quindi una
+modifica della KB rende automaticamente obsolete tutte le voci precedenti:
+alla prima richiesta con una versione più recente le voci vecchie vengono
+rimosse.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+
+from core.kb_version import get_kb_version
+from core.query_metrics import stage
+
+
+class RetrievalCache:
+    """
+    Cache LRU thread-safe per i risultati delle ricerche sul vector store.
+    Chiave: (kb, versione, query, k, filtri, tipo di ricerca).
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._kb_versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(kb, version, query, k, filters=None, kind="relevance"):
+        filters_key = json.dumps(filters, sort_keys=True, default=str) if filters else ""
+        return (kb, version, query, k, filters_key, kind)
+
+    def _observe_version(self, kb, version):
+        """Rimuove le voci della KB appartenenti a versioni superate."""
+        if self._kb_versions.get(kb, -1) >= version:
+            return
+        self._kb_versions[kb] = version
+        stale = [key for key in self._entries if key[0] == kb and key[1] < version]
+        for key in stale:
+            del self._entries[key]
+
+    def get(self, key):
+        with self._lock:
+            self._observe_version(key[0], key[1])
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._observe_version(key[0], key[1])
+            if key[1] < self._kb_versions.get(key[0], -1):
+                return  # risultato calcolato su una versione già superata
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, kb=None):
+        """Svuota la cache, o solo le voci di una KB."""
+        with self._lock:
+            if kb is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == kb]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+RETRIEVAL_CACHE = RetrievalCache()
+
+
+def cached_similarity_search(vector_store, query, k, filters=None, kind="relevance"):
+    """
+    Esegue una similarity search passando prima dalla cache di processo.
+
+    Parameters:
+    - vector_store: Il vector store della KB.
+    - query (str): Il testo della query.
+    - k (int): Numero di risultati.
+    - filters (dict): Filtro sui metadati (opzionale).
+    - kind (str): "relevance" per `similarity_search_with_relevance_scores`,
+      "score" per `similarity_search_with_score`.
+
+    Returns:
+    - list of (Document, float): I risultati della ricerca.
+    """
+    kb = getattr(vector_store, "path", None)
+    if kb is None:
+        return _search(vector_store, query, k, filters, kind)
+
+    key = RETRIEVAL_CACHE.make_key(kb, get_kb_version(kb), query, k, filters, kind)
+    results = RETRIEVAL_CACHE.get(key)
+    if results is None:
+        results = _search(vector_store, query, k, filters, kind)
+        RETRIEVAL_CACHE.put(key, results)
+    return list(results)
+
+
+def _search(vector_store, query, k, filters, kind):
+    # Embedding e ricerca separati, per misurare le due fasi
+    with stage("embedding"):
+        embedding = vector_store.embeddings.embed_query(query)
+    with stage("vector_search"):
+        results = vector_store.similarity_search_by_vector_with_score(embedding, k=k, filter=filters)
+    if kind == "score":
+        return results
+    return [(doc, vector_store.relevance_score(distance)) for doc, distance in results]
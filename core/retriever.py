@@ -1,41 +1,78 @@
+import time
 from langchain.prompts import ChatPromptTemplate
-from anthropic import Anthropic
-import os
+from config import CONTEXT_TOKEN_BUDGETS
+from core.context_builder import build_context
+from core.llm_client import ANTHROPIC_GUARD, get_anthropic_client
+from core.retrieval_cache import cached_similarity_search
+from core.streaming import StreamingAnswer, anthropic_usage, record_generation, stream_anthropic
+
+CLOUD_MODEL = "claude-3-5-sonnet-20240620"
+
+# Candidati recuperati: il contesto viene poi riempito fino al budget di token del modello
+RETRIEVAL_CANDIDATES = 8
+
+# Le istruzioni statiche del template terminano dove iniziano i campi della singola domanda
+QUERY_SECTION_MARKER = "Cronologia Chat:"
 
 def load_prompt_from_file(file_path="prompt_template.txt"):
     with open(file_path, "r", encoding="utf-8") as file:
         return file.read()
 
+def split_prompt_template(template):
+    """
+    Divide il template in istruzioni statiche (prompt di sistema, memorizzabile nella cache
+    dei prompt) e parte variabile con cronologia, contesto e domanda.
+    Se il marcatore manca, tutto il template resta nella parte variabile.
+    """
+    position = template.find(QUERY_SECTION_MARKER)
+    if position <= 0:
+        return "", template
+    return template[:position].strip(), template[position:]
+
 PROMPT_TEMPLATE = load_prompt_from_file()
-def query_rag_with_cloud(query_text, vector_store, expertise_level="expert"):
+SYSTEM_PROMPT, QUERY_PROMPT_TEMPLATE = split_prompt_template(PROMPT_TEMPLATE)
+
+# Template compilati una sola volta all'import
+COMPILED_PROMPT = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
+COMPILED_QUERY_PROMPT = ChatPromptTemplate.from_template(QUERY_PROMPT_TEMPLATE)
+
+def _system_blocks():
+    # Blocco statico marcato come memorizzabile: le richieste successive leggono il prefisso dalla cache
+    if not SYSTEM_PROMPT:
+        return []
+    return [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+def query_rag_with_cloud(query_text, vector_store, expertise_level="expert", stream=False,
+                         conversation_history="", retrieval_query=None):
     """
     Esegue una query sul vector_store fornito e restituisce una risposta arricchita dal contesto
     utilizzando l'SDK di Anthropic con il modello specificato.
+    Con `stream=True` la risposta è uno `StreamingAnswer` da consumare durante la visualizzazione.
+    `conversation_history` è la memoria della conversazione da inserire nel prompt;
+    `retrieval_query`, se indicata, sostituisce la domanda nella ricerca dei documenti.
     """
-    ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
-    if not ANTHROPIC_API_KEY:
-        raise ValueError("La chiave API di Anthropic non è impostata. Verifica il file `.env`.")
+    # Client condiviso dal processo (solleva ValueError se manca la chiave API)
+    client = get_anthropic_client()
 
-    results = vector_store.similarity_search_with_relevance_scores(query_text, k=3)
+    results = cached_similarity_search(
+        vector_store, retrieval_query or query_text, k=RETRIEVAL_CANDIDATES, kind="relevance"
+    )
     if len(results) == 0:
-        return "Non ci sono risultati pertinenti per la tua domanda.", [], 0, 0
+        return "Non ci sono risultati pertinenti per la tua domanda.", []
 
-    context_text = "\n\n- -\n\n".join([doc.page_content for doc, _ in results])
-    prompt_template = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
-
-    prompt = prompt_template.format(
+    packed = build_context(results, CONTEXT_TOKEN_BUDGETS["cloud"], vector_store=vector_store)
+    context_text = packed["text"]
+    prompt = COMPILED_QUERY_PROMPT.format(
         context=context_text,
         question=query_text,
         expertise_level=expertise_level,
-        conversation_history=""
+        conversation_history=conversation_history
     )
 
-    client = Anthropic(api_key=ANTHROPIC_API_KEY)
-    message = client.messages.create(
-        model="claude-3-5-sonnet-20240620",
+    request = dict(
+        model=CLOUD_MODEL,
         max_tokens=8192,
         temperature=0.7,
-        system=PROMPT_TEMPLATE,
+        system=_system_blocks(),
         messages=[
             {
                 "role": "user",
@@ -49,17 +86,23 @@ def query_rag_with_cloud(query_text, vector_store, expertise_level="expert"):
         ]
     )
 
-    result_text = message.content[0].text
-    input_tokens = message.usage.input_tokens
-    output_tokens = message.usage.output_tokens
-
     references = [
         {
             "file_name": doc.metadata.get("file_name", "Documento sconosciuto"),
             "file_path": doc.metadata.get("file_path", "Percorso sconosciuto"),
             "source_url": doc.metadata.get("source_url", None),
+            "title": doc.metadata.get("page_title", None),
         }
-        for doc, _ in results
+        for doc in packed["sources"]
     ]
 
+    if stream:
+        usage = {}
+        return StreamingAnswer(CLOUD_MODEL, stream_anthropic(client, usage, **request), usage), references
+
+    start = time.perf_counter()
+    with ANTHROPIC_GUARD.slot():
+        message = client.messages.create(**request)
+    record_generation(CLOUD_MODEL, start, anthropic_usage(message.usage))
+    result_text = message.content[0].text
     return result_text, references
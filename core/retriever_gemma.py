@@ -1,17 +1,18 @@
 # core/retriever_gemma.py
 
-import requests
-from langchain.prompts import ChatPromptTemplate
-from core.retriever import load_prompt_from_file
+import time
+from config import CONTEXT_TOKEN_BUDGETS, GEMMA_MODEL, GEMMA_OLLAMA_HOST
+from core.context_builder import build_context
+from core.llm_client import get_ollama_client
+from core.ollama_models import keep_alive_value
+from core.retriever import COMPILED_PROMPT, RETRIEVAL_CANDIDATES
+from core.retrieval_cache import cached_similarity_search
+from core.streaming import StreamingAnswer, record_generation, stream_ollama
 
-# Carica il template di prompt
-PROMPT_TEMPLATE = load_prompt_from_file()
-
-# Configurazione Ollama
-# Assicurati che OLLAMA_HOST (es. "http://127.0.0.1:11435") sia settato come env var
-OLLAMA_HOST = "http://127.0.0.1:11436"
-OLLAMA_URL = f"{OLLAMA_HOST}/generate"
-GEMMA_MODEL_NAME = "gemma3:latest"  # dal `ollama list`
+# Configurazione Ollama (GEMMA_OLLAMA_HOST nel `.env`, es. "http://127.0.0.1:11436")
+OLLAMA_HOST = GEMMA_OLLAMA_HOST
+OLLAMA_GENERATE_PATH = "/api/generate"
+GEMMA_MODEL_NAME = GEMMA_MODEL  # dal `ollama list` (GEMMA_MODEL nel `.env`)
 
 def _call_ollama(prompt: str) -> str:
     """
@@ -20,60 +21,85 @@ def _call_ollama(prompt: str) -> str:
     payload = {
         "model": GEMMA_MODEL_NAME,
         "prompt": prompt,
-        "stream": False
+        "stream": False,
+        "keep_alive": keep_alive_value()
     }
-    response = requests.post(OLLAMA_URL, json=payload)
-    try:
-        response.raise_for_status()
-    except requests.HTTPError as e:
-        # Mostra dettagli dell’errore Ollama
-        raise RuntimeError(f"Ollama API Error {response.status_code}: {response.text}") from e
-
-    data = response.json()
+    # Client condiviso: connessioni keep-alive, timeout, retry e circuit breaker
+    start = time.perf_counter()
+    data = get_ollama_client(OLLAMA_HOST).post_json(OLLAMA_GENERATE_PATH, payload)
+    record_generation(GEMMA_MODEL_NAME, start, {
+        "input_tokens": data.get("prompt_eval_count"),
+        "output_tokens": data.get("eval_count"),
+    })
     # Ollama restituisce le risposte in 'choices': [{'text': ...}, ...]
     if isinstance(data, dict) and "choices" in data and data["choices"]:
         return data["choices"][0].get("text", "").strip()
     # Fallback a campo 'response' se presente
     return data.get("response", "").strip()
 
-def query_rag_with_gemma(query_text, vector_store, expertise_level="expert"):
+def _stream_ollama(prompt: str) -> StreamingAnswer:
+    """
+    Invia il prompt a Ollama con `"stream": true` e ritorna la risposta in streaming.
+    La richiesta parte quando la risposta inizia a essere consumata.
+    """
+    payload = {
+        "model": GEMMA_MODEL_NAME,
+        "prompt": prompt,
+        "stream": True,
+        "keep_alive": keep_alive_value()
+    }
+    events = get_ollama_client(OLLAMA_HOST).stream_json(OLLAMA_GENERATE_PATH, payload)
+    usage = {}
+    return StreamingAnswer(GEMMA_MODEL_NAME, stream_ollama(events, usage), usage)
+
+def query_rag_with_gemma(query_text, vector_store, expertise_level="expert", stream=False,
+                         conversation_history="", retrieval_query=None):
     """
     Esegue una query RAG utilizzando Gemma locale via Ollama.
     1) Recupero semantico dal vector_store.
     2) Costruzione del prompt con contesto e domanda.
-    3) Invio del prompt a Ollama e ottenimento della generazione.
+    3) Invio del prompt a Ollama e ottenimento della generazione
+       (in streaming con `stream=True`).
     4) Raccolta dei riferimenti dei documenti.
+    `conversation_history` è la memoria della conversazione da inserire nel prompt;
+    `retrieval_query`, se indicata, sostituisce la domanda nel recupero semantico.
     """
     # 1) Recupero semantico
-    results = vector_store.similarity_search_with_score(query_text, k=5)
+    results = cached_similarity_search(
+        vector_store, retrieval_query or query_text, k=RETRIEVAL_CANDIDATES, kind="score"
+    )
     if not results:
         return "Non ci sono risultati pertinenti per la tua domanda.", []
 
-    # 2) Costruzione del contesto
-    context = "\n\n---\n\n".join([doc.page_content for doc, _ in results])
+    # 2) Costruzione del contesto entro il budget di token del modello
+    packed = build_context(results, CONTEXT_TOKEN_BUDGETS["gemma"], vector_store=vector_store)
+    context = packed["text"]
 
     # 3) Preparazione prompt
-    prompt_template = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
-    prompt = prompt_template.format(
+    # Template compilato una sola volta (le istruzioni statiche restano il prefisso comune del prompt)
+    prompt = COMPILED_PROMPT.format(
         context=context,
         question=query_text,
         expertise_level=expertise_level,
-        conversation_history=""
+        conversation_history=conversation_history
     )
 
-    # 4) Chiamata a Gemma via Ollama
-    generated_text = _call_ollama(prompt)
-
-    # 5) Riferimenti
+    # 4) Riferimenti
     references = [
         {
             "file_name": doc.metadata.get("file_name", "Documento sconosciuto"),
             "file_path": doc.metadata.get("file_path", None),
             "source_url": doc.metadata.get("source_url", None),
+            "title": doc.metadata.get("page_title", None),
         }
-        for doc, _ in results
+        for doc in packed["sources"]
     ]
 
+    # 5) Chiamata a Gemma via Ollama
+    if stream:
+        return _stream_ollama(prompt), references
+    generated_text = _call_ollama(prompt)
+
     # Rimuovi il prompt dal testo generato, se presente
     if generated_text.startswith(prompt):
         answer = generated_text[len(prompt):].strip()
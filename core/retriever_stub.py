@@ -0,0 +1,74 @@
+# retriever_stub.py
+
+"""
+Backend di generazione deterministico, senza rete né modelli.
+
+Usa il retrieval reale sulla KB (se fornita) e produce una risposta
+ricavata in modo deterministico da domanda e livello di esperienza: stessa
+domanda, stessa risposta. Serve per test, benchmark e per provare la UI
+senza Ollama o una chiave Anthropic.
+"""
+
+import hashlib
+import time
+
+from core.retrieval_cache import cached_similarity_search
+from core.streaming import StreamingAnswer, record_generation
+
+STUB_MODEL_NAME = "stub"
+STUB_WORDS = (
+    "secondo la documentazione la procedura richiede una verifica preliminare dei dati "
+    "un controllo incrociato con le fonti interne e una sintesi finale dei risultati"
+).split()
+
+
+def stub_answer_words(query_text, expertise_level="expert", length=40):
+    """Parole della risposta: dipendono solo da domanda e livello di esperienza."""
+    digest = hashlib.sha256(f"{expertise_level}\n{query_text}".encode("utf-8")).digest()
+    return [STUB_WORDS[digest[i % len(digest)] % len(STUB_WORDS)] for i in range(length)]
+
+
+def _stream_words(words, token_delay):
+    for i, word in enumerate(words):
+        if token_delay:
+            time.sleep(token_delay)
+        yield word if i == 0 else " " + word
+
+
+def query_rag_with_stub(query_text, vector_store, expertise_level="expert", stream=False, token_delay=0.0,
+                        conversation_history="", retrieval_query=None):
+    """
+    Esegue il retrieval e restituisce una risposta deterministica.
+
+    Parameters:
+    - query_text (str): La domanda.
+    - vector_store: Vector store della KB (None per saltare il retrieval).
+    - expertise_level (str): Livello di esperienza, influisce sulla risposta.
+    - stream (bool): Se True la risposta è uno `StreamingAnswer`.
+    - token_delay (float): Pausa in secondi tra una parola e l'altra in streaming.
+    - conversation_history (str): Memoria della conversazione (conteggiata nei token di input).
+    - retrieval_query (str): Query per il retrieval, se diversa dalla domanda.
+
+    Returns:
+    - tuple: (risposta, riferimenti), come gli altri retriever.
+    """
+    results = cached_similarity_search(vector_store, retrieval_query or query_text, k=3, kind="score") if vector_store else []
+    references = [
+        {
+            "file_name": doc.metadata.get("file_name", "Documento sconosciuto"),
+            "file_path": doc.metadata.get("file_path", None),
+            "source_url": doc.metadata.get("source_url", None),
+            "title": doc.metadata.get("page_title", None),
+        }
+        for doc, _ in results
+    ]
+
+    words = stub_answer_words(query_text, expertise_level)
+    usage = {"input_tokens": len(query_text.split()) + len(conversation_history.split()), "output_tokens": len(words)}
+    if stream:
+        return StreamingAnswer(STUB_MODEL_NAME, _stream_words(words, token_delay), usage), references
+
+    start = time.perf_counter()
+    answer = "".join(_stream_words(words, token_delay))
+    record_generation(STUB_MODEL_NAME, start, usage)
+    return answer, references
@@ -0,0 +1,186 @@
+# session_store.py
+
+"""
+Sessioni di accesso degli utenti, condivise tra i processi dell'app.
+
+Il token di sessione (nel parametro `token` dell'URL) identifica l'utente in
+qualunque worker dietro al load balancer e sopravvive ai riavvii. Le sessioni
+scadono dopo `SESSION_TTL_SECONDS` di inattività: la scadenza viene rinnovata
+quando l'utente usa l'app, al più una volta ogni metà della durata per non
+scrivere sul database a ogni rerun.
+
+Il backend è scelto con `SESSION_BACKEND`: "sqlite" (predefinito, `SESSION_DB`),
+"memory" (un solo processo, sessioni perse al riavvio) oppure "modulo:Classe"
+per un backend esterno con la stessa interfaccia di `SessionStore`.
+"""
+
+import hashlib
+import importlib
+import secrets
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from config import SESSION_BACKEND, SESSION_DB, SESSION_TTL_SECONDS
+
+
+def _token_key(token):
+    # Nel database solo l'hash del token: una copia del file non permette di riusare le sessioni
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class SessionStore(ABC):
+    """Interfaccia dei backend delle sessioni."""
+
+    def __init__(self, ttl=SESSION_TTL_SECONDS):
+        self.ttl = ttl
+
+    @abstractmethod
+    def create(self, username):
+        """Apre una sessione per l'utente e ne restituisce il token."""
+
+    @abstractmethod
+    def get(self, token):
+        """Utente della sessione (rinnovandone la scadenza), None se il token non è valido o è scaduto."""
+
+    @abstractmethod
+    def delete(self, token):
+        """Chiude la sessione del token (nessun effetto se non esiste)."""
+
+    @abstractmethod
+    def purge_expired(self):
+        """Elimina le sessioni scadute. Restituisce quante."""
+
+
+class MemorySessionStore(SessionStore):
+    """Sessioni nella memoria del processo (un solo worker)."""
+
+    def __init__(self, ttl=SESSION_TTL_SECONDS):
+        super().__init__(ttl)
+        self._lock = threading.Lock()
+        self._sessions = {}  # hash del token -> (utente, scadenza)
+
+    def create(self, username):
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._sessions[_token_key(token)] = (username, time.time() + self.ttl)
+        return token
+
+    def get(self, token):
+        if not token:
+            return None
+        key = _token_key(token)
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                return None
+            username, expires_at = session
+            if expires_at <= now:
+                del self._sessions[key]
+                return None
+            self._sessions[key] = (username, now + self.ttl)
+            return username
+
+    def delete(self, token):
+        if token:
+            with self._lock:
+                self._sessions.pop(_token_key(token), None)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (_, expires_at) in self._sessions.items() if expires_at <= now]
+            for key in expired:
+                del self._sessions[key]
+        return len(expired)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessioni in un database SQLite condiviso dai processi dell'app."""
+
+    def __init__(self, path=SESSION_DB, ttl=SESSION_TTL_SECONDS):
+        super().__init__(ttl)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "token_hash TEXT PRIMARY KEY, username TEXT NOT NULL, created_at REAL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires_at)")
+        return self._db
+
+    def create(self, username):
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            # Le sessioni scadute vengono eliminate alla creazione delle nuove
+            db.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+            db.execute(
+                "INSERT INTO sessions (token_hash, username, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (_token_key(token), username, now, now + self.ttl),
+            )
+        return token
+
+    def get(self, token):
+        if not token:
+            return None
+        key = _token_key(token)
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            row = db.execute(
+                "SELECT username, expires_at FROM sessions WHERE token_hash = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                return None
+            if row[1] - now < self.ttl / 2:
+                db.execute("UPDATE sessions SET expires_at = ? WHERE token_hash = ?", (now + self.ttl, key))
+            return row[0]
+
+    def delete(self, token):
+        if token:
+            with self._lock:
+                self._connection().execute("DELETE FROM sessions WHERE token_hash = ?", (_token_key(token),))
+
+    def purge_expired(self):
+        with self._lock:
+            return self._connection().execute(
+                "DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)
+            ).rowcount
+
+
+SESSION_BACKENDS = {
+    "sqlite": SQLiteSessionStore,
+    "memory": MemorySessionStore,
+}
+
+
+def create_session_store(backend=SESSION_BACKEND):
+    """Crea il backend indicato: un nome di `SESSION_BACKENDS` oppure "modulo:Classe"."""
+    if backend in SESSION_BACKENDS:
+        return SESSION_BACKENDS[backend]()
+    if ":" in backend:
+        module_name, class_name = backend.split(":")
+        return getattr(importlib.import_module(module_name), class_name)()
+    raise ValueError(f"Backend delle sessioni non supportato: {backend}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = create_session_store()
+        return _store
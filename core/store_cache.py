@@ -0,0 +1,183 @@
+# store_cache.py
+
+"""
+Handle dei vector store condivisi a livello di processo.
+
+Ogni rerun di Streamlit chiedeva un nuovo vector store (e un nuovo client
+Chroma) per la KB selezionata. La cache tiene un solo handle per cartella
+della KB, condiviso da tutte le sessioni, e lo riapre solo se la cartella
+viene sostituita (es. `tools.compress_kb --replace`), se viene invalidato
+esplicitamente dopo eliminazioni e compattazioni o se la versione della KB
+(`core.kb_version`) è cambiata per una scrittura di un altro processo (es. un
+altro worker del servizio API): gli indici in memoria di quell'handle non
+vedrebbero i nuovi documenti.
+
+Quando la memoria stimata degli handle supera `VECTOR_STORE_CACHE_MB`, le
+KB inutilizzate da più tempo (e inattive da almeno
+`VECTOR_STORE_IDLE_SECONDS`) escono dalla cache. Gli handle rimossi non
+vengono chiusi esplicitamente: una sessione potrebbe usarli ancora fino al
+rerun successivo; le risorse vengono rilasciate quando non restano
+riferimenti.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from config import VECTOR_STORE_CACHE_MB, VECTOR_STORE_IDLE_SECONDS
+from core.embeddings import get_embedding_function
+from core.kb_version import get_kb_version
+from core.vector_store import open_vector_store
+
+
+def directory_size(path):
+    """Byte occupati su disco dalla cartella (stima della memoria di un handle Chroma)."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def estimate_store_bytes(store):
+    """Memoria stimata dell'handle: strutture di ricerca per HNSW e compresso, file su disco per Chroma."""
+    footprint = getattr(store, "memory_footprint", None)
+    if footprint is not None:
+        return footprint()
+    return directory_size(store.path)
+
+
+class _Entry:
+    def __init__(self, store, inode, size, version):
+        self.store = store
+        self.inode = inode
+        self.size = size
+        self.version = version
+        self.last_used = time.monotonic()
+
+
+class VectorStoreCache:
+    """
+    Cache LRU thread-safe degli handle dei vector store, per cartella della KB.
+
+    Parameters:
+    - max_bytes (int): Memoria stimata oltre la quale le KB inattive vengono rimosse.
+    - idle_seconds (float): Inattività minima perché una KB possa essere rimossa.
+    """
+
+    def __init__(self, max_bytes=VECTOR_STORE_CACHE_MB * 1024 * 1024, idle_seconds=VECTOR_STORE_IDLE_SECONDS):
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._open_locks = {}
+        self.opens = 0
+        self.hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _open_lock(self, persist_directory):
+        with self._lock:
+            return self._open_locks.setdefault(persist_directory, threading.Lock())
+
+    @staticmethod
+    def _inode(persist_directory):
+        try:
+            return os.stat(persist_directory).st_ino
+        except FileNotFoundError:
+            return None
+
+    def _lookup(self, persist_directory, inode):
+        version = get_kb_version(persist_directory)
+        with self._lock:
+            entry = self._entries.get(persist_directory)
+            if entry is None:
+                return None
+            if entry.inode != inode or entry.version != version:
+                # Cartella sostituita o rimossa, o KB modificata da un altro processo
+                del self._entries[persist_directory]
+                self.invalidations += 1
+                return None
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(persist_directory)
+            self.hits += 1
+            return entry.store
+
+    def get(self, persist_directory, backend=None):
+        """
+        Restituisce l'handle condiviso della KB, aprendolo (una sola volta anche con
+        richieste contemporanee) se non è in cache.
+        """
+        store = self._lookup(persist_directory, self._inode(persist_directory))
+        if store is not None:
+            return store
+        with self._open_lock(persist_directory):
+            store = self._lookup(persist_directory, self._inode(persist_directory))
+            if store is not None:
+                return store
+            version = get_kb_version(persist_directory)
+            store = open_vector_store(persist_directory, get_embedding_function(), backend=backend)
+            entry = _Entry(store, self._inode(persist_directory), estimate_store_bytes(store), version)
+            with self._lock:
+                self._entries[persist_directory] = entry
+                self.opens += 1
+                self._evict()
+            return store
+
+    def _evict(self):
+        """Rimuove le KB inattive meno usate finché la memoria stimata resta sopra il limite."""
+        now = time.monotonic()
+        total = sum(entry.size for entry in self._entries.values())
+        for path in list(self._entries):
+            if total <= self.max_bytes or len(self._entries) <= 1:
+                break
+            entry = self._entries[path]
+            if now - entry.last_used < self.idle_seconds:
+                continue
+            del self._entries[path]
+            total -= entry.size
+            self.evictions += 1
+
+    def note_version(self, persist_directory, store, version):
+        """
+        Registra una scrittura fatta da questo processo tramite `store`: se è l'handle in
+        cache resta valido con la nuova versione, invece di essere riaperto.
+        """
+        with self._lock:
+            entry = self._entries.get(persist_directory)
+            if entry is not None and entry.store is store:
+                entry.version = version
+
+    def invalidate(self, persist_directory=None):
+        """
+        Rimuove l'handle della KB (o tutti) dalla cache: la richiesta successiva lo riapre.
+        Da chiamare dopo eliminazioni, compattazioni o sostituzioni della KB.
+        """
+        with self._lock:
+            paths = list(self._entries) if persist_directory is None else [persist_directory]
+            for path in paths:
+                if self._entries.pop(path, None) is not None:
+                    self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(entry.size for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "opens": self.opens,
+                "hits": self.hits,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "kbs": [
+                    {"path": path, "bytes": entry.size, "idle_s": round(time.monotonic() - entry.last_used, 1)}
+                    for path, entry in self._entries.items()
+                ],
+            }
+
+
+STORE_CACHE = VectorStoreCache()
@@ -0,0 +1,193 @@
+# streaming.py
+
+"""
+Generazione in streaming delle risposte dei modelli.
+
+`StreamingAnswer` avvolge l'iteratore dei frammenti di testo prodotti dal
+backend: viene consumato una sola volta (es. da `st.write_stream` in
+`format_response`), accumula il testo completo e, a stream concluso (anche se
+interrotto), registra latenza e token in `GENERATION_STATS`.
+"""
+
+import itertools
+import threading
+import time
+from collections import deque
+
+from core.llm_client import ANTHROPIC_GUARD, LLMBackendError
+from core.query_metrics import current_trace
+from utils.stats import summarize
+
+
+class GenerationStats:
+    """Ultime misure di generazione per modello, condivise a livello di processo."""
+
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, stats):
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.max_samples)).append(stats)
+
+    def summary(self):
+        """Riepilogo per modello: richieste, latenze (p50/p95/p99), token e uso della cache dei prompt."""
+        with self._lock:
+            samples = {model: list(values) for model, values in self._samples.items()}
+        return {
+            model: {
+                "requests": len(values),
+                "completed": sum(1 for s in values if s["completed"]),
+                "ttft_ms": summarize([s["ttft_ms"] for s in values if s["ttft_ms"] is not None]),
+                "total_ms": summarize([s["total_ms"] for s in values]),
+                "input_tokens": sum(s["input_tokens"] or 0 for s in values),
+                "output_tokens": sum(s["output_tokens"] or 0 for s in values),
+                "cache_creation_tokens": sum(s.get("cache_creation_input_tokens") or 0 for s in values),
+                "cache_read_tokens": sum(s.get("cache_read_input_tokens") or 0 for s in values),
+                "cache_hits": sum(1 for s in values if s.get("cache_read_input_tokens")),
+            }
+            for model, values in samples.items()
+        }
+
+
+GENERATION_STATS = GenerationStats()
+
+
+def record_generation(model, start, usage, first_chunk_at=None, completed=True, trace=None):
+    """
+    Registra in `GENERATION_STATS` una generazione iniziata a `start` (perf_counter)
+    e la riporta nella traccia della domanda (`trace` o quella attiva).
+    """
+    stats = {
+        "completed": completed,
+        "ttft_ms": (first_chunk_at - start) * 1000 if first_chunk_at else None,
+        "total_ms": (time.perf_counter() - start) * 1000,
+        "input_tokens": usage.get("input_tokens"),
+        "output_tokens": usage.get("output_tokens"),
+        "cache_creation_input_tokens": usage.get("cache_creation_input_tokens"),
+        "cache_read_input_tokens": usage.get("cache_read_input_tokens"),
+    }
+    GENERATION_STATS.record(model, stats)
+    trace = trace or current_trace()
+    if trace is not None:
+        trace.record_generation(model, stats)
+    return stats
+
+
+def anthropic_usage(usage):
+    """Token d'uso di una risposta Anthropic, inclusi quelli della cache dei prompt."""
+    return {
+        "input_tokens": usage.input_tokens,
+        "output_tokens": usage.output_tokens,
+        "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+        "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+    }
+
+
+class StreamingAnswer:
+    """
+    Risposta di un modello generata in streaming.
+
+    Parameters:
+    - model (str): Nome del modello, usato come chiave delle statistiche.
+    - chunks (iterator): Iteratore dei frammenti di testo prodotti dal backend.
+    - usage (dict): Dizionario aggiornato dal backend con "input_tokens" e
+      "output_tokens" quando lo stream termina.
+    """
+
+    def __init__(self, model, chunks, usage=None):
+        self.model = model
+        self.usage = usage if usage is not None else {}
+        self.text = ""
+        self.stats = None
+        self._chunks = chunks
+        self._start = time.perf_counter()
+        self._trace = current_trace()
+        self._done_callbacks = []
+        self._finished = False
+        self._prefetched = None
+        self._first_chunk_at = None
+
+    def prefetch(self):
+        """
+        Legge il primo frammento in anticipo: gli errori di connessione o del backend
+        emergono qui, quando il router può ancora passare a un modello di fallback,
+        invece che durante la visualizzazione della risposta.
+        """
+        if self._prefetched is not None:
+            return
+        self._chunks = iter(self._chunks)
+        try:
+            self._prefetched = next((piece for piece in self._chunks if piece), None)
+        except Exception:
+            self.stats = record_generation(self.model, self._start, self.usage, completed=False, trace=self._trace)
+            self._finish()
+            raise
+        if self._prefetched is not None:
+            self._first_chunk_at = time.perf_counter()
+
+    def add_done_callback(self, callback):
+        """Registra una funzione da chiamare a fine stream (o alla chiusura se mai consumato)."""
+        if self._finished:
+            callback()
+        else:
+            self._done_callbacks.append(callback)
+
+    def _finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        for callback in self._done_callbacks:
+            callback()
+
+    def close(self):
+        """Chiude uno stream non consumato liberando le risorse associate."""
+        if hasattr(self._chunks, "close"):
+            self._chunks.close()
+        self._finish()
+
+    def __del__(self):
+        if getattr(self, "_done_callbacks", None):
+            self._finish()
+
+    def __iter__(self):
+        parts, first_chunk_at, completed = [], self._first_chunk_at, False
+        chunks = itertools.chain([self._prefetched] if self._prefetched else [], self._chunks)
+        try:
+            for piece in chunks:
+                if not piece:
+                    continue
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                parts.append(piece)
+                yield piece
+            completed = True
+        finally:
+            self.text = "".join(parts)
+            self.stats = record_generation(
+                self.model, self._start, self.usage, first_chunk_at, completed, trace=self._trace
+            )
+            self._finish()
+
+    def __str__(self):
+        return self.text
+
+
+def stream_anthropic(client, usage, **request):
+    """Frammenti di testo da `client.messages.stream`, con i token d'uso a fine stream."""
+    with ANTHROPIC_GUARD.slot(), client.messages.stream(**request) as stream:
+        for text in stream.text_stream:
+            yield text
+        usage.update(anthropic_usage(stream.get_final_message().usage))
+
+
+def stream_ollama(events, usage):
+    """Frammenti di testo dagli oggetti NDJSON di `/api/generate` con `"stream": true`."""
+    for data in events:
+        if data.get("error"):
+            raise LLMBackendError(f"Ollama API Error: {data['error']}")
+        yield data.get("response", "")
+        if data.get("done"):
+            usage["input_tokens"] = data.get("prompt_eval_count")
+            usage["output_tokens"] = data.get("eval_count")
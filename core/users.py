@@ -0,0 +1,65 @@
+# users.py
+
+"""
+Credenziali degli utenti (`USERS_FILE`, JSON {utente: password}).
+
+Il file viene letto una sola volta e tenuto in memoria; ad ogni accesso un
+`os.stat` verifica se è cambiato (inode, dimensione e mtime), così più
+processi servono gli stessi utenti senza rileggerlo e vedono subito le modifiche.
+"""
+
+import hmac
+import json
+import os
+import threading
+
+from config import USERS_FILE
+
+
+class UserDirectory:
+    """Credenziali lette da `path`, con i nomi utente in maiuscolo."""
+
+    def __init__(self, path=USERS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._users = {}
+
+    def _current(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return {}
+        signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if signature != self._signature:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        users = json.load(f)
+                except json.JSONDecodeError:
+                    return self._users  # file in scrittura: restano le credenziali precedenti
+                self._users = {name.upper(): password.strip() for name, password in users.items()}
+                self._signature = signature
+            return self._users
+
+    def authenticate(self, username, password):
+        """True se la password dell'utente (nome senza distinzione maiuscole/minuscole) è corretta."""
+        expected = self._current().get(username.upper())
+        # Confronto a tempo costante anche per gli utenti inesistenti
+        return hmac.compare_digest((expected or "").encode("utf-8"), password.encode("utf-8")) \
+            and expected is not None
+
+    def usernames(self):
+        return sorted(self._current())
+
+
+_directory = None
+_directory_lock = threading.Lock()
+
+
+def get_user_directory():
+    global _directory
+    with _directory_lock:
+        if _directory is None:
+            _directory = UserDirectory()
+        return _directory
@@ -0,0 +1,199 @@
+# vector_store.py
+
+"""
+Livello di astrazione sui backend dei vettori.
+
+`DocumentManager`, `load_or_create_chroma_db` e i retriever usano solo
+l'interfaccia di `VectorStore`, senza accedere agli attributi privati del
+wrapper LangChain. Sono disponibili due backend:
+- `ChromaVectorStore`: il wrapper storico su Chroma;
+- `HNSWVectorStore` (in `core.hnsw_store`): grafo HNSW su vettori in
+  memory-mapping con tabella dei metadati SQLite affiancata.
+"""
+
+import json
+import math
+import os
+import uuid
+from abc import ABC, abstractmethod
+
+
+class VectorStore(ABC):
+    """
+    Interfaccia comune dei vector store di una knowledge base.
+
+    I risultati di `get` seguono il formato di Chroma: un dizionario con le
+    chiavi "ids", "documents", "metadatas" ed "embeddings" (solo quelle
+    richieste in `include`, oltre a "ids" sempre presente).
+    """
+
+    backend_name = None
+
+    def __init__(self, persist_directory, embedding_function):
+        self.persist_directory = persist_directory
+        self.embedding_function = embedding_function
+
+    @property
+    def path(self):
+        """Cartella su disco della KB, usata come chiave per versioni e cache."""
+        return self.persist_directory
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    @abstractmethod
+    def add_documents(self, documents, ids=None):
+        """Aggiunge i documenti calcolandone gli embedding e restituisce i loro id."""
+
+    @abstractmethod
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        """Aggiunge chunk con embedding già calcolati (es. copia da un altro backend)."""
+
+    @abstractmethod
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=None):
+        """Chunk che corrispondono a `ids` e/o al filtro `where`, nel formato di Chroma."""
+
+    @abstractmethod
+    def delete(self, ids=None, where=None):
+        """Elimina i chunk che corrispondono a `ids` e/o al filtro `where`."""
+
+    @abstractmethod
+    def count(self):
+        """Numero di chunk presenti."""
+
+    @abstractmethod
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None):
+        """Restituisce una lista di (Document, distanza L2 al quadrato)."""
+
+    def persist(self):
+        """Forza la scrittura su disco, per i backend che la richiedono."""
+
+    def close(self):
+        """Rilascia le risorse (file, connessioni) del backend."""
+
+    def similarity_search_with_score(self, query, k=4, filter=None):
+        embedding = self.embedding_function.embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, k=k, filter=filter)
+
+    def similarity_search_with_relevance_scores(self, query, k=4, filter=None):
+        """Come `similarity_search_with_score`, con punteggi di rilevanza in [0, 1]."""
+        return [
+            (doc, self.relevance_score(distance))
+            for doc, distance in self.similarity_search_with_score(query, k=k, filter=filter)
+        ]
+
+    @staticmethod
+    def relevance_score(distance):
+        # Stessa normalizzazione usata da LangChain per la distanza euclidea
+        return 1.0 - distance / math.sqrt(2)
+
+
+class ChromaVectorStore(VectorStore):
+    """Backend basato sul wrapper LangChain di Chroma."""
+
+    backend_name = "chroma"
+
+    def __init__(self, persist_directory, embedding_function):
+        super().__init__(persist_directory, embedding_function)
+        from langchain.vectorstores import Chroma
+        self._store = Chroma(persist_directory=persist_directory, embedding_function=embedding_function)
+
+    def add_documents(self, documents, ids=None):
+        return self._store.add_documents(documents, ids=ids) if ids else self._store.add_documents(documents)
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        self._store._collection.add(ids=ids, embeddings=[list(map(float, e)) for e in embeddings],
+                                    metadatas=metadatas, documents=list(texts))
+        return ids
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=None):
+        kwargs = {"include": list(include)}
+        if ids is not None:
+            kwargs["ids"] = list(ids)
+        if where:
+            kwargs["where"] = where
+        if limit is not None:
+            kwargs["limit"] = limit
+            kwargs["offset"] = offset or 0
+        return self._store._collection.get(**kwargs)
+
+    def delete(self, ids=None, where=None):
+        kwargs = {}
+        if ids is not None:
+            kwargs["ids"] = list(ids)
+        if where:
+            kwargs["where"] = where
+        self._store._collection.delete(**kwargs)
+
+    def count(self):
+        return self._store._collection.count()
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None):
+        # Nonostante il nome, il metodo di LangChain restituisce le distanze di Chroma
+        return self._store.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=filter)
+
+    def similarity_search_with_score(self, query, k=4, filter=None):
+        return self._store.similarity_search_with_score(query, k=k, filter=filter)
+
+    def similarity_search_with_relevance_scores(self, query, k=4, filter=None):
+        return self._store.similarity_search_with_relevance_scores(query, k=k, filter=filter)
+
+    def persist(self):
+        if hasattr(self._store, "persist"):
+            self._store.persist()
+
+
+def detect_backend(persist_directory):
+    """Riconosce il backend di una KB esistente dai file presenti nella cartella."""
+    from core.hnsw_store import META_FILE, METADATA_FILE
+    if not os.path.exists(os.path.join(persist_directory, METADATA_FILE)):
+        return "chroma"
+    try:
+        with open(os.path.join(persist_directory, META_FILE), "r", encoding="utf-8") as f:
+            return json.load(f).get("backend", "hnsw")
+    except FileNotFoundError:
+        return "hnsw"
+
+
+def open_vector_store(persist_directory, embedding_function, backend=None, **options):
+    """
+    Apre (o crea) il vector store di una KB.
+
+    Parameters:
+    - persist_directory (str): Cartella della KB.
+    - embedding_function: Funzione di embedding LangChain.
+    - backend (str): "chroma", "hnsw" o "quantized". Se None viene riconosciuto dai file
+      esistenti, con fallback su "chroma" per le KB nuove.
+    - options: Opzioni specifiche del backend (es. `dtype` per HNSW, `compression`
+      e `reduce_dim` per il backend compresso).
+
+    Returns:
+    - VectorStore: Il vector store della KB.
+    """
+    if backend is None:
+        backend = detect_backend(persist_directory) if os.path.isdir(persist_directory) else "chroma"
+    if backend == "hnsw":
+        from core.hnsw_store import HNSWVectorStore
+        return HNSWVectorStore(persist_directory, embedding_function, **options)
+    if backend == "quantized":
+        from core.quantized_store import QuantizedVectorStore
+        return QuantizedVectorStore(persist_directory, embedding_function, **options)
+    if backend == "chroma":
+        return ChromaVectorStore(persist_directory, embedding_function)
+    raise ValueError(f"Backend del vector store non supportato: {backend}")
+
+
+def copy_vector_store(source, target, batch_size=1000):
+    """
+    Copia tutti i chunk (testo, metadati ed embedding) da un vector store a un
+    altro, senza ricalcolare gli embedding. Restituisce il numero di chunk copiati.
+    """
+    copied = 0
+    while True:
+        batch = source.get(include=["documents", "metadatas", "embeddings"], limit=batch_size, offset=copied)
+        if not batch["ids"]:
+            return copied
+        target.add_embeddings(batch["documents"], batch["embeddings"], batch["metadatas"], ids=batch["ids"])
+        copied += len(batch["ids"])
@@ -0,0 +1,113 @@
+# web_metadata.py
+
+"""
+Metadati di visualizzazione delle pagine web (titolo, descrizione, sito).
+
+Vengono estratti una sola volta durante il crawling e salvati nei metadati
+dei chunk; in più i titoli finiscono in una cache persistente SQLite
+(`WEB_TITLE_CACHE_DB`), usata come fallback per i chunk indicizzati prima
+di questa modifica. La visualizzazione dei riferimenti non fa quindi alcuna
+richiesta di rete.
+"""
+
+import sqlite3
+import threading
+import time
+
+from config import WEB_TITLE_CACHE_DB
+
+MAX_TITLE_LENGTH = 300
+MAX_DESCRIPTION_LENGTH = 500
+
+
+def _meta_content(soup, **attrs):
+    tag = soup.find("meta", attrs=attrs)
+    content = tag.get("content") if tag else None
+    return " ".join(content.split()) if content else None
+
+
+def extract_page_metadata(soup):
+    """
+    Metadati di visualizzazione di una pagina già analizzata con BeautifulSoup.
+
+    Returns:
+    - dict: "page_title", "page_description", "site_name", "page_language" (solo quelli presenti).
+    """
+    title = None
+    if soup.title and soup.title.string:
+        title = " ".join(soup.title.string.split())
+    title = title or _meta_content(soup, property="og:title")
+    if not title and soup.find("h1"):
+        title = " ".join(soup.find("h1").get_text(" ", strip=True).split())
+    description = _meta_content(soup, name="description") or _meta_content(soup, property="og:description")
+    html = soup.find("html")
+    metadata = {
+        "page_title": title[:MAX_TITLE_LENGTH] if title else None,
+        "page_description": description[:MAX_DESCRIPTION_LENGTH] if description else None,
+        "site_name": _meta_content(soup, property="og:site_name"),
+        "page_language": html.get("lang") if html else None,
+    }
+    return {key: value for key, value in metadata.items() if value}
+
+
+class WebTitleCache:
+    """Cache persistente (SQLite) URL -> titolo della pagina, condivisa tra processi."""
+
+    def __init__(self, path=WEB_TITLE_CACHE_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self._memory = {}
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS web_titles (url TEXT PRIMARY KEY, title TEXT NOT NULL, updated_at REAL)"
+            )
+        return self._db
+
+    def get(self, url):
+        with self._lock:
+            if url in self._memory:
+                return self._memory[url]
+            row = self._connection().execute("SELECT title FROM web_titles WHERE url = ?", (url,)).fetchone()
+            title = row[0] if row else None
+            if title:
+                self._memory[url] = title
+            return title
+
+    def put_many(self, titles):
+        """Salva {url: titolo}, ignorando i titoli vuoti."""
+        rows = [(url, title, time.time()) for url, title in titles.items() if title]
+        if not rows:
+            return
+        with self._lock:
+            self._connection().executemany(
+                "INSERT INTO web_titles (url, title, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET title = excluded.title, updated_at = excluded.updated_at",
+                rows,
+            )
+            self._memory.update({url: title for url, title, _ in rows})
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_title_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = WebTitleCache()
+        return _cache
+
+
+def reference_title(reference):
+    """
+    Titolo da mostrare per un riferimento web, senza accessi alla rete:
+    metadato salvato all'indicizzazione, poi cache persistente, infine l'URL.
+    """
+    url = reference.get("source_url")
+    return reference.get("title") or (get_title_cache().get(url) if url else None) or url
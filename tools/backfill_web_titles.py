@@ -0,0 +1,74 @@
+# backfill_web_titles.py
+
+"""
+Popola la cache persistente dei titoli per i contenuti web già indicizzati.
+
+I chunk web caricati prima dell'estrazione dei metadati al crawling non
+hanno `page_title`: lo strumento scarica (in parallelo, una volta sola) le
+pagine dei loro `source_url` non ancora presenti nella cache, così la
+visualizzazione delle risposte non deve mai accedere alla rete.
+
+Uso:
+    python -m tools.backfill_web_titles <utente>_<kb> [--workers 8] [--timeout 5]
+"""
+
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from bs4 import BeautifulSoup
+
+from core.database import kb_storage_path
+from core.vector_store import open_vector_store
+from core.web_metadata import extract_page_metadata, get_title_cache
+
+
+def fetch_title(url, timeout=5):
+    try:
+        response = requests.get(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=timeout)
+        response.raise_for_status()
+    except requests.RequestException:
+        return None
+    if "text/html" not in response.headers.get("Content-Type", ""):
+        return None
+    return extract_page_metadata(BeautifulSoup(response.text, "html.parser")).get("page_title")
+
+
+def backfill_titles(kb_name, workers=8, timeout=5):
+    """Scarica i titoli mancanti e restituisce il riepilogo."""
+    persist_directory = kb_storage_path(kb_name)
+    if not os.path.isdir(persist_directory):
+        raise ValueError(f"La knowledge base '{kb_name}' non esiste.")
+    store = open_vector_store(persist_directory, embedding_function=None)
+    metadatas = store.get(include=["metadatas"])["metadatas"]
+    store.close()
+
+    cache = get_title_cache()
+    urls = {metadata["source_url"] for metadata in metadatas
+            if metadata and metadata.get("source_url") and not metadata.get("page_title")}
+    missing = sorted(url for url in urls if cache.get(url) is None)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        titles = dict(zip(missing, pool.map(lambda url: fetch_title(url, timeout), missing)))
+    cache.put_many(titles)
+    return {
+        "kb": kb_name,
+        "urls_without_title": len(urls),
+        "already_cached": len(urls) - len(missing),
+        "fetched": sum(1 for title in titles.values() if title),
+        "failed": sum(1 for title in titles.values() if not title),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Popola la cache dei titoli delle pagine web di una KB.")
+    parser.add_argument("kb", help="Nome completo della KB (<utente>_<kb>)")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=5)
+    args = parser.parse_args()
+    print(json.dumps(backfill_titles(args.kb, args.workers, args.timeout), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+# batch_qa.py
+
+"""
+Domande in batch su una knowledge base, senza interfaccia.
+
+Legge le domande da un file JSONL (`{"id": ..., "question": ...}`, con
+`expertise_level` opzionale) o CSV (colonne `id`, `question` e, opzionale,
+`expertise_level`), calcola gli embedding di tutte le domande a blocchi con
+una sola passata del modello, poi genera le risposte in parallelo passando
+dal router dei modelli, entro gli slot di concorrenza del backend.
+
+Ogni risposta viene aggiunta subito al file di output JSONL con riferimenti,
+backend usato, tempi delle fasi, token e costo stimato: se l'esecuzione si
+interrompe, rilanciando lo stesso comando le domande già completate vengono
+saltate (quelle terminate con errore vengono ritentate).
+
+Uso:
+    python -m tools.batch_qa <utente>_<kb> domande.jsonl risposte.jsonl [--model stub] [--workers 4]
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from core.database import kb_storage_path
+from core.embeddings import PrecomputedEmbeddings, get_embedding_function
+from core.model_router import ModelRouter, get_model_router, stub_backend
+from core.query_metrics import STAGES, QueryTrace, activate_trace
+from core.vector_store import open_vector_store
+from utils.stats import summarize
+
+MAX_DEFAULT_WORKERS = 16
+
+
+def load_questions(path):
+    """
+    Legge le domande da JSONL o CSV (riconosciuto dall'estensione).
+
+    Returns:
+    - list of dict: {"id", "question", "expertise_level"}; l'id di default è il numero di riga.
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    questions = []
+    for number, row in enumerate(rows, start=1):
+        question = (row.get("question") or "").strip()
+        if not question:
+            continue
+        questions.append({
+            "id": str(row.get("id") or number),
+            "question": question,
+            "expertise_level": row.get("expertise_level") or None,
+        })
+    return questions
+
+
+def completed_ids(output_path):
+    """Id delle domande già presenti nell'output senza errore (per la ripresa)."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # ultima riga troncata da un'interruzione
+            if not record.get("error"):
+                done.add(str(record["id"]))
+    return done
+
+
+def _ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def _answer_one(router, backend, item, vector_store, expertise_level):
+    trace = QueryTrace(user="batch", kb=os.path.basename(vector_store.path), model=backend)
+    record = {"id": item["id"], "question": item["question"]}
+    with activate_trace(trace):
+        try:
+            routed = router.answer(
+                backend, item["question"], vector_store,
+                expertise_level=item["expertise_level"] or expertise_level,
+            )
+        except Exception as e:
+            trace.completed = False
+            record.update(answer=None, references=[], backend=None, error=f"{type(e).__name__}: {e}")
+        else:
+            trace.model = routed.backend
+            record.update(
+                answer=routed.answer,
+                references=routed.references,
+                backend=routed.backend,
+                error=None,
+            )
+    metrics = trace.to_record()
+    record["timings_ms"] = {name: metrics[f"{name}_ms"] for name in STAGES if metrics[f"{name}_ms"] is not None}
+    for key in ("input_tokens", "output_tokens", "cost_usd"):
+        record[key] = metrics[key]
+    return record
+
+
+def run_batch(kb_name, input_path, output_path, model="stub", workers=None, expertise_level="expert",
+              embed_batch_size=64, fallback=True, limit=None):
+    """
+    Esegue il batch e restituisce il riepilogo.
+
+    Parameters:
+    - kb_name (str): Nome completo della KB (<utente>_<kb>).
+    - input_path (str): File delle domande (JSONL o CSV).
+    - output_path (str): File JSONL delle risposte (in aggiunta, per la ripresa).
+    - model (str): Backend del router ("cloud", "deepseek", "gemma", "stub").
+    - workers (int): Domande in parallelo; di default gli slot di concorrenza del backend.
+    - expertise_level (str): Livello di esperienza per le domande che non lo indicano.
+    - embed_batch_size (int): Domande per blocco di embedding.
+    - fallback (bool): Se False una domanda non passa ad altri modelli quando il backend è saturo o giù.
+    - limit (int): Numero massimo di domande da elaborare in questa esecuzione.
+    """
+    persist_directory = kb_storage_path(kb_name)
+    if not os.path.isdir(persist_directory):
+        raise ValueError(f"La knowledge base '{kb_name}' non esiste.")
+    # Handle privato (non quello condiviso): la sua funzione di embedding viene sostituita
+    vector_store = open_vector_store(persist_directory, get_embedding_function())
+
+    shared = get_model_router()
+    if model == "stub" and "stub" not in shared.names():
+        shared.register(stub_backend())
+    router = ModelRouter(fallback_order=shared.fallback_order if fallback else ())
+    for name in shared.names():
+        router.register(shared.get(name))  # stessi slot del router condiviso
+    backend = router.get(model)
+
+    questions = load_questions(input_path)
+    done = completed_ids(output_path)
+    pending = [item for item in questions if item["id"] not in done]
+    if limit is not None:
+        pending = pending[:limit]
+
+    # Un'unica passata di embedding per tutte le domande: i retriever ritrovano i vettori
+    # tramite `vector_store.embeddings.embed_query`
+    start = time.perf_counter()
+    embeddings = PrecomputedEmbeddings(vector_store.embeddings)
+    embeddings.precompute([item["question"] for item in pending], batch_size=embed_batch_size)
+    vector_store.embedding_function = embeddings
+    embed_s = time.perf_counter() - start
+
+    workers = workers or min(backend.slots.max_concurrency, MAX_DEFAULT_WORKERS)
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        if out.tell() and not _ends_with_newline(output_path):
+            out.write("\n")  # chiude la riga troncata da un'interruzione
+        futures = [
+            pool.submit(_answer_one, router, model, item, vector_store, expertise_level)
+            for item in pending
+        ]
+        for future in as_completed(futures):
+            record = future.result()
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            if record["error"]:
+                errors += 1
+            else:
+                latencies.append(record["timings_ms"].get("total", 0.0))
+    elapsed = time.perf_counter() - start
+    vector_store.close()
+
+    return {
+        "kb": kb_name,
+        "model": model,
+        "questions": len(questions),
+        "skipped_completed": sum(1 for item in questions if item["id"] in done),
+        "processed": len(pending),
+        "errors": errors,
+        "workers": workers,
+        "embedding_s": round(embed_s, 2),
+        "answering_s": round(elapsed, 2),
+        "questions_per_s": round(len(pending) / elapsed, 2) if elapsed and pending else None,
+        "total_ms": summarize(latencies),
+        "output": output_path,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Risponde in batch alle domande di un file su una KB.")
+    parser.add_argument("kb", help="Nome completo della KB (<utente>_<kb>)")
+    parser.add_argument("input", help="Domande in JSONL o CSV")
+    parser.add_argument("output", help="Risposte in JSONL (riprende da dove si era interrotto)")
+    parser.add_argument("--model", default="stub", help="Backend del router: cloud, deepseek, gemma, stub")
+    parser.add_argument("--workers", type=int, default=None, help="Domande in parallelo")
+    parser.add_argument("--expertise-level", choices=["beginner", "intermediate", "expert"], default="expert")
+    parser.add_argument("--embed-batch-size", type=int, default=64)
+    parser.add_argument("--no-fallback", action="store_true", help="Non usare i modelli di fallback")
+    parser.add_argument("--limit", type=int, default=None, help="Massimo di domande in questa esecuzione")
+    args = parser.parse_args()
+    report = run_batch(args.kb, args.input, args.output, args.model, args.workers, args.expertise_level,
+                       args.embed_batch_size, not args.no_fallback, args.limit)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+# benchmark_suite.py
+
+"""
+Benchmark di indicizzazione e retrieval su corpora sintetici, con risultati
+JSON confrontabili tra commit.
+
+Per ogni dimensione (`--sizes`, numero di documenti) viene generato un
+corpus deterministico di PDF, DOCX, TXT, CSV e pagine HTML (servite da un
+server HTTP locale), indicizzato in una KB nuova con `DocumentManager` e
+interrogato con il backend stub (`core.retriever_stub`: retrieval reale,
+generazione deterministica senza modelli). Gli embedding sono calcolati da
+un embedder deterministico basato su hashing delle parole, quindi i tempi
+misurano il codice dell'app e non il modello.
+
+Ogni dimensione gira in un processo separato, così le misure (in particolare il
+picco di memoria) non risentono delle dimensioni precedenti. Il report contiene,
+per dimensione: file/s e chunk/s dell'indicizzazione, picco di memoria (RSS)
+del processo, percentili p50/p95/p99 della ricerca vettoriale e della risposta
+completa, byte su disco per chunk. Il file JSON
+(default `benchmark_results/<commit>-<data>.json`) si confronta con:
+
+    python -m tools.benchmark_suite compare base.json nuovo.json [--threshold 10]
+
+che esce con codice 1 se una metrica peggiora oltre la soglia (in %).
+
+Uso:
+    python -m tools.benchmark_suite run [--sizes 20,100,500] [--formats pdf,docx,txt,csv,html]
+                                        [--backend hnsw] [--queries 200] [--output file.json]
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+from config import VECTOR_BACKEND
+from utils.stats import summarize
+
+FORMATS = ("pdf", "docx", "txt", "csv", "html")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Vocabolario ASCII (i PDF generati usano la codifica standard dei font base)
+VOCABULARY = (
+    "bilancio ricavi costi margine liquidita credito debito rating tasso interesse obbligazione "
+    "azione dividendo capitale patrimonio rischio controllo verifica procedura conto fattura "
+    "pagamento scadenza cliente fornitore contratto garanzia mutuo prestito investimento fondo "
+    "portafoglio rendimento volatilita inflazione cambio valuta bonifico riconciliazione budget "
+    "previsione trimestre esercizio revisione audit conformita normativa vigilanza segnalazione"
+).split()
+
+
+# ---- Embedder e corpus sintetici ----
+
+class HashingEmbeddings:
+    """
+    Embedder deterministico: ogni parola incrementa (con segno) una componente
+    scelta dal suo hash; il vettore viene normalizzato. Testi con parole in comune
+    hanno vettori vicini, quindi il retrieval resta significativo.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self.model_name = f"hashing-{dim}"
+
+    @functools.lru_cache(maxsize=65536)
+    def _slot(self, word):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest[:4], "little") % self.dim, 1.0 if digest[4] & 1 else -1.0
+
+    def _embed(self, text):
+        vector = [0.0] * self.dim
+        for word in text.lower().split():
+            index, sign = self._slot(word.strip(".,;:?!()\"'"))
+            vector[index] += sign
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def _sentence(rng):
+    words = [rng.choice(VOCABULARY) for _ in range(rng.randint(8, 18))]
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraphs(rng, count):
+    return [" ".join(_sentence(rng) for _ in range(rng.randint(3, 6))) for _ in range(count)]
+
+
+def _write_pdf(path, paragraphs, line_chars=90, lines_per_page=50):
+    """PDF minimale (font Helvetica, testo su più pagine) senza dipendenze esterne."""
+    lines = []
+    for paragraph in paragraphs:
+        line = ""
+        for word in paragraph.split():
+            if len(line) + len(word) + 1 > line_chars:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}".strip()
+        lines.extend([line, ""])
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in pages:
+        text = "".join(
+            "({}) Tj T*\n".format(line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)"))
+            for line in page
+        )
+        stream = f"BT /F1 10 Tf 14 TL 50 800 Td\n{text}ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    output = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(output)
+
+
+def _write_docx(path, paragraphs):
+    """DOCX minimale (solo `word/document.xml`), leggibile da docx2txt."""
+    body = "".join(f"<w:p><w:r><w:t>{escape(paragraph)}</w:t></w:r></w:p>" for paragraph in paragraphs)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr(
+            "[Content_Types].xml",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>',
+        )
+        docx.writestr(
+            "_rels/.rels",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+            'relationships/officeDocument" Target="word/document.xml"/></Relationships>',
+        )
+        docx.writestr(
+            "word/document.xml",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f"<w:body>{body}</w:body></w:document>",
+        )
+
+
+def _write_csv(path, rng, rows):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write("data,conto,descrizione,importo\n")
+        for i in range(rows):
+            f.write(f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d},{rng.randint(1000, 9999)},"
+                    f"\"{_sentence(rng)}\",{rng.uniform(-50000, 50000):.2f}\n")
+
+
+def generate_corpus(directory, size, formats=FORMATS, seed=0):
+    """
+    Genera `size` documenti deterministici (formati a rotazione) in `directory`.
+
+    Returns:
+    - dict: {"files": [percorsi locali], "pages": [nomi delle pagine HTML]}.
+    """
+    os.makedirs(directory, exist_ok=True)
+    corpus = {"files": [], "pages": []}
+    for i in range(size):
+        rng = random.Random(f"{seed}-{i}")
+        kind = formats[i % len(formats)]
+        name = f"doc_{i:05d}.{kind}"
+        path = os.path.join(directory, name)
+        paragraphs = _paragraphs(rng, rng.randint(4, 12))
+        if kind == "pdf":
+            _write_pdf(path, paragraphs)
+        elif kind == "docx":
+            _write_docx(path, paragraphs)
+        elif kind == "csv":
+            _write_csv(path, rng, rng.randint(10, 40))
+        elif kind == "html":
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"<html><head><title>Documento {i}</title></head><body>"
+                        + "".join(f"<p>{escape(paragraph)}</p>" for paragraph in paragraphs)
+                        + "</body></html>")
+            corpus["pages"].append(name)
+            continue
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n\n".join(paragraphs))
+        corpus["files"].append(path)
+    return corpus
+
+
+def _queries(count, seed=0):
+    rng = random.Random(f"queries-{seed}")
+    # Domande tutte diverse: la cache del retrieval non falsa le latenze
+    return [f"{' '.join(rng.choice(VOCABULARY) for _ in range(rng.randint(3, 7)))} {i}?" for i in range(count)]
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _serve(directory):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(_QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def peak_rss_mb():
+    """
+    Picco di memoria residente del processo (MB), None se non misurabile.
+    È il picco dall'avvio del processo: per misurare una sola dimensione va chiamata
+    in un processo dedicato (vedi `_bench_size_isolated`).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux riporta KB, macOS byte
+    return round(peak / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+
+
+# ---- Esecuzione ----
+
+def _bench_size(size, formats, backend, queries, k, seed, workdir):
+    """Indicizza e interroga il corpus di una dimensione."""
+    from core.document_manager import DocumentManager
+    from core.embeddings import get_embedding_function
+    from core.retriever_stub import query_rag_with_stub
+    from core.store_cache import directory_size
+    from core.vector_store import open_vector_store
+
+    corpus_dir = os.path.join(workdir, f"corpus_{size}")
+    corpus = generate_corpus(corpus_dir, size, formats, seed)
+    server = _serve(corpus_dir)
+    kb_dir = os.path.join(workdir, f"chroma_bench_{size}")
+    store = open_vector_store(kb_dir, get_embedding_function(), backend=backend)
+    errors = []
+    manager = DocumentManager(store, upload_dir=corpus_dir,
+                              notify=lambda level, message: errors.append(message) if level == "error" else None)
+    try:
+        start = time.perf_counter()
+        for path in corpus["files"]:
+            manager.add_local_document(path)
+        for page in corpus["pages"]:
+            manager.add_web_document(f"http://127.0.0.1:{server.server_port}/{page}", depth_level=1)
+        ingest_s = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+    chunks = store.count()
+
+    search_ms, answer_ms = [], []
+    for query in _queries(queries, seed):
+        start = time.perf_counter()
+        store.similarity_search_with_score(query, k=k)
+        search_ms.append((time.perf_counter() - start) * 1000)
+    # Domande diverse da quelle della ricerca: la risposta include anche il retrieval
+    for query in _queries(queries, seed + 1):
+        start = time.perf_counter()
+        query_rag_with_stub(query, store)
+        answer_ms.append((time.perf_counter() - start) * 1000)
+
+    store.persist()
+    store.close()
+    storage = directory_size(kb_dir)
+    documents = len(corpus["files"]) + len(corpus["pages"])
+    return {
+        "size": size,
+        "documents": documents,
+        "failed": len(errors),
+        "chunks": chunks,
+        "ingest_s": round(ingest_s, 3),
+        "files_per_s": round(documents / ingest_s, 2) if ingest_s else None,
+        "chunks_per_s": round(chunks / ingest_s, 2) if ingest_s else None,
+        "query_ms": {"search": summarize(search_ms), "answer": summarize(answer_ms)},
+        "storage_bytes": storage,
+        "bytes_per_chunk": round(storage / chunks, 1) if chunks else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "errors": errors[:5],
+    }
+
+
+def _bench_size_isolated(size, formats, backend, queries, k, dim, seed, workdir):
+    """`_bench_size` in un processo nuovo (cartella di lavoro ed embedder sintetico inclusi)."""
+    from core.embeddings import set_embedding_function
+
+    # Registro delle KB, cache e database dell'app vengono creati nella cartella di lavoro
+    os.chdir(workdir)
+    set_embedding_function(HashingEmbeddings(dim))
+    return _bench_size(size, formats, backend, queries, k, seed, workdir)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_suite(sizes=(20, 100, 500), formats=FORMATS, backend=None, queries=200, k=5, dim=384, seed=0,
+              workdir=None, keep=False):
+    """
+    Esegue il benchmark per ogni dimensione, ognuna in un processo nuovo
+    (`spawn`), e restituisce il report.
+    """
+    backend = backend or VECTOR_BACKEND
+    commit = _git_commit()
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix="ragnova_bench_"))
+    os.makedirs(workdir, exist_ok=True)
+    context = multiprocessing.get_context("spawn")
+    results = []
+    try:
+        for size in sizes:
+            with ProcessPoolExecutor(1, mp_context=context) as pool:
+                results.append(pool.submit(
+                    _bench_size_isolated, size, formats, backend, queries, k, dim, seed, workdir
+                ).result())
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "suite": "ragnova-benchmark",
+        "schema": 1,
+        "commit": commit,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"sizes": list(sizes), "formats": list(formats), "backend": backend, "queries": queries,
+                   "k": k, "embedding_dim": dim, "seed": seed},
+        "results": results,
+    }
+
+
+# ---- Confronto ----
+
+# Metrica -> True se un valore più alto è migliore
+COMPARED_METRICS = {
+    "files_per_s": True,
+    "chunks_per_s": True,
+    "query_ms.search.p50": False,
+    "query_ms.search.p95": False,
+    "query_ms.search.p99": False,
+    "query_ms.answer.p50": False,
+    "query_ms.answer.p95": False,
+    "query_ms.answer.p99": False,
+    "bytes_per_chunk": False,
+    "peak_rss_mb": False,
+}
+
+
+def _metric(result, name):
+    value = result
+    for key in name.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare_reports(base, new, threshold=10.0):
+    """
+    Variazione percentuale di ogni metrica per le dimensioni presenti in entrambi i report.
+
+    Returns:
+    - tuple: (righe del confronto, regressioni oltre `threshold`%).
+    """
+    if base["config"] != new["config"]:
+        print("Attenzione: configurazioni diverse, il confronto è indicativo.", file=sys.stderr)
+    base_results = {result["size"]: result for result in base["results"]}
+    rows, regressions = [], []
+    for result in new["results"]:
+        previous = base_results.get(result["size"])
+        if previous is None:
+            continue
+        for name, higher_is_better in COMPARED_METRICS.items():
+            before, after = _metric(previous, name), _metric(result, name)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            worse = -change if higher_is_better else change
+            row = {"size": result["size"], "metric": name, "base": before, "new": after,
+                   "change_pct": round(change, 1), "regression": worse > threshold}
+            rows.append(row)
+            if row["regression"]:
+                regressions.append(row)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark di indicizzazione e retrieval su corpora sintetici.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Esegue il benchmark e salva i risultati JSON")
+    run.add_argument("--sizes", default="20,100,500", help="Documenti per corpus, separati da virgola")
+    run.add_argument("--formats", default=",".join(FORMATS))
+    run.add_argument("--backend", choices=["chroma", "hnsw", "quantized"], help="Default: VECTOR_BACKEND")
+    run.add_argument("--queries", type=int, default=200)
+    run.add_argument("--k", type=int, default=5)
+    run.add_argument("--dim", type=int, default=384, help="Dimensione degli embedding sintetici")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--workdir", help="Cartella di lavoro (default: temporanea)")
+    run.add_argument("--keep", action="store_true", help="Conserva corpora e KB generati")
+    run.add_argument("--output", help="File dei risultati (default: benchmark_results/<commit>-<data>.json)")
+
+    compare = commands.add_parser("compare", help="Confronta due file di risultati")
+    compare.add_argument("base")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=10.0, help="Peggioramento massimo tollerato (%%)")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        with open(args.base, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.new, "r", encoding="utf-8") as f:
+            new = json.load(f)
+        rows, regressions = compare_reports(base, new, args.threshold)
+        print(json.dumps({"base": base.get("commit"), "new": new.get("commit"), "rows": rows}, indent=2))
+        if regressions:
+            print(f"{len(regressions)} metriche peggiorate oltre il {args.threshold}%.", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    formats = tuple(name.strip() for name in args.formats.split(",") if name.strip())
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        parser.error(f"formati non supportati: {', '.join(sorted(unknown))}")
+    sizes = [int(size) for size in args.sizes.split(",")]
+    report = run_suite(sizes, formats, args.backend, args.queries, args.k, args.dim, args.seed,
+                       args.workdir, args.keep)
+    output = args.output or os.path.join(
+        "benchmark_results", f"{report['commit'] or 'local'}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps({**report, "output": output}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
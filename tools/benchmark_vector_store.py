@@ -0,0 +1,133 @@
+# benchmark_vector_store.py
+
+"""
+Confronta il backend Chroma e il backend HNSW sulla stessa knowledge base.
+
+La KB Chroma viene copiata (senza ricalcolare gli embedding) in un indice
+HNSW temporaneo; le query usano come vettori gli embedding di chunk scelti a
+caso, così il confronto misura solo il vector store e non il modello di
+embedding.
+
+Viene misurato anche il costo di una scrittura: `--writes` aggiunte di
+`--write-batch` chunk (poi eliminati), su una copia temporanea anche per
+Chroma, così la KB originale non viene modificata. Per HNSW il report indica
+anche i byte del grafo copiati in una nuova generazione da ogni aggiunta.
+
+Uso:
+    python -m tools.benchmark_vector_store <utente>_<kb> [--queries 100] [--k 5] [--dtype float16]
+                                                         [--writes 5] [--write-batch 16]
+"""
+
+import argparse
+import json
+import random
+import shutil
+import tempfile
+import time
+
+from core.database import kb_storage_path
+from core.hnsw_store import HNSWVectorStore
+from core.vector_store import ChromaVectorStore, copy_vector_store
+from utils.stats import summarize
+
+
+def _timed_searches(store, vectors, k):
+    latencies, results = [], []
+    for vector in vectors:
+        start = time.perf_counter()
+        found = store.similarity_search_by_vector_with_score(vector, k=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([doc.page_content for doc, _ in found])
+    return latencies, results
+
+
+def _timed_writes(store, texts, vectors, writes, batch_size):
+    """Latenze (ms) di `writes` aggiunte di `batch_size` chunk e delle relative eliminazioni."""
+    add_ms, delete_ms = [], []
+    for i in range(writes):
+        batch = [(i * batch_size + j) % len(texts) for j in range(batch_size)]
+        start = time.perf_counter()
+        ids = store.add_embeddings([texts[j] for j in batch], [vectors[j] for j in batch])
+        add_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        store.delete(ids=ids)
+        delete_ms.append((time.perf_counter() - start) * 1000)
+    return {"add": summarize(add_ms), "delete": summarize(delete_ms)}
+
+
+def run_benchmark(kb_name, queries=100, k=5, dtype="float32", seed=0, writes=5, write_batch=16):
+    """Esegue il confronto e restituisce un dizionario con i risultati."""
+    persist_directory = kb_storage_path(kb_name)
+
+    start = time.perf_counter()
+    chroma = ChromaVectorStore(persist_directory, embedding_function=None)
+    chroma_open_ms = (time.perf_counter() - start) * 1000
+
+    target = tempfile.mkdtemp(prefix="hnsw_bench_")
+    chroma_target = tempfile.mkdtemp(prefix="chroma_bench_")
+    try:
+        start = time.perf_counter()
+        hnsw = HNSWVectorStore(target, embedding_function=None, dtype=dtype)
+        copied = copy_vector_store(chroma, hnsw)
+        build_s = time.perf_counter() - start
+        hnsw.close()
+
+        start = time.perf_counter()
+        hnsw = HNSWVectorStore(target, embedding_function=None, dtype=dtype)
+        hnsw_open_ms = (time.perf_counter() - start) * 1000
+
+        all_ids = chroma.get(include=[])["ids"]
+        sample = random.Random(seed).sample(all_ids, min(queries, len(all_ids)))
+        found = chroma.get(ids=sample, include=["documents", "embeddings"])
+        texts, vectors = found["documents"], found["embeddings"]
+
+        chroma_latencies, chroma_results = _timed_searches(chroma, vectors, k)
+        hnsw_latencies, hnsw_results = _timed_searches(hnsw, vectors, k)
+        recall = [
+            len(set(expected) & set(found)) / max(len(expected), 1)
+            for expected, found in zip(chroma_results, hnsw_results)
+        ]
+
+        write_ms = {}
+        if writes and texts:
+            write_ms["hnsw"] = _timed_writes(hnsw, texts, vectors, writes, write_batch)
+            chroma_copy = ChromaVectorStore(chroma_target, embedding_function=None)
+            copy_vector_store(chroma, chroma_copy)
+            write_ms["chroma"] = _timed_writes(chroma_copy, texts, vectors, writes, write_batch)
+            chroma_copy.close()
+        graph_copy_bytes = hnsw.graph_copy_bytes()
+        hnsw.close()
+    finally:
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.rmtree(chroma_target, ignore_errors=True)
+
+    return {
+        "kb": kb_name,
+        "chunks": copied,
+        "k": k,
+        "dtype": dtype,
+        "hnsw_build_s": build_s,
+        "open_ms": {"chroma": chroma_open_ms, "hnsw": hnsw_open_ms},
+        "query_ms": {"chroma": summarize(chroma_latencies), "hnsw": summarize(hnsw_latencies)},
+        "recall_at_k_vs_chroma": sum(recall) / len(recall) if recall else None,
+        "write_batch": write_batch,
+        "write_ms": write_ms,
+        "hnsw_graph_copy_bytes_per_add": graph_copy_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Chroma vs HNSW su una knowledge base.")
+    parser.add_argument("kb", help="Nome completo della KB (<utente>_<kb>)")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--writes", type=int, default=5, help="Aggiunte misurate (0 = nessuna)")
+    parser.add_argument("--write-batch", type=int, default=16, help="Chunk per aggiunta")
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.kb, args.queries, args.k, args.dtype,
+                                   writes=args.writes, write_batch=args.write_batch), indent=2))
+
+
+if __name__ == "__main__":
+    main()
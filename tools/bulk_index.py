@@ -0,0 +1,462 @@
+# bulk_index.py
+
+"""
+Indicizzazione offline in blocco di una knowledge base, ed esportazione/importazione
+delle KB per costruirle su una macchina batch e distribuirle agli host di servizio.
+
+`index` usa gli stessi loader e lo stesso semantic chunking dell'app
+(`core.document_manager.chunk_local_file` / `chunk_web_pages`): caricamento e
+chunking girano in `--workers` processi, ognuno con il proprio modello di
+embedding; il processo principale calcola gli embedding a blocchi di
+`--batch-size` chunk e li scrive nella KB. Dopo ogni scrittura le sorgenti
+completate vengono aggiunte al file di checkpoint (JSONL), quindi un'esecuzione
+interrotta riprende dalle sorgenti mancanti; i documenti già presenti nella KB
+(stesso hash del file o stesso URL) vengono comunque saltati.
+
+I file vengono copiati in `uploaded_documents/kb_<kb>` e nei metadati resta il
+percorso relativo, così la KB esportata funziona anche su un altro host.
+
+Scritture ed esportazione tengono il lock di scrittura della KB
+(`core.kb_version.kb_write_lock`): l'archivio non contiene mai una KB modificata
+a metà da un'altra scrittura. L'indice FAISS della KB non viene esportato: è
+derivato dai chunk e viene ricostruito alla prima ricerca.
+
+Uso:
+    python -m tools.bulk_index index <utente>_<kb> docs/ altri/file.pdf [--urls urls.txt] [--depth 1]
+                                     [--workers 2] [--batch-size 64] [--checkpoint file.jsonl]
+                                     [--backend hnsw] [--no-copy]
+    python -m tools.bulk_index export <utente>_<kb> kb.tar.gz
+    python -m tools.bulk_index import kb.tar.gz [--replace]
+"""
+
+import argparse
+import io
+import json
+import os
+import shutil
+import tarfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+
+from config import VECTOR_BACKEND
+from core.database import UPLOAD_PATH, kb_storage_path, kb_upload_dir
+from core.document_manager import (
+    DocumentManager, calculate_file_hash, chunk_local_file, chunk_web_pages, fetch_web_pages,
+)
+from core.embeddings import get_embedding_function
+from core.kb_registry import get_kb_registry
+from core.faiss_index import INDEX_DIR
+from core.kb_version import bump_kb_version, get_kb_version, kb_write_lock
+from core.vector_store import detect_backend, open_vector_store
+from core.web_metadata import get_title_cache
+
+MANIFEST = "manifest.json"
+
+# Stato dei processi di chunking (impostato da `_init_worker`)
+_known_hashes = set()
+_known_urls = set()
+
+
+def _init_worker(known_hashes, known_urls):
+    global _known_hashes, _known_urls
+    _known_hashes, _known_urls = known_hashes, known_urls
+    get_embedding_function()  # carica il modello una sola volta per processo
+
+
+def _chunk_source(source):
+    """Carica e suddivide in chunk una sorgente (file o URL). Eseguita nei processi di lavoro."""
+    start = time.perf_counter()
+    result = {"source": source["key"], "kind": source["kind"], "status": "ok", "chunks": 0}
+    try:
+        if source["kind"] == "file":
+            file_hash = calculate_file_hash(source["path"])
+            result["file_hash"] = file_hash
+            if file_hash in _known_hashes:
+                result["status"] = "skipped"
+                return result
+            doc_id, chunks = chunk_local_file(source["path"], file_hash, source["stored_path"],
+                                              embeddings=get_embedding_function())
+        else:
+            if source["url"] in _known_urls:
+                result["status"] = "skipped"
+                return result
+            pages = fetch_web_pages(source["url"], depth_level=source["depth"])
+            if not pages:
+                raise ValueError(f"Nessun contenuto trovato per l'URL: {source['url']}")
+            doc_id, chunks = chunk_web_pages(source["url"], pages, embeddings=get_embedding_function())
+            result["titles"] = {page["url"]: page["metadata"].get("page_title") for page in pages}
+        result.update({
+            "doc_id": doc_id,
+            "texts": [chunk.page_content for chunk in chunks],
+            "metadatas": [chunk.metadata for chunk in chunks],
+            "chunks": len(chunks),
+        })
+    except Exception as e:
+        result.update({"status": "failed", "error": str(e)})
+    finally:
+        result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def _chunk_results(sources, workers, known_hashes, known_urls):
+    """Risultati di `_chunk_source` in ordine di completamento, con al più `2 * workers` sorgenti in corso."""
+    if workers <= 1:
+        _init_worker(known_hashes, known_urls)
+        for source in sources:
+            yield _chunk_source(source)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(known_hashes, known_urls)) as pool:
+        pending = set()
+        for source in sources:
+            pending.add(pool.submit(_chunk_source, source))
+            if len(pending) >= workers * 2:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+
+def discover_sources(paths, url_file=None, depth_level=1, upload_dir=None):
+    """
+    Sorgenti da indicizzare: i file supportati nei percorsi indicati (cartelle
+    esplorate ricorsivamente) e gli URL del file `url_file` (uno per riga).
+    Con `upload_dir` il percorso salvato è quello della copia in `upload_dir`,
+    relativo alla cartella padre del percorso indicato. Un file indicato più volte
+    viene considerato una sola volta; solleva `ValueError` se due file diversi
+    verrebbero copiati nello stesso percorso (es. cartelle con lo stesso nome).
+    """
+    sources = []
+    seen = set()
+    stored_by = {}  # percorso della copia -> file di origine
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(folder, name) for folder, _, names in os.walk(path) for name in names
+            )
+        else:
+            files = [path]
+        for file_path in files:
+            if (os.path.splitext(file_path)[1].lower() not in DocumentManager.ALLOWED_EXTENSIONS
+                    or file_path in seen):
+                continue
+            seen.add(file_path)
+            relative = os.path.relpath(file_path, os.path.dirname(path))
+            stored_path = os.path.join(upload_dir, relative) if upload_dir else file_path
+            if stored_path in stored_by:
+                raise ValueError(
+                    f"I file '{stored_by[stored_path]}' e '{file_path}' verrebbero copiati "
+                    f"nello stesso percorso: {stored_path}"
+                )
+            stored_by[stored_path] = file_path
+            sources.append({
+                "key": file_path,
+                "kind": "file",
+                "path": file_path,
+                "stored_path": stored_path,
+            })
+    if url_file:
+        with open(url_file, "r", encoding="utf-8") as f:
+            for line in f:
+                url = line.strip()
+                if url and not url.startswith("#"):
+                    sources.append({"key": url, "kind": "url", "url": url, "depth": depth_level})
+    return sources
+
+
+def _read_checkpoint(path):
+    """Sorgenti già completate (indicizzate o saltate) secondo il checkpoint."""
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # riga troncata da un'interruzione
+            if entry.get("status") in ("done", "skipped"):
+                completed.add(entry["source"])
+    return completed
+
+
+def _existing_documents(store, batch_size=1000):
+    """Hash dei file e URL dei documenti già presenti nella KB."""
+    hashes, urls = set(), set()
+    offset = 0
+    while True:
+        batch = store.get(include=["metadatas"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            return hashes, urls
+        for metadata in batch["metadatas"]:
+            if metadata.get("file_hash"):
+                hashes.add(metadata["file_hash"])
+            if metadata.get("source_url"):
+                urls.add(metadata["source_url"])
+        offset += len(batch["ids"])
+
+
+def index_kb(kb_name, paths=(), url_file=None, depth_level=1, workers=2, batch_size=64,
+             checkpoint=None, backend=None, copy_files=True):
+    """Indicizza le sorgenti nella KB e restituisce il riepilogo con i tempi."""
+    persist_directory = kb_storage_path(kb_name)
+    upload_dir = kb_upload_dir(kb_name)
+    checkpoint = checkpoint or f"bulk_index_{kb_name}.jsonl"
+    if backend is None and not os.path.isdir(persist_directory):
+        backend = VECTOR_BACKEND
+
+    embedding_function = get_embedding_function()
+    store = open_vector_store(persist_directory, embedding_function, backend=backend)
+    known_hashes, known_urls = _existing_documents(store)
+    completed = _read_checkpoint(checkpoint)
+    sources = discover_sources(paths, url_file, depth_level, upload_dir if copy_files else None)
+    todo = [source for source in sources if source["key"] not in completed]
+
+    summary = {"kb": kb_name, "sources": len(sources), "resumed": len(sources) - len(todo),
+               "indexed": 0, "skipped": 0, "failed": 0, "chunks": 0}
+    timings = {"load_chunk_s": 0.0, "embed_s": 0.0, "write_s": 0.0}
+    failures = []
+    buffer = []
+
+    def log(results, log_file):
+        for result in results:
+            entry = {"source": result["source"], "status": result["status"], "chunks": result["chunks"]}
+            if result.get("doc_id"):
+                entry["doc_id"] = result["doc_id"]
+            if result.get("error"):
+                entry["error"] = result["error"]
+            log_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        log_file.flush()
+
+    def flush(log_file):
+        texts = [text for result in buffer for text in result["texts"]]
+        metadatas = [metadata for result in buffer for metadata in result["metadatas"]]
+        start = time.perf_counter()
+        vectors = []
+        for offset in range(0, len(texts), batch_size):
+            vectors.extend(embedding_function.embed_documents(texts[offset:offset + batch_size]))
+        timings["embed_s"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        with kb_write_lock(persist_directory):
+            for result in buffer:
+                source = result["source_info"]
+                if copy_files and source["kind"] == "file":
+                    os.makedirs(os.path.dirname(source["stored_path"]), exist_ok=True)
+                    shutil.copy2(source["path"], source["stored_path"])
+            if texts:
+                store.add_embeddings(texts, vectors, metadatas)
+                store.persist()
+        timings["write_s"] += time.perf_counter() - start
+
+        titles = {}
+        for result in buffer:
+            result["status"] = "done"
+            titles.update(result.get("titles") or {})
+        if titles:
+            get_title_cache().put_many(titles)
+        # Il checkpoint viene scritto solo dopo la scrittura nella KB
+        log(buffer, log_file)
+        summary["indexed"] += len(buffer)
+        summary["chunks"] += len(texts)
+        buffer.clear()
+
+    start = time.perf_counter()
+    by_key = {source["key"]: source for source in todo}
+    with open(checkpoint, "a", encoding="utf-8") as log_file:
+        for result in _chunk_results(todo, workers, known_hashes, known_urls):
+            timings["load_chunk_s"] += result.pop("seconds")
+            # Duplicati tra le sorgenti di questa stessa esecuzione
+            if result["status"] == "ok" and (result.get("file_hash") in known_hashes
+                                             or result["source"] in known_urls):
+                result["status"] = "skipped"
+            if result["status"] != "ok":
+                summary[result["status"]] += 1
+                if result["status"] == "failed":
+                    failures.append({"source": result["source"], "error": result["error"]})
+                log([result], log_file)
+                continue
+            if result["kind"] == "file":
+                known_hashes.add(result["file_hash"])
+            else:
+                known_urls.add(result["source"])
+            result["source_info"] = by_key[result["source"]]
+            buffer.append(result)
+            if sum(len(item["texts"]) for item in buffer) >= batch_size:
+                flush(log_file)
+        if buffer:
+            flush(log_file)
+    elapsed = time.perf_counter() - start
+
+    if summary["indexed"]:
+        # Nuova versione: le cache e gli handle degli altri processi vengono riallineati
+        summary["kb_version"] = bump_kb_version(persist_directory)
+        get_kb_registry().record_write(store, summary["kb_version"])
+    store.close()
+    processed = summary["indexed"] + summary["skipped"] + summary["failed"]
+    summary.update({
+        "elapsed_s": round(elapsed, 2),
+        "files_per_s": round(processed / elapsed, 2) if elapsed else None,
+        "chunks_per_s": round(summary["chunks"] / elapsed, 2) if elapsed else None,
+        **{name: round(value, 2) for name, value in timings.items()},
+        "workers": workers,
+        "checkpoint": checkpoint,
+        "failures": failures[:20],
+    })
+    return summary
+
+
+def export_kb(kb_name, archive):
+    """
+    Archivia (tar.gz) la cartella della KB e i suoi file caricati, con un manifest.
+    Il lock di scrittura della KB è tenuto per tutta l'archiviazione.
+    """
+    persist_directory = kb_storage_path(kb_name)
+    if not os.path.isdir(persist_directory):
+        raise ValueError(f"Knowledge base '{kb_name}' non trovata.")
+    upload_dir = kb_upload_dir(kb_name)
+    faiss_dir = f"{persist_directory}/{INDEX_DIR}"
+
+    def skip_temporary(member):
+        # Lock, file temporanei di scritture in corso e indice FAISS (aggiornato anche dalle ricerche)
+        if member.name.endswith((".lock", ".tmp", ".part")):
+            return None
+        if member.name == faiss_dir or member.name.startswith(faiss_dir + "/"):
+            return None
+        return member
+
+    with kb_write_lock(persist_directory):
+        store = open_vector_store(persist_directory, embedding_function=None)
+        manifest = {
+            "kb": kb_name,
+            "backend": detect_backend(persist_directory),
+            "version": get_kb_version(persist_directory),
+            "chunks": store.count(),
+            "exported_at": time.time(),
+        }
+        store.close()
+
+        with tarfile.open(archive, "w:gz") as tar:
+            data = json.dumps(manifest, indent=2).encode("utf-8")
+            info = tarfile.TarInfo(MANIFEST)
+            info.size = len(data)
+            info.mtime = int(manifest["exported_at"])
+            tar.addfile(info, io.BytesIO(data))
+            tar.add(persist_directory, arcname=persist_directory, filter=skip_temporary)
+            if os.path.isdir(upload_dir):
+                tar.add(upload_dir, arcname=f"{UPLOAD_PATH}/kb_{kb_name}", filter=skip_temporary)
+    return {**manifest, "archive": archive, "bytes": os.path.getsize(archive)}
+
+
+def import_kb(archive, replace=False):
+    """
+    Installa una KB esportata con `export_kb`. Con `replace` la KB esistente
+    viene conservata come backup; la versione importata è sempre maggiore di
+    quella sostituita, così i processi in esecuzione riaprono la KB. La sostituzione
+    avviene sotto il lock di scrittura della KB.
+    """
+    with tarfile.open(archive, "r:*") as tar:
+        manifest = json.load(tar.extractfile(MANIFEST))
+        kb_name = manifest["kb"]
+        if not kb_name or kb_name.startswith(".") or "/" in kb_name or "\\" in kb_name:
+            raise ValueError(f"Nome della knowledge base non valido: {kb_name}")
+        persist_directory = kb_storage_path(kb_name)
+        upload_dir = kb_upload_dir(kb_name)
+        prefixes = (persist_directory, f"{UPLOAD_PATH}/kb_{kb_name}")
+
+        members = []
+        for member in tar.getmembers():
+            if member.name == MANIFEST:
+                continue
+            parts = member.name.split("/")
+            if (os.path.isabs(member.name) or ".." in parts or parts[0] not in (prefixes[0], UPLOAD_PATH)
+                    or not any(member.name == prefix or member.name.startswith(prefix + "/") for prefix in prefixes)
+                    or not (member.isfile() or member.isdir())):
+                raise ValueError(f"Elemento non valido nell'archivio: {member.name}")
+            members.append(member)
+
+        if not replace and (os.path.exists(persist_directory) or os.path.exists(upload_dir)):
+            raise ValueError(f"La knowledge base '{kb_name}' esiste già (usa --replace per sostituirla).")
+
+        # Estrazione in una cartella di lavoro sullo stesso disco, poi spostamento
+        staging = f".import_{kb_name}_{int(time.time())}"
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(staging, members=members, filter="data")
+        else:
+            tar.extractall(staging, members=members)
+
+    # Le scritture in corso sulla KB finiscono prima della sostituzione, quelle successive
+    # trovano la KB importata
+    with kb_write_lock(persist_directory):
+        previous_version = get_kb_version(persist_directory)
+        backups = []
+        timestamp = int(time.time())
+        for target, backup in (
+            (persist_directory, f".{persist_directory}.bak-{timestamp}"),
+            (upload_dir, os.path.join(UPLOAD_PATH, f".kb_{kb_name}.bak-{timestamp}")),
+        ):
+            if os.path.exists(target):
+                os.rename(target, backup)
+                backups.append(backup)
+            extracted = os.path.join(staging, target)
+            if os.path.exists(extracted):
+                os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+                os.rename(extracted, target)
+        shutil.rmtree(staging)
+        version = bump_kb_version(persist_directory, minimum=previous_version)
+
+    store = open_vector_store(persist_directory, embedding_function=None)
+    chunks = store.count()
+    get_kb_registry().record_write(store, version)
+    store.close()
+    return {
+        "kb": kb_name,
+        "chunks": chunks,
+        "expected_chunks": manifest.get("chunks"),
+        "version": version,
+        "backups": backups,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indicizzazione offline ed esportazione delle knowledge base.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index = commands.add_parser("index", help="Indicizza cartelle, file e URL in una KB")
+    index.add_argument("kb", help="Nome completo della KB (<utente>_<kb>)")
+    index.add_argument("paths", nargs="*", help="Cartelle o file da indicizzare")
+    index.add_argument("--urls", help="File con un URL per riga")
+    index.add_argument("--depth", type=int, default=1, help="Profondità di esplorazione degli URL")
+    index.add_argument("--workers", type=int, default=2, help="Processi di caricamento e chunking")
+    index.add_argument("--batch-size", type=int, default=64, help="Chunk per blocco di embedding e scrittura")
+    index.add_argument("--checkpoint", help="File di checkpoint (default: bulk_index_<kb>.jsonl)")
+    index.add_argument("--backend", choices=["chroma", "hnsw", "quantized"],
+                       help="Backend delle KB nuove (default: VECTOR_BACKEND)")
+    index.add_argument("--no-copy", action="store_true",
+                       help="Non copia i file in uploaded_documents (la KB non è trasferibile)")
+
+    export = commands.add_parser("export", help="Esporta una KB in un archivio tar.gz")
+    export.add_argument("kb", help="Nome completo della KB (<utente>_<kb>)")
+    export.add_argument("archive")
+
+    install = commands.add_parser("import", help="Importa una KB esportata")
+    install.add_argument("archive")
+    install.add_argument("--replace", action="store_true",
+                         help="Sostituisce la KB esistente (che viene conservata come backup)")
+
+    args = parser.parse_args()
+    if args.command == "index":
+        if not args.paths and not args.urls:
+            parser.error("indicare almeno una cartella, un file o --urls")
+        report = index_kb(args.kb, args.paths, args.urls, args.depth, args.workers, args.batch_size,
+                          args.checkpoint, args.backend, not args.no_copy)
+    elif args.command == "export":
+        report = export_kb(args.kb, args.archive)
+    else:
+        report = import_kb(args.archive, args.replace)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# compress_kb.py
+
+"""
+Converte una knowledge base esistente (`chroma_<kb>`) nel backend compresso.
+
+Il quantizzatore viene addestrato su un campione dei vettori della KB, poi i
+chunk vengono copiati senza ricalcolare gli embedding. Al termine lo
+strumento riporta la memoria risparmiata dalle strutture di ricerca e
+l'impatto sul recall@k rispetto alla ricerca esatta.
+
+Uso:
+    python -m tools.compress_kb <utente>_<kb> --mode pq --subspaces 48 [--reduce-dim 256] [--replace]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import time
+
+import numpy as np
+
+from core.database import kb_storage_path
+from core.kb_registry import get_kb_registry
+from core.kb_version import VERSION_FILE, bump_kb_version, get_kb_version, kb_write_lock
+from core.store_cache import STORE_CACHE
+from core.vector_store import copy_vector_store, open_vector_store
+from utils.stats import summarize
+
+
+def _load_chunks(store, ids, batch_size=1000):
+    texts, vectors = [], []
+    for start in range(0, len(ids), batch_size):
+        wanted = ids[start:start + batch_size]
+        batch = store.get(ids=wanted, include=["documents", "embeddings"])
+        order = {chunk_id: i for i, chunk_id in enumerate(batch["ids"])}
+        for chunk_id in wanted:
+            texts.append(batch["documents"][order[chunk_id]])
+            vectors.append(batch["embeddings"][order[chunk_id]])
+    return texts, np.asarray(vectors, dtype="float32")
+
+
+def evaluate_recall(store, texts, vectors, queries=100, k=10, seed=0):
+    """Recall@k della ricerca compressa rispetto alla ricerca esatta (brute force)."""
+    sample = random.Random(seed).sample(range(len(vectors)), min(queries, len(vectors)))
+    recalls, latencies = [], []
+    for position in sample:
+        query = vectors[position]
+        exact = np.argsort(((vectors - query) ** 2).sum(axis=1))[:k]
+        expected = {texts[i] for i in exact}
+        start = time.perf_counter()
+        found = store.similarity_search_by_vector_with_score(query, k=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(expected & {doc.page_content for doc, _ in found}) / len(expected))
+    return sum(recalls) / len(recalls), summarize(latencies)
+
+
+def compress_kb(kb_name, mode="int8", reduce_dim=None, subspaces=16, train_size=20000,
+                queries=100, k=10, replace=False):
+    """
+    Esegue la conversione e restituisce il report.
+
+    Con `replace` la sostituzione avviene sotto il lock di scrittura della KB ed è
+    annullata (`ValueError`) se la KB è stata modificata durante la conversione.
+    """
+    source_dir = kb_storage_path(kb_name)
+    # Le cartelle di lavoro e di backup non iniziano con "chroma_", così non compaiono tra le KB
+    target_dir = f".{source_dir}.quantized"
+    if os.path.exists(target_dir):
+        shutil.rmtree(target_dir)
+
+    source_version = get_kb_version(source_dir)
+    source = open_vector_store(source_dir, embedding_function=None)
+    ids = source.get(include=[])["ids"]
+    if not ids:
+        raise ValueError(f"La knowledge base '{kb_name}' è vuota.")
+    texts, vectors = _load_chunks(source, ids)
+
+    start = time.perf_counter()
+    target = open_vector_store(target_dir, embedding_function=None, backend="quantized",
+                               compression=mode, reduce_dim=reduce_dim, subspaces=subspaces)
+    sample = vectors[random.Random(0).sample(range(len(vectors)), min(train_size, len(vectors)))]
+    target.train(sample)
+    copied = copy_vector_store(source, target)
+    convert_s = time.perf_counter() - start
+
+    recall, latencies = evaluate_recall(target, texts, vectors, queries=queries, k=k)
+    full_bytes = vectors.shape[0] * vectors.shape[1] * 4
+    compressed_bytes = target.memory_footprint()
+    target.close()
+    source.close()
+
+    if replace:
+        with kb_write_lock(source_dir):
+            if get_kb_version(source_dir) != source_version:
+                # Documenti aggiunti o eliminati dopo la lettura: finirebbero solo nel backup
+                raise ValueError(
+                    f"La knowledge base '{kb_name}' è stata modificata durante la conversione: "
+                    f"sostituzione annullata (la KB convertita è in {target_dir})."
+                )
+            backup_dir = f".{source_dir}.bak-{int(time.time())}"
+            os.rename(source_dir, backup_dir)
+            os.rename(target_dir, source_dir)
+            if os.path.exists(os.path.join(backup_dir, VERSION_FILE)):
+                shutil.copy2(os.path.join(backup_dir, VERSION_FILE), os.path.join(source_dir, VERSION_FILE))
+            # Nuova versione: cache, indice FAISS e knowledge graph vengono riallineati
+            version = bump_kb_version(source_dir)
+        STORE_CACHE.invalidate(source_dir)
+        target_dir = source_dir
+        replaced = open_vector_store(source_dir, embedding_function=None)
+        get_kb_registry().record_write(replaced, version)
+        replaced.close()
+
+    return {
+        "kb": kb_name,
+        "chunks": copied,
+        "mode": mode,
+        "reduce_dim": reduce_dim,
+        "subspaces": subspaces if mode == "pq" else None,
+        "convert_s": round(convert_s, 2),
+        "search_bytes_float32": full_bytes,
+        "search_bytes_compressed": compressed_bytes,
+        "memory_saved_bytes": full_bytes - compressed_bytes,
+        "compression_ratio": round(full_bytes / compressed_bytes, 1) if compressed_bytes else None,
+        f"recall_at_{k}": round(recall, 4),
+        "query_ms": latencies,
+        "output_dir": target_dir,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converte una KB nel backend a vettori compressi.")
+    parser.add_argument("kb", help="Nome completo della KB (<utente>_<kb>)")
+    parser.add_argument("--mode", choices=["int8", "pq"], default="int8")
+    parser.add_argument("--reduce-dim", type=int, default=None, help="Dimensione dopo PCA")
+    parser.add_argument("--subspaces", type=int, default=16, help="Sottospazi della PQ")
+    parser.add_argument("--train-size", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--replace", action="store_true",
+                        help="Sostituisce la KB originale (che viene conservata come backup)")
+    args = parser.parse_args()
+    report = compress_kb(args.kb, args.mode, args.reduce_dim, args.subspaces, args.train_size,
+                         args.queries, args.k, args.replace)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
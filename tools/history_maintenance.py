@@ -0,0 +1,59 @@
+# history_maintenance.py
+
+"""
+Retention e compattazione della cronologia delle domande (`CHAT_HISTORY_DB`).
+
+Senza opzioni usa i valori di `HISTORY_RETENTION_DAYS` e
+`HISTORY_MAX_ENTRIES` (0 = nessun limite). `--import-legacy` importa i
+vecchi `chat_log_<utente>.txt` presenti nella cartella corrente anche per
+gli utenti che non hanno ancora effettuato l'accesso.
+
+Uso:
+    python -m tools.history_maintenance [--user <utente>] [--retention-days 180]
+                                        [--max-entries 1000] [--compact] [--import-legacy]
+"""
+
+import argparse
+import glob
+import json
+import os
+
+from config import HISTORY_MAX_ENTRIES, HISTORY_RETENTION_DAYS
+from core.history_store import get_history_store
+
+
+def import_legacy_logs(store, user=None):
+    imported = {}
+    # Anche i file di importazioni rimaste a metà (`.importing-*`), che vengono riprese
+    paths = {path.split(".txt.importing-")[0] + ".txt" for path in glob.glob("chat_log_*.txt.importing-*")}
+    for path in sorted(paths.union(glob.glob("chat_log_*.txt"))):
+        name = os.path.basename(path)[len("chat_log_"):-len(".txt")]
+        if user is None or name == user:
+            imported[name] = store.import_legacy_log(name, path)
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retention e compattazione della cronologia delle domande.")
+    parser.add_argument("--user", help="Applica la retention a un solo utente")
+    parser.add_argument("--retention-days", type=float, default=HISTORY_RETENTION_DAYS)
+    parser.add_argument("--max-entries", type=int, default=HISTORY_MAX_ENTRIES)
+    parser.add_argument("--compact", action="store_true", help="Ottimizza l'indice e recupera lo spazio su disco")
+    parser.add_argument("--import-legacy", action="store_true", help="Importa i vecchi file chat_log_<utente>.txt")
+    args = parser.parse_args()
+
+    store = get_history_store()
+    summary = {}
+    if args.import_legacy:
+        summary["imported"] = import_legacy_logs(store, args.user)
+    summary["deleted"] = store.apply_retention(args.user, args.retention_days or None, args.max_entries or None)
+    if args.compact:
+        size_before = os.path.getsize(store.path)
+        store.compact()
+        summary["bytes_before"] = size_before
+        summary["bytes_after"] = os.path.getsize(store.path)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
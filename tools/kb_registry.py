@@ -0,0 +1,40 @@
+# kb_registry.py
+
+"""
+Registro delle knowledge base (`KB_REGISTRY_DB`): riallineamento con le
+cartelle su disco e statistiche per la pianificazione della capacità.
+
+Senza opzioni stampa le statistiche (KB dalla meno recentemente usata).
+`--sync` registra le KB presenti su disco e rimuove quelle eliminate;
+`--refresh` ricalcola anche vettori, byte e versione di ogni KB.
+
+Uso:
+    python -m tools.kb_registry [--sync] [--refresh] [--owner <utente>]
+"""
+
+import argparse
+import json
+
+from core.kb_registry import get_kb_registry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registro delle knowledge base.")
+    parser.add_argument("--sync", action="store_true", help="Riallinea il registro con le cartelle su disco")
+    parser.add_argument("--refresh", action="store_true", help="Ricalcola vettori, byte e versione di ogni KB")
+    parser.add_argument("--owner", help="Solo le KB di un utente")
+    args = parser.parse_args()
+
+    registry = get_kb_registry()
+    report = {}
+    if args.sync or args.refresh:
+        report["sync"] = registry.sync(refresh=args.refresh)
+    stats = registry.stats()
+    if args.owner:
+        stats["kbs"] = [kb for kb in stats["kbs"] if kb["owner"] == args.owner]
+    report.update(stats)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
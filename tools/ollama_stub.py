@@ -0,0 +1,200 @@
+# ollama_stub.py
+
+"""
+Server locale che simula l'API di generazione di Ollama.
+
+Risponde a `POST /api/generate` (con o senza streaming NDJSON) e a
+`GET /api/tags` con un testo deterministico, ricavato dal prompt, emesso a
+frammenti con un ritardo configurabile. Serve per provare lo streaming e i
+client senza un modello reale in esecuzione.
+
+Simula anche il caricamento dei modelli: la prima richiesta per un modello
+non in memoria attende `--load-delay` secondi, una richiesta senza prompt
+carica soltanto il modello, `keep_alive` ne fissa la permanenza e
+`GET /api/ps` elenca i modelli caricati.
+
+Uso:
+    python -m tools.ollama_stub [--port 11434] [--token-delay 0.02] [--tokens 40] [--load-delay 0]
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "il documento indica che la procedura prevede una verifica preliminare dei dati "
+    "seguita da un controllo incrociato con le fonti interne e da una sintesi finale"
+).split()
+
+
+DEFAULT_KEEP_ALIVE = 300.0
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_keep_alive(value):
+    """Secondi di permanenza in memoria (None = sempre) da un numero o da una durata ("30m", "1h30m")."""
+    if value is None:
+        return DEFAULT_KEEP_ALIVE
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        parts = re.findall(r"(-?[\d.]+)(ms|s|m|h)", value)
+        if not parts:
+            return DEFAULT_KEEP_ALIVE
+        seconds = sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+    return None if seconds < 0 else seconds
+
+
+def stub_answer(prompt, tokens=40):
+    """Risposta deterministica: stessa sequenza di parole per lo stesso prompt."""
+    seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+    return [WORDS[(seed >> (i % 200)) % len(WORDS)] + " " for i in range(tokens)]
+
+
+class OllamaStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    token_delay = 0.02
+    tokens = 40
+    load_delay = 0.0
+    loaded = None  # modello -> scadenza (None = sempre), condiviso dalle richieste del server
+    loaded_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass  # nessun log per richiesta
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _load_model(self, model, keep_alive):
+        """Attende il caricamento se il modello non è in memoria, poi ne aggiorna la scadenza."""
+        with self.loaded_lock:
+            expiry = self.loaded.get(model, 0)
+            resident = expiry is None or expiry > time.time()
+        if not resident and self.load_delay:
+            time.sleep(self.load_delay)
+        seconds = parse_keep_alive(keep_alive)
+        with self.loaded_lock:
+            if seconds == 0:
+                self.loaded.pop(model, None)
+            else:
+                self.loaded[model] = None if seconds is None else time.time() + seconds
+
+    def _running_models(self):
+        now = time.time()
+        with self.loaded_lock:
+            return [
+                {
+                    "name": model,
+                    "model": model,
+                    "size_vram": 0,
+                    "expires_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(expiry or now + 10 ** 8)),
+                }
+                for model, expiry in self.loaded.items()
+                if expiry is None or expiry > now
+            ]
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": "stub:latest"}]})
+        elif self.path == "/api/ps":
+            self._send_json(200, {"models": self._running_models()})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        prompt = request.get("prompt", "")
+        model = request.get("model", "stub")
+        start = time.perf_counter_ns()
+        self._load_model(model, request.get("keep_alive"))
+        if not prompt:
+            # Richiesta di solo caricamento (o scaricamento con keep_alive 0)
+            self._send_json(200, {"model": model, "response": "", "done": True, "done_reason": "load"})
+            return
+        pieces = stub_answer(prompt, self.tokens)
+        final = {
+            "model": model,
+            "done": True,
+            "prompt_eval_count": len(prompt.split()),
+            "eval_count": len(pieces),
+        }
+
+        if not request.get("stream", True):
+            time.sleep(self.token_delay * len(pieces))
+            final["response"] = "".join(pieces).strip()
+            final["total_duration"] = time.perf_counter_ns() - start
+            self._send_json(200, final)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for piece in pieces:
+            time.sleep(self.token_delay)
+            self._write_chunk({"model": final["model"], "response": piece, "done": False})
+        final["response"] = ""
+        final["total_duration"] = time.perf_counter_ns() - start
+        self._write_chunk(final)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data):
+        line = (json.dumps(data) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+        self.wfile.flush()
+
+
+def _handler_class(token_delay, tokens, load_delay):
+    return type("ConfiguredHandler", (OllamaStubHandler,), {
+        "token_delay": token_delay,
+        "tokens": tokens,
+        "load_delay": load_delay,
+        "loaded": {},
+        "loaded_lock": threading.Lock(),
+    })
+
+
+def start_stub_server(port=0, token_delay=0.02, tokens=40, load_delay=0.0):
+    """
+    Avvia il server in un thread in background.
+
+    Returns:
+    - (ThreadingHTTPServer, str): Il server (da chiudere con `shutdown()`) e il suo URL base.
+    """
+    handler = _handler_class(token_delay, tokens, load_delay)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server stub dell'API di generazione di Ollama.")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Secondi tra un frammento e l'altro")
+    parser.add_argument("--tokens", type=int, default=40, help="Frammenti per risposta")
+    parser.add_argument("--load-delay", type=float, default=0.0, help="Secondi di caricamento di un modello")
+    args = parser.parse_args()
+    handler = _handler_class(args.token_delay, args.tokens, args.load_delay)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), handler)
+    print(f"Stub Ollama in ascolto su http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# startup_profile.py
+
+"""
+Profilo degli import all'avvio dell'app e controllo del tempo fino alla pagina di login.
+
+L'app viene eseguita in un interprete nuovo (`python -X importtime`), come un
+worker Streamlit appena avviato: lo strumento riporta il costo di import per
+modulo e per pacchetto, il tempo fino alla pagina di login e le dipendenze
+pesanti caricate prima del login, che devono restare importate solo dai
+percorsi che le usano (loader, embedding, OCR, pandas, ...).
+
+Con `--check` termina con codice 1 se il tempo supera `--budget-s` o se una
+dipendenza pesante viene importata all'avvio: è il controllo di regressione
+da eseguire prima di un rilascio.
+
+Uso:
+    python -m tools.startup_profile [--top 25] [--check] [--budget-s 3]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+# Moduli che non devono essere importati prima della pagina di login
+HEAVY_MODULES = (
+    "torch",
+    "transformers",
+    "sentence_transformers",
+    "langchain_experimental",
+    "langchain.document_loaders",
+    "langchain.embeddings",
+    "langchain.vectorstores",
+    "chromadb",
+    "pypandoc",
+    "doctr",
+    "networkx",
+    "pandas",
+    "bs4",
+)
+MARKER = "-- startup_profile: app --"
+
+# Eseguito nel processo figlio: Streamlit è già importato in un worker, quindi è escluso dal profilo
+_CHILD = """
+import json, sys, time
+import streamlit
+try:
+    from streamlit.testing.v1 import AppTest
+except ImportError:
+    AppTest = None
+sys.stderr.write({marker!r} + "\\n")
+sys.stderr.flush()
+start = time.perf_counter()
+if AppTest is not None:
+    at = AppTest.from_file({script!r}, default_timeout={timeout!r})
+    at.run()
+    login_form = any(widget.label == "Username" for widget in at.text_input)
+    exceptions = [str(exception.value) for exception in at.exception]
+else:
+    # Streamlit senza AppTest: solo il costo degli import dell'app
+    import {module}
+    login_form, exceptions = None, []
+elapsed = time.perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"elapsed_s": elapsed, "login_form": login_form, "exceptions": exceptions, "heavy": heavy}}))
+"""
+
+
+def parse_importtime(stderr):
+    """
+    Righe di `-X importtime` successive al marcatore.
+
+    Returns:
+    - list: dict con `module`, `self_ms` e `cumulative_ms`, nell'ordine di fine import.
+    """
+    records = []
+    started = False
+    for line in stderr.splitlines():
+        if line.strip() == MARKER:
+            started = True
+            continue
+        if not started or not line.startswith("import time:") or "self [us]" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        records.append({
+            "module": fields[2].strip(),
+            "self_ms": int(fields[0]) / 1000,
+            "cumulative_ms": int(fields[1]) / 1000,
+        })
+    return records
+
+
+def profile_startup(script="app.py", timeout=60):
+    """Avvia l'app in un interprete nuovo e restituisce il report di avvio."""
+    root = os.path.dirname(os.path.abspath(script))
+    code = _CHILD.format(marker=MARKER, script=os.path.abspath(script), timeout=timeout,
+                         module=os.path.splitext(os.path.basename(script))[0], heavy=HEAVY_MODULES)
+    # Nessun precaricamento dei modelli Ollama: il controllo non dipende dai server locali
+    env = {**os.environ, "OLLAMA_PRELOAD": "0",
+           "PYTHONPATH": os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")]))}
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=root, env=env, capture_output=True, text=True, timeout=timeout * 2,
+    )
+    if completed.returncode != 0 or not completed.stdout.strip():
+        raise RuntimeError(f"Avvio dell'app non riuscito:\n{completed.stderr[-4000:]}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    records = parse_importtime(completed.stderr)
+
+    packages = defaultdict(float)
+    for record in records:
+        packages[record["module"].split(".")[0]] += record["self_ms"]
+    result.update({
+        "imports": len(records),
+        "import_ms": round(sum(record["self_ms"] for record in records), 1),
+        "modules": records,
+        "packages": dict(sorted(packages.items(), key=lambda item: -item[1])),
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profilo degli import e tempo di avvio fino alla pagina di login.")
+    parser.add_argument("--script", default="app.py")
+    parser.add_argument("--top", type=int, default=25, help="Moduli e pacchetti più costosi da riportare")
+    parser.add_argument("--check", action="store_true",
+                        help="Esce con codice 1 se il tempo supera il budget o se sono importate dipendenze pesanti")
+    parser.add_argument("--budget-s", type=float, default=3.0, help="Tempo massimo fino alla pagina di login")
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    result = profile_startup(args.script, args.timeout)
+    report = {
+        "time_to_login_s": round(result["elapsed_s"], 3),
+        "login_form": result["login_form"],
+        "exceptions": result["exceptions"],
+        "imports": result["imports"],
+        "import_ms": result["import_ms"],
+        "heavy_modules": result["heavy"],
+        "top_packages_ms": {name: round(ms, 1) for name, ms in list(result["packages"].items())[:args.top]},
+        "top_modules_cumulative_ms": {
+            record["module"]: record["cumulative_ms"]
+            for record in sorted(result["modules"], key=lambda record: -record["cumulative_ms"])[:args.top]
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.check:
+        problems = []
+        if result["elapsed_s"] > args.budget_s:
+            problems.append(f"pagina di login in {result['elapsed_s']:.2f} s (budget {args.budget_s} s)")
+        if result["heavy"]:
+            problems.append(f"dipendenze pesanti importate all'avvio: {', '.join(result['heavy'])}")
+        if result["login_form"] is False or result["exceptions"]:
+            problems.append("la pagina di login non è stata mostrata")
+        if problems:
+            print("Controllo di avvio non superato: " + "; ".join(problems), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
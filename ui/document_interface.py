@@ -8,11 +8,14 @@ from core.database import load_or_create_chroma_db
 import mimetypes
 
 class DocumentInterface:
-    def __init__(self, vector_store, upload_dir="uploaded_documents"):
+    def __init__(self, vector_store, upload_dir="uploaded_documents", kb_loader=load_or_create_chroma_db,
+                 manager_factory=DocumentManager):
+        # `kb_loader` e `manager_factory` sono sostituiti in modalità client del servizio API
         self.vector_store = vector_store
+        self.kb_loader = kb_loader
         self.upload_dir_base = upload_dir  # Directory base per gli upload
         self.upload_dir = self.get_upload_dir()  # Directory specifica per la KB
-        self.doc_manager = DocumentManager(self.vector_store, self.upload_dir)
+        self.doc_manager = manager_factory(self.vector_store, self.upload_dir)
         # Crea la directory di upload se non esiste
         if not os.path.exists(self.upload_dir):
             os.makedirs(self.upload_dir)
@@ -54,13 +57,13 @@ class DocumentInterface:
         Wrapper per chiamare la funzione `add_web_document` in `DocumentManager`.
         """
         try:
-            message = self.doc_manager.add_web_document(
+            # L'esito (successo o errore) viene mostrato dal DocumentManager
+            self.doc_manager.add_web_document(
                 url,
                 chunk_size,
                 chunk_overlap,
                 depth_level=depth_level  # Passiamo il livello di profondità
             )
-            st.success(message)
         except ValueError as ve:
             st.error(f"Errore: {ve}")
         except Exception as e:
@@ -73,7 +76,7 @@ class DocumentInterface:
         username = st.session_state.get("username", "defaultuser")
         kb_name = st.session_state.get("selected_kb", "default")
         full_kb_name = f"{username}_{kb_name}"
-        self.vector_store = load_or_create_chroma_db(full_kb_name)
+        self.vector_store = self.kb_loader(full_kb_name)
         self.doc_manager.vector_store = self.vector_store
 
     def show(self):
@@ -102,7 +105,7 @@ class DocumentInterface:
                     full_kb_name = f"{username}_{new_kb_name}"
 
                     # Usa full_kb_name al posto di new_kb_name
-                    self.vector_store = load_or_create_chroma_db(full_kb_name)
+                    self.vector_store = self.kb_loader(full_kb_name)
                     self.doc_manager.vector_store = self.vector_store
 
                     self.upload_dir = self.get_upload_dir()
@@ -259,18 +262,15 @@ class DocumentInterface:
                                                 unsafe_allow_html=True)
                             else:
                                 file_path = self.doc_manager.get_document_path(doc["ID Documento"])
-                                if os.path.exists(file_path):
+                                # Link firmato all'endpoint dei file (il file viene letto solo all'apertura)
+                                file_url = self.doc_manager.get_document_url(doc["ID Documento"])
+                                if file_url:
                                     mime_type, _ = mimetypes.guess_type(file_path)
-                                    # Crea un link che apre il file in una nuova scheda se è un PDF
                                     if mime_type == "application/pdf":
-                                        # Ottieni l'URL del file se è servito tramite un server, altrimenti usa il percorso locale
-                                        # Supponiamo che i file siano accessibili tramite un URL pubblico o un endpoint specifico
-                                        # Altrimenti, Streamlit non può servire direttamente file locali per motivi di sicurezza
-                                        # Potresti dover configurare un endpoint per servire i file
-                                        st.markdown(f"[Apri {doc['Nome Documento']} in una nuova scheda]({file_path})",
+                                        st.markdown(f"[Apri {doc['Nome Documento']} in una nuova scheda]({file_url})",
                                                     unsafe_allow_html=True)
                                     else:
-                                        st.markdown(f"[Apri {doc['Nome Documento']}]({file_path})",
+                                        st.markdown(f"[Apri {doc['Nome Documento']}]({file_url})",
                                                     unsafe_allow_html=True)
                                 else:
                                     st.error("Il file non esiste.")
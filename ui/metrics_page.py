@@ -0,0 +1,163 @@
+# metrics_page.py
+
+import time
+
+import streamlit as st
+
+from core.kb_registry import get_kb_registry
+from core.model_router import get_model_router
+from core.ollama_models import backend_model_status
+from core.query_metrics import STAGES, get_metrics_store
+from core.store_cache import STORE_CACHE
+
+PERIODS = {
+    "Ultime 24 ore": 24 * 3600,
+    "Ultimi 7 giorni": 7 * 24 * 3600,
+    "Ultimi 30 giorni": 30 * 24 * 3600,
+    "Tutto": None,
+}
+STAGE_LABELS = {
+    "embedding": "Embedding",
+    "vector_search": "Ricerca vettoriale",
+    "context": "Contesto",
+    "ttft": "Primo token",
+    "generation": "Generazione",
+    "total": "Totale",
+}
+
+
+def show_metrics_page():
+    """
+    Pagina di amministrazione con le metriche delle domande: numero, token,
+    costo stimato e percentili p50/p95/p99 dei tempi di ogni fase.
+    """
+    import pandas as pd  # solo per gli amministratori: non rallenta l'avvio dell'app
+
+    st.header("📊 Metriche delle Domande")
+
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        period = st.selectbox("Periodo", list(PERIODS), index=1)
+    with col2:
+        group_by = st.multiselect(
+            "Raggruppa per", ["user", "kb", "model"], default=["user", "kb", "model"],
+            format_func={"user": "Utente", "kb": "Knowledge Base", "model": "Modello"}.get
+        )
+
+    seconds = PERIODS[period]
+    since = time.time() - seconds if seconds else None
+    rows = get_metrics_store().aggregate(group_by=tuple(group_by), since=since)
+    if not rows:
+        st.info("Nessuna domanda registrata nel periodo selezionato.")
+    else:
+        totals = {
+            "queries": sum(row["queries"] for row in rows),
+            "tokens": sum(row["input_tokens"] + row["output_tokens"] for row in rows),
+            "cost": sum(row["cost_usd"] for row in rows),
+        }
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Domande", totals["queries"])
+        c2.metric("Token", f"{totals['tokens']:,}".replace(",", "."))
+        c3.metric("Costo stimato", f"$ {totals['cost']:.4f}")
+
+        stage = st.selectbox("Fase", list(STAGES), index=len(STAGES) - 1, format_func=STAGE_LABELS.get)
+        table = pd.DataFrame([
+            {
+                **{column: row[column] for column in group_by},
+                "Domande": row["queries"],
+                "Token input": row["input_tokens"],
+                "Token output": row["output_tokens"],
+                "Token da cache": row["cache_read_tokens"],
+                "Costo ($)": round(row["cost_usd"], 4),
+                "p50 (ms)": _round(row[f"{stage}_p50_ms"]),
+                "p95 (ms)": _round(row[f"{stage}_p95_ms"]),
+                "p99 (ms)": _round(row[f"{stage}_p99_ms"]),
+            }
+            for row in rows
+        ])
+        st.dataframe(table, use_container_width=True, hide_index=True)
+
+    st.subheader("Stato dei Modelli")
+    status = get_model_router().status()
+    st.dataframe(
+        pd.DataFrame([
+            {
+                "Modello": info["label"],
+                "In corso": info["active"],
+                "In coda": info["waiting"],
+                "Slot": info["max_concurrency"],
+                "Disponibile": "✅" if info["available"] else "⛔",
+                "In memoria": _loaded_label(backend_model_status(name)),
+            }
+            for name, info in status.items()
+        ]),
+        use_container_width=True,
+        hide_index=True,
+    )
+
+    st.subheader("Knowledge Base in Memoria")
+    _show_store_cache()
+
+    st.subheader("Knowledge Base Registrate")
+    _show_kb_registry()
+
+
+def _show_store_cache():
+    import pandas as pd
+
+    stats = STORE_CACHE.stats()
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("KB in memoria", stats["entries"])
+    c2.metric("Memoria stimata", f"{stats['bytes'] / 1024 ** 2:.0f} / {stats['max_bytes'] / 1024 ** 2:.0f} MB")
+    c3.metric("Aperture", stats["opens"], help=f"Riusi dalla cache: {stats['hits']}")
+    c4.metric("Rimozioni", stats["evictions"], help=f"Invalidazioni: {stats['invalidations']}")
+    if stats["kbs"]:
+        st.dataframe(
+            pd.DataFrame([
+                {"Knowledge Base": kb["path"], "MB": round(kb["bytes"] / 1024 ** 2, 1), "Inattiva da (s)": kb["idle_s"]}
+                for kb in stats["kbs"]
+            ]),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+
+def _show_kb_registry():
+    import pandas as pd
+
+    stats = get_kb_registry().stats()
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Knowledge Base", stats["count"], help=f"Utenti: {stats['owners']}")
+    c2.metric("Vettori", stats["vectors"])
+    c3.metric("Spazio su disco", f"{stats['bytes'] / 1024 ** 2:.0f} MB")
+    if stats["kbs"]:
+        # Dalla meno recentemente usata: le prime sono le candidate all'archiviazione
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    "Utente": kb["owner"],
+                    "Knowledge Base": kb["kb"],
+                    "Backend": kb["backend"],
+                    "Vettori": kb["vectors"],
+                    "MB": round((kb["bytes"] or 0) / 1024 ** 2, 1),
+                    "Versione": kb["version"],
+                    "Ultimo accesso": time.strftime("%Y-%m-%d %H:%M", time.localtime(kb["last_access"])),
+                }
+                for kb in stats["kbs"]
+            ]),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+
+def _loaded_label(status):
+    # None: backend non locale o server Ollama non raggiungibile
+    if status is None:
+        return "—"
+    if status["loaded"]:
+        return f"✅ fino a {status['expires_at'][11:19]}" if status["expires_at"] else "✅"
+    return "⏳" if status["loading"] else "❌"
+
+
+def _round(value):
+    return round(value, 1) if value is not None else None
@@ -1,13 +1,10 @@
 # docuement_loader.py
 
-from langchain.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader, CSVLoader, WebBaseLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 import os
-import pypandoc
 from tempfile import TemporaryDirectory
 
-from langchain_experimental.text_splitter import SemanticChunker
-from langchain.embeddings import HuggingFaceEmbeddings
+# Loader, splitter, pypandoc ed embedding vengono importati nelle funzioni che li usano:
+# importarli qui rallenterebbe l'avvio dell'app (e la pagina di login) di diversi secondi.
 
 
 
@@ -20,6 +17,8 @@ def convert_doc_to_docx(file_path):
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Il file {file_path} non esiste.")
 
+    import pypandoc
+
     # Usa una directory temporanea per la conversione
     with TemporaryDirectory() as temp_dir:
         converted_path = os.path.join(temp_dir, "converted_document.docx")
@@ -38,6 +37,8 @@ def load_document(file_path_or_url):
     - file_path_or_url può essere un percorso locale o un URL.
     Restituisce None se il formato non è supportato.
     """
+    from langchain.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader, CSVLoader, WebBaseLoader
+
     # Controlla se è un URL o un file locale
     if file_path_or_url.startswith("http://") or file_path_or_url.startswith("https://"):
         # Caricamento da sito web
@@ -76,8 +77,13 @@ def load_document(file_path_or_url):
 
 # document_loader.py
 
-def split_text_semantic(documents, breakpoint_type="percentile", breakpoint_amount=90):
-    embeddings = HuggingFaceEmbeddings()
+def split_text_semantic(documents, breakpoint_type="percentile", breakpoint_amount=90, embeddings=None):
+    # `embeddings`: modello già caricato da riusare (es. tra i documenti di un'indicizzazione in blocco)
+    from langchain_experimental.text_splitter import SemanticChunker
+
+    if embeddings is None:
+        from langchain.embeddings import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings()
     semantic_chunker = SemanticChunker(
         embeddings=embeddings,
         breakpoint_threshold_type=breakpoint_type,
@@ -93,6 +99,8 @@ def split_text_semantic(documents, breakpoint_type="percentile", breakpoint_amou
 
 def split_text_plain(documents, chunk_size=300, chunk_overlap=100):
     """Divide i documenti in chunk più piccoli."""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap
@@ -0,0 +1,77 @@
+# file_utils.py
+
+"""
+Utility per la scrittura sicura di file condivisi tra processi.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_SUFFIX = ".lock"
+LOCK_TIMEOUT = 300.0  # secondi di attesa massima per acquisire un lock
+
+
+def _try_lock(fd):
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path, timeout=LOCK_TIMEOUT):
+    """
+    Lock inter-processo esclusivo su `path` (`flock` su POSIX, `msvcrt.locking` su Windows).
+
+    Il lock è tenuto dal sistema operativo sul descrittore aperto del file `<path>.lock`:
+    viene rilasciato automaticamente se il processo termina, quindi non esistono lock
+    orfani e un'operazione lunga non lo perde mai. Il file `.lock` resta su disco.
+    Solleva `TimeoutError` se il lock non si ottiene entro `timeout` secondi.
+    """
+    lock_path = path + LOCK_SUFFIX
+    fd = os.open(lock_path, os.O_CREAT | os.O_RDWR)
+    try:
+        deadline = time.monotonic() + timeout
+        while not _try_lock(fd):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Impossibile acquisire il lock su {path}")
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            _unlock(fd)
+    finally:
+        os.close(fd)
+
+
+def write_json_atomic(path, data):
+    """
+    Scrive un file JSON in modo atomico (scrittura su file temporaneo + `os.replace`),
+    così i lettori concorrenti non vedono mai un file parziale.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
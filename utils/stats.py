@@ -0,0 +1,30 @@
+# stats.py
+
+"""
+Funzioni statistiche di supporto per benchmark e metriche.
+"""
+
+
+def percentile(values, q):
+    """
+    Percentile `q` (0-100) con interpolazione lineare, come `numpy.percentile`.
+    Restituisce None per una lista vuota.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values):
+    """Riepilogo con conteggio, media e percentili p50/p95/p99."""
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }